@@ -1,68 +1,58 @@
 import argparse
+import collections
 import json
-import math
 import sys
 
+import lib.db_lib as dbl
+import lib.karp_rabin as kr
 import lib.openreview_db as ordb
+import lib.path_store as ps
 
 
 parser = argparse.ArgumentParser(
     description='Example for accessing OpenReview data')
 parser.add_argument('-d', '--dbfile', default="../db/or.db",
     type=str, help='path to database file')
-parser.add_argument('-p', '--pathsfile', default="characterized_paths.json",
+parser.add_argument('-p', '--pathsfile', default="characterized_paths.jsonl",
     type=str, help='path to characteristic paths file')
 
 
 def load_characteristic_paths(filename):
-  with open(filename, 'r') as f:
-    list_paths = json.loads(f.read())
-
-  characteristic_paths = []
-  for nodes, char in list_paths:
-    comments = [ordb.Comment(*node) for node in nodes]
-    characteristic_paths.append(ordb.CharacterizedPath(comments, char))
-
-  return characteristic_paths
+  """Lazy reader: iterate the paths or index into them."""
+  return ps.PathReader(filename, make_comment=ordb.Comment,
+      make_path=ordb.CharacterizedPath)
 
 WINDOW = 7
-Q = 2124749677  # Is this too big for Python int
-
-
-def myhash(tokens):
-  tok_str = "".join(tokens)
-  hash_acc = 0
-  for i, ch in enumerate(reversed(tok_str)):
-    hash_acc += math.pow(2, i) * ord(ch)
-
-  return hash_acc % Q
-
-
-def get_hashes(tokens):
-  return {i:myhash(tokens[i:i+WINDOW]) for i in range(len(tokens) - WINDOW)}
-
-
-def karp_rabin(tokens_1, tokens_2):
-  hashes_1 = get_hashes(tokens_1)
-  hashes_2 = get_hashes(tokens_2)
-  results = []
-  for k1, v1 in hashes_1.items():
-    for k2, v2 in hashes_2.items():
-      if v1 == v2:
-        results.append((k1, k2))
-  return sorted(results)
 
 
 def check_exact_match(parent_chunks, child_chunks):
+  """Map chunks that share a WINDOW-token run, hashing every chunk once.
+
+  Parent chunks go into one shared index and each child chunk is joined
+  against it. lcs_map[(i, j)] is the first shared window of child chunk i
+  with parent chunk j.
+  """
   child_chunks_mapped = {i:None for i in range(len(child_chunks))}
   parent_chunks_mapped = {i:None for i in range(len(parent_chunks))}
   lcs_map ={}
-  for i, child_chunk in enumerate(child_chunks):
-    for j, parent_chunk in enumerate(parent_chunks):
-      x = karp_rabin(sum(child_chunk, []), sum(parent_chunk, []))
-      if x:
-        child_chunks_mapped[i], parent_chunks_mapped[j] = j, i
-        lcs_map[(i,j)] = child_chunk[x[0][0]:x[0][0]+WINDOW] 
+  vocab = {}
+  parent_ids = [kr.token_ids(tokens, vocab)
+      for tokens in kr.flatten_chunks(parent_chunks)]
+  index = collections.defaultdict(list)
+  for j, ids in enumerate(parent_ids):
+    kr.build_index(kr.rolling_hashes(ids, WINDOW), index, key=j)
+  for i, child_tokens in enumerate(kr.flatten_chunks(child_chunks)):
+    ids = kr.token_ids(child_tokens, vocab)
+    first_offsets = {}
+    for offset, hash_value in enumerate(kr.rolling_hashes(ids, WINDOW)):
+      for j, parent_offset in index.get(hash_value, ()):
+        if j not in first_offsets and kr.same_window(ids, offset,
+            parent_ids[j], parent_offset, WINDOW):
+          first_offsets[j] = offset
+    for j in sorted(first_offsets):
+      child_chunks_mapped[i], parent_chunks_mapped[j] = j, i
+      offset = first_offsets[j]
+      lcs_map[(i,j)] = child_tokens[offset:offset + WINDOW]
   assert len(parent_chunks) == len(parent_chunks_mapped)
   assert len(child_chunks) == len(child_chunks_mapped)
 
@@ -74,7 +64,7 @@ def get_url(comment):
       comment.forum_id, comment.comment_id)
 
 def flatten(chunk):
-  return " ".join(sum(chunk, []))
+  return " ".join(token for sentence in chunk for token in sentence)
 
 
 def main():
@@ -85,9 +75,10 @@ def main():
 
   conn = ordb.create_connection(args.dbfile)
   cur = conn.cursor()
-  cur.execute("SELECT * FROM text WHERE split=?", ("train",))
-  rows = cur.fetchall()
-  text_data = ordb.crunch_text_rows(rows)
+  wanted = set(comment.comment_id for path in characteristic_paths
+      for comment in path.comments[1:3])
+  text_data = {comment_id: chunks for comment_id, chunks
+      in dbl.iter_comments(cur, "text", "train") if comment_id in wanted}
 
   with open('temp.txt', 'wb') as f:
     for path in characteristic_paths:
@@ -104,7 +95,7 @@ def main():
             continue
           maybe_lcs = lcs_map[(rebuttal_match_chunk_id, review_chunk_id)]
           if maybe_lcs:
-            lcs = " ".join(maybe_lcs[0]).encode("utf-8")
+            lcs = " ".join(maybe_lcs).encode("utf-8")
             f.write("*" * 80 + "\n" + lcs + "\n")
           f.write(str((review_chunk_id, rebuttal_match_chunk_id)) + "\n")
           review_chunk = flatten(review[review_chunk_id])
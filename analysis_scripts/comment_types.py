@@ -17,9 +17,9 @@ def prune_unofficial(parents, comment_map):
 
   official_children = collections.defaultdict(list)
 
-  queue = ["None"]
+  queue = collections.deque(["None"])
   while queue:
-    curr_id = queue.pop(0)
+    curr_id = queue.popleft()
     for child in children[curr_id]:
       if is_official(comment_map[child]):
         queue.append(child)
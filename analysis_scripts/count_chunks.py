@@ -1,30 +1,53 @@
 import argparse
 import sys
 
-import openreview_db as ordb
+import lib.db_lib as dbl
+import lib.instrument as instrument
 
 
 parser = argparse.ArgumentParser(
     description='Example for accessing OpenReview data')
 parser.add_argument('-d', '--dbfile', default="db/or.db",
     type=str, help='path to database file')
+parser.add_argument('-t', '--table', default="text",
+    type=str, help='text table to count')
+parser.add_argument('-s', '--split', default="train",
+    type=str, help='split to count, or all')
+parser.add_argument('--stats', action="store_true",
+    help='print percentiles and histograms per split and comment type '
+    'instead of one line per comment')
+instrument.add_argument(parser)
+
+
+def print_statistics(stats):
+  for (split, comment_type), group in sorted(stats.items()):
+    print("{0} {1}: {2} comments".format(split, comment_type, group.comments))
+    for field in dbl.LENGTH_FIELDS:
+      print("  {0} percentiles: {1}".format(field, " ".join(
+        "p{0}={1}".format(p, value)
+        for p, value in sorted(group.percentiles[field].items()))))
+      print("  {0} histogram: {1}".format(field, " ".join(
+        "{0}:{1}".format(length, count)
+        for length, count in sorted(group.histograms[field].items()))))
+    print()
 
 
 def main():
   
   args = parser.parse_args()
+  instrument.enable_from_args(args)
 
-  conn = ordb.create_connection(args.dbfile)
+  conn = dbl.create_connection(args.dbfile, profile=dbl.Profiles.READ)
   cur = conn.cursor()
-  cur.execute("SELECT * FROM text WHERE split=?", ("train",))
-  rows = cur.fetchall()
-  text_data = ordb.crunch_text_rows(rows)
+
+  split = None if args.split == "all" else args.split
+  if args.stats:
+    print_statistics(dbl.length_statistics(cur, args.table, split))
+    return
 
   print("num_chunks num_tokens")
-  for comment_id, chunks in text_data.items():
-    sentences = sum(chunks, [])
-    num_tokens = len(sum(sentences, []))
-    print(" ".join([str(len(chunks)), str(num_tokens)]))
+  for lengths in dbl.iter_comment_lengths(cur, args.table, split):
+    print(" ".join([str(lengths.num_chunks), str(lengths.num_tokens)]))
 
 
   
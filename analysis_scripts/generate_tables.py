@@ -1,20 +1,22 @@
 import argparse
-import collections
 
 import lib.db_lib as dbl
+import lib.instrument as instrument
+import lib.summary as summary
 
 parser = argparse.ArgumentParser(
         description='Load OpenReview data from a sqlite3 database.')
 parser.add_argument('-d', '--dbfile', default="../db/or.db",
         type=str, help='path to database file')
+parser.add_argument('-r', '--rebuild', action="store_true",
+        help='recompute the per-comment summary tables from the text tables')
+instrument.add_argument(parser)
 
 
-def col_counter(input_list, column_name):
-  return  collections.Counter([k[column_name] for k in input_list])
-
 def main():
 
   args = parser.parse_args()
+  instrument.enable_from_args(args)
   conn = dbl.create_connection(args.dbfile)
   if conn is None:
     print("Connection error")
@@ -26,40 +28,20 @@ def main():
 
 
   for table_name in dbl.TextTables.ALL:
+    if args.rebuild or not summary.summary_exists(cur, table_name):
+      summary.rebuild(cur, table_name)
+      conn.commit()
+    stats = summary.split_stats(cur, table_name)
     for set_split in ["train", "dev", "test"]:
-      results = {}
-
-      # Total papers
-      cur.execute(
-          ("SELECT COUNT(DISTINCT forum_id) FROM {0} WHERE "
-          "split=?").format(table_name), (set_split,))
-      x, = cur.fetchall()
-      if set(x.values()) == set([0]):
+      if set_split not in stats:
         continue
-      results["Total forums"] = x["COUNT(DISTINCT forum_id)"]
-
-      # Total comments
-      cur.execute(
-          ("SELECT COUNT(DISTINCT comment_supernote) FROM {0} WHERE "
-          "split=?").format(table_name), (set_split,))
-      x, = cur.fetchall()
-      results["Total comments"] = x["COUNT(DISTINCT comment_supernote)"]
-
-      # Comment types
-      cur.execute(
-          ("SELECT DISTINCT comment_type, comment_supernote FROM {0} WHERE "
-          "split=?").format(table_name), (set_split,))
-      x = cur.fetchall()
-      results["Comment types"] = col_counter(x, "comment_type")
-
-      # Author types
-      cur.execute(
-          ("SELECT DISTINCT author_type, comment_supernote FROM {0} WHERE "
-          "split=?").format(table_name), (set_split,))
-      x = cur.fetchall()
-      results["Author types"] =  col_counter(x, "author_type")
-
-      table_1[(table_name, set_split)] = results
+      split_stats = stats[set_split]
+      table_1[(table_name, set_split)] = {
+          "Total forums": split_stats.forums,
+          "Total comments": split_stats.comments,
+          "Comment types": split_stats.comment_types,
+          "Author types": split_stats.author_types,
+      }
 
   for k, v in table_1.items():
     print(k)
@@ -1,38 +1,20 @@
 import argparse
 import collections
+import itertools
 import sys
 
-import sqlite3
-from sqlite3 import Error
+import numpy as np
+
+import lib.db_lib as dbl
+
+import annotations as al
 
 parser = argparse.ArgumentParser(
     description='Calculate agreement from rd-annotator datables')
 parser.add_argument('-d', '--dbfile', default="/Users/nnayak/git_repos/rd-annotator/rdasite/db.sqlite3",
     type=str, help='path to database file')
-
-
-def dict_factory(cursor, row):
-  d = {}
-  for idx, col in enumerate(cursor.description):
-    d[col[0]] = row[idx]
-  return d
-
-
-def create_connection(db_file):
-  """ create a database connection to a SQLite database """
-  conn = None
-  try:
-    conn = sqlite3.connect(db_file)
-    conn.row_factory = dict_factory
-    return conn
-  except Error as e:
-    print(e)
-
-
-def get_agreement(annotation_list):
-    num_annotations = len(annotation_list) / 2
-    for i in range(num_annotations):
-        pass
+parser.add_argument('-b', '--resamples', default=10000, type=int,
+    help='number of bootstrap resamples for confidence intervals')
 
 
 def sort_label(label):
@@ -47,71 +29,212 @@ class MatchValues(object):
     NO_OVERLAP = "Both aligned; no overlap"
 
 
-def get_match_value(labels):
-   label_1, label_2 = sorted(labels)
-   if label_1 == label_2:
-       if label_1 == "-1":
-           return MatchValues.NOTHING_MATCH
-       else:
+def label_to_set(label):
+    if label == "-1":
+        return frozenset()
+    return frozenset(int(i) for i in label.split("|"))
+
+
+def pair_match_value(set_1, set_2):
+    """MatchValues category of two labels, as sets of review chunk indices."""
+    if set_1 == set_2:
+        if not set_1:
+            return MatchValues.NOTHING_MATCH
         return MatchValues.EXACT_MATCH
-   elif set(label_1).intersection(set(label_2)):
-       return MatchValues.PARTIAL_MATCH
-   else:
-       if label_1 == "-1" or label_2 == "-1":
-           return MatchValues.SOME_AND_NONE
-       else:
+    elif set_1 & set_2:
+        return MatchValues.PARTIAL_MATCH
+    elif not set_1 or not set_2:
+        return MatchValues.SOME_AND_NONE
+    else:
         return MatchValues.NO_OVERLAP
 
 
-def main():
-    args = parser.parse_args()
-    conn = create_connection(args.dbfile)
+def get_match_value(labels):
+    """pair_match_value of exactly two labels, e.g. ["-1", "0|2"]."""
+    label_1, label_2 = labels
+    return pair_match_value(label_to_set(label_1), label_to_set(label_2))
 
-    c = conn.cursor()
 
-    instances = c.execute(
-    ("SELECT DISTINCT review_supernote, rebuttal_supernote, annotator, label, rebuttal_chunk "
-     "FROM alignments_alignmentannotation")).fetchall()
+MATCH_VALUE_ORDER = [MatchValues.EXACT_MATCH, MatchValues.PARTIAL_MATCH,
+    MatchValues.NOTHING_MATCH, MatchValues.SOME_AND_NONE,
+    MatchValues.NO_OVERLAP]
 
-    instances = [x for x in instances if not x["annotator"].startswith("test")]
+KAPPA = "Fleiss' kappa"
+ALPHA = "Krippendorff's alpha (Jaccard distance)"
 
-    instance_by_id = collections.defaultdict(list)
-    for instance in instances:
-        instance_by_id[(instance["review_supernote"],
-        instance["rebuttal_supernote"])].append(instance)
 
-    exact_scores = []
-    partial_scores = []
-    match_types_accumulator = collections.Counter()
+def chunk_labels(instance_by_id):
+    """Lists of labels per rebuttal chunk, for chunks with two or more.
 
-    for key, instances in instance_by_id.items():
+    Chunks are ordered by pair and then chunk index. A chunk may have any
+    number of annotators; who gave which label is not used.
+    """
+    items = []
+    for key in sorted(instance_by_id):
         labels = collections.defaultdict(list)
-        #exact_accumulator = 0
-        #partial_accumulator = 0
-        for instance in instances:
-            if "test" in instance["annotator"]:
-                continue
-            elif instance["annotator"] == "TJO":
-                continue
-            labels[instance["rebuttal_chunk"]].append(instance["label"])
-        
-        for i, l in labels.items():
-            assert len(l) == 2
-            #exact, partial = get_match_value(l)
-            #exact_accumulator += exact
-            #partial_accumulator += partial
-            value = get_match_value(l)
-            if value in [2,4]:
-                print(key, i, l)
-            match_types_accumulator[get_match_value(l)] += 1
-
-        #exact_scores.append(exact_accumulator/len(labels))
-        #partial_scores.append(partial_accumulator/len(labels))
-
-    for k, v in match_types_accumulator.items():
-        print(k, v)
-    #print(sum(exact_scores)/len(exact_scores))
-    #print(sum(partial_scores)/len(partial_scores))
+        for instance in instance_by_id[key]:
+            labels[int(instance["rebuttal_chunk"])].append(instance["label"])
+        items += [labels[chunk] for chunk in sorted(labels)
+            if len(labels[chunk]) >= 2]
+    return items
+
+
+def pair_match_values(labels):
+    """Counter of pair_match_value over every pair of a chunk's labels."""
+    return collections.Counter(get_match_value(pair)
+        for pair in itertools.combinations(labels, 2))
+
+
+EncodedLabels = collections.namedtuple("EncodedLabels",
+    "values membership counts category_shares".split())
+
+
+def encode_labels(items):
+    """Encode the label lists of multiply-annotated chunks as arrays.
+
+    Every distinct label set gets a code; values[code] is the set and
+    membership[code] is a boolean row over review chunk indices.
+    counts[item, code] is how many annotators gave that set to the item, and
+    category_shares[item] is the share of the item's annotator pairs in each
+    MATCH_VALUE_ORDER category.
+    """
+    codes = {}
+    item_codes = [[codes.setdefault(label_to_set(label), len(codes))
+        for label in labels] for labels in items]
+    counts = np.zeros((len(items), len(codes)))
+    category_shares = np.zeros((len(items), len(MATCH_VALUE_ORDER)))
+    for item, (labels, label_codes) in enumerate(zip(items, item_codes)):
+        np.add.at(counts[item], label_codes, 1)
+        pairs = pair_match_values(labels)
+        for i, match_value in enumerate(MATCH_VALUE_ORDER):
+            category_shares[item, i] = pairs[match_value] / sum(pairs.values())
+
+    width = max([max(value) + 1 for value in codes if value] + [1])
+    membership = np.zeros((len(codes), width), dtype=bool)
+    for value, code in codes.items():
+        membership[code, list(value)] = True
+    values = sorted(codes, key=codes.get)
+    return EncodedLabels(values, membership, counts, category_shares)
+
+
+def label_distances(membership):
+    """Intersection sizes, set sizes and Jaccard distances between codes."""
+    counts = membership.astype(float)
+    intersections = counts @ counts.T
+    sizes = counts.sum(axis=1)
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    distances = np.zeros_like(unions)
+    nonempty = unions > 0
+    distances[nonempty] = 1 - intersections[nonempty] / unions[nonempty]
+    return intersections, sizes, distances
+
+
+def ratio(numerator, denominator):
+    """numerator / denominator, NaN where the denominator is zero."""
+    numerator, denominator = np.broadcast_arrays(numerator, denominator)
+    result = np.full(numerator.shape, np.nan)
+    defined = denominator != 0
+    result[defined] = numerator[defined] / denominator[defined]
+    return result
+
+
+def agreement_statistics(weights, encoded, distances):
+    """Statistics for each row of item weights (bootstrap counts).
+
+    Returns {name: array with one value per row of weights}. A statistic is
+    NaN where it is undefined, e.g. kappa when every label is the same.
+    """
+    counts = encoded.counts
+    num_labels = counts.sum(axis=1)
+    num_items = weights.sum(axis=1)
+    label_totals = weights @ num_labels
+    value_counts = weights @ counts
+
+    # Fleiss' kappa, with the observed agreement of each item taken over its
+    # own number of annotators.
+    item_agreement = (counts * (counts - 1)).sum(axis=1) / (
+        num_labels * (num_labels - 1))
+    observed = ratio(weights @ item_agreement, num_items)
+    value_shares = ratio(value_counts, label_totals[:, None])
+    expected = (value_shares ** 2).sum(axis=1)
+    statistics = {KAPPA: ratio(observed - expected, 1 - expected)}
+
+    # Krippendorff's alpha; every label is pairable as each item has two or
+    # more.
+    item_disagreement = ((counts @ distances) * counts).sum(axis=1) / (
+        num_labels - 1)
+    disagreement_observed = ratio(weights @ item_disagreement, label_totals)
+    disagreement_expected = ratio(((value_counts @ distances) *
+        value_counts).sum(axis=1), label_totals * (label_totals - 1))
+    statistics[ALPHA] = 1 - ratio(disagreement_observed,
+        disagreement_expected)
+
+    category_shares = ratio(weights @ encoded.category_shares,
+        num_items[:, None])
+    for i, match_value in enumerate(MATCH_VALUE_ORDER):
+        statistics[match_value] = category_shares[:, i]
+    return statistics
+
+
+def get_agreement(instance_by_id, num_resamples=10000, seed=0,
+    block_size=1000):
+    """Agreement statistics with 95% bootstrap confidence intervals.
+
+    Items (rebuttal chunks with two or more labels) are resampled with
+    replacement; each block of resamples is evaluated with a handful of
+    matrix products. Returns {name: (estimate, low, high)}, or {} if there
+    are no such items. Undefined statistics and intervals are NaN.
+    """
+    items = chunk_labels(instance_by_id)
+    if not items:
+        return {}
+    encoded = encode_labels(items)
+    _, _, distances = label_distances(encoded.membership)
+    num_items = len(items)
+
+    estimates = agreement_statistics(np.ones((1, num_items)), encoded,
+        distances)
+
+    rng = np.random.RandomState(seed)
+    samples = collections.defaultdict(list)
+    for start in range(0, num_resamples, block_size):
+        weights = rng.multinomial(num_items, np.full(num_items, 1 / num_items),
+            size=min(block_size, num_resamples - start)).astype(float)
+        for name, values in agreement_statistics(weights, encoded,
+            distances).items():
+            samples[name].append(values)
+
+    results = {}
+    for name, estimate in estimates.items():
+        values = np.concatenate(samples[name] or [np.empty(0)])
+        values = values[~np.isnan(values)]
+        low, high = (np.percentile(values, [2.5, 97.5]) if len(values)
+            else (np.nan, np.nan))
+        results[name] = (float(estimate[0]), float(low), float(high))
+    return results
+
+
+def main():
+    args = parser.parse_args()
+    conn = dbl.create_connection(args.dbfile, profile=dbl.Profiles.READ)
+
+    annotations = al.load_annotations(conn)
+    instance_by_id = annotations.by_pair
+
+    match_types_accumulator = collections.Counter()
+    for labels in chunk_labels(instance_by_id):
+        match_types_accumulator.update(pair_match_values(labels))
+
+    for match_value in MATCH_VALUE_ORDER:
+        print(match_value, match_types_accumulator[match_value])
+
+    print()
+    results = get_agreement(instance_by_id, args.resamples)
+    if not results:
+        print("No rebuttal chunk has two or more labels")
+    for name, (estimate, low, high) in results.items():
+        print("{0}\t{1:.4f}\t[{2:.4f}, {3:.4f}]".format(name, estimate, low,
+          high))
 
 
 if __name__ == "__main__":
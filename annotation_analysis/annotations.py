@@ -0,0 +1,52 @@
+import collections
+
+import lib.db_lib as dbl
+
+
+# Annotators whose labels are never used: the test accounts and TJO.
+EXCLUDED_ANNOTATORS_SQL = "annotator != 'TJO' AND instr(annotator, 'test') = 0"
+
+
+Annotations = collections.namedtuple("Annotations",
+    "pairs text rows by_chunk by_pair".split())
+
+
+def load_annotations(conn):
+    """Load everything the annotation analyses need in one pass per table.
+
+    Returns an Annotations tuple with:
+      pairs: distinct (review_supernote, rebuttal_supernote) rows
+      text: {supernote: chunks} for every comment in alignments_text
+      rows: every annotation row from non-excluded annotators, duplicates
+        included, as jaccard.py has always counted them
+      by_chunk: rows keyed by (rebuttal_supernote, int(rebuttal_chunk))
+      by_pair: distinct rows keyed by (review_supernote, rebuttal_supernote),
+        as agreement.py has always read them
+    """
+    c = conn.cursor()
+
+    pairs = c.execute(("SELECT DISTINCT review_supernote, rebuttal_supernote "
+    "FROM alignments_annotatedpair")).fetchall()
+
+    text = dbl.crunch_text_rows(c.execute(
+        ("SELECT comment_supernote, chunk_idx, sentence_idx, token "
+         "FROM alignments_text ORDER BY rowid")))
+
+    rows = c.execute(
+    ("SELECT review_supernote, rebuttal_supernote, annotator, label, "
+     "rebuttal_chunk FROM alignments_alignmentannotation WHERE "
+     + EXCLUDED_ANNOTATORS_SQL)).fetchall()
+
+    by_chunk = collections.defaultdict(list)
+    by_pair = collections.defaultdict(list)
+    seen = set()
+    for row in rows:
+        by_chunk[(row["rebuttal_supernote"], int(row["rebuttal_chunk"]))
+            ].append(row)
+        key = tuple(row.values())
+        if key not in seen:
+            seen.add(key)
+            by_pair[(row["review_supernote"], row["rebuttal_supernote"])
+                ].append(row)
+
+    return Annotations(pairs, text, rows, by_chunk, by_pair)
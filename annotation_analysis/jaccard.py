@@ -2,43 +2,23 @@ import argparse
 import collections
 import sys
 import nltk
+import numpy as np
 
 from nltk.corpus import stopwords
+from scipy import sparse
 
-import sqlite3
-from sqlite3 import Error
+import lib.db_lib as dbl
 
 import agreement
+import annotations as al
 
 parser = argparse.ArgumentParser(
     description='Calculate agreement from rd-annotator datables')
 parser.add_argument('-d', '--dbfile', default="/Users/nnayak/git_repos/rd-annotator/rdasite/db.sqlite3",
     type=str, help='path to database file')
-
-
-def dict_factory(cursor, row):
-  d = {}
-  for idx, col in enumerate(cursor.description):
-    d[col[0]] = row[idx]
-  return d
-
-
-def collapse_dict(input_dict):
-  assert sum(input_dict.keys()) + 5 > 0
-  # This is a garbage way to get an error if the keys are not ints
-  return [input_dict[i] for i in sorted(input_dict.keys())]
-
-
-
-def create_connection(db_file):
-  """ create a database connection to a SQLite database """
-  conn = None
-  try:
-    conn = sqlite3.connect(db_file)
-    conn.row_factory = dict_factory
-    return conn
-  except Error as e:
-    print(e)
+parser.add_argument('-c', '--corpus_dbfile', default=None,
+    type=str, help='if given, score every review/rebuttal pair in this '
+    'OpenReview database instead of the annotated pairs')
 
 
 STOPWORDS = set(stopwords.words('english'))
@@ -51,30 +31,6 @@ def jaccard(chunk_1_tokens, chunk_2_tokens):
     return len(tokens_1.intersection(tokens_2)) / len(tokens_1.union(tokens_2))
 
 
-def crunch_text_rows(rows):
-  """Crunch rows from text table back into a more readable format.
-  TODO(nnk): This, but in a non-horrible way
-  """
-  texts_builder = collections.defaultdict(lambda : collections.defaultdict(lambda:
-    collections.defaultdict(list)))
-
-  for row in rows:
-    supernote, chunk, sentence, token = (row["comment_supernote"],
-        row["chunk_idx"], row["sentence_idx"], row["token"])
-    texts_builder[supernote][chunk][sentence].append(token)
-
-  texts = {}
-  for supernote, chunk_dict in texts_builder.items():
-    texts[supernote] = [collapse_dict(sentence) 
-        for sentence in collapse_dict(chunk_dict)]
-
-  return texts
-
-def get_text(c, supernote):
-    rows = c.execute("SELECT * FROM alignments_text WHERE comment_supernote=?",
-            (supernote, ))
-    return crunch_text_rows(rows)
-
 def best_jaccard_match(chunk, review_chunks):
     chunk_tokens = sum(chunk, [])
     max_jaccard_index = -1
@@ -88,31 +44,120 @@ def best_jaccard_match(chunk, review_chunks):
 
     return max_jaccard_index
 
+
+def chunk_token_set(chunk):
+    return set(token.lower() for sentence in chunk for token in sentence
+        ) - STOPWORDS
+
+
+def encode_pairs(pairs):
+    """Binary CSR matrices of the rebuttal and review chunks of many pairs.
+
+    Each pair gets its own block of columns, so chunks of different pairs
+    never share a column and products between the matrices only have nonzeros
+    within a pair. Also returns the first review row of every pair.
+    """
+    rebuttal_indices, rebuttal_indptr = [], [0]
+    review_indices, review_indptr = [], [0]
+    review_starts = []
+    column_base = 0
+    for rebuttal_chunks, review_chunks in pairs:
+        vocab = {}
+        review_starts.append(len(review_indptr) - 1)
+        for chunks, indices, indptr in (
+            (rebuttal_chunks, rebuttal_indices, rebuttal_indptr),
+            (review_chunks, review_indices, review_indptr)):
+            for chunk in chunks:
+                indices.extend(sorted(
+                    column_base + vocab.setdefault(token, len(vocab))
+                    for token in chunk_token_set(chunk)))
+                indptr.append(len(indices))
+        column_base += len(vocab)
+
+    rebuttal_matrix, review_matrix = [
+        sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+          shape=(len(indptr) - 1, column_base))
+        for indices, indptr in ((rebuttal_indices, rebuttal_indptr),
+          (review_indices, review_indptr))]
+    return rebuttal_matrix, review_matrix, np.array(review_starts)
+
+
+def batch_best_jaccard_matches(pairs):
+    """best_jaccard_match for every rebuttal chunk of many pairs at once.
+
+    pairs is a list of (rebuttal_chunks, review_chunks). Returns, for each
+    pair, a list with the best review chunk index of each rebuttal chunk (-1
+    when no review chunk overlaps), identical to best_jaccard_match.
+    """
+    rebuttal_matrix, review_matrix, review_starts = encode_pairs(pairs)
+    intersections = (rebuttal_matrix @ review_matrix.T).tocoo()
+    rebuttal_sizes = np.asarray(rebuttal_matrix.sum(axis=1)).ravel()
+    review_sizes = np.asarray(review_matrix.sum(axis=1)).ravel()
+    rows, cols = intersections.row, intersections.col
+    scores = intersections.data / (
+        rebuttal_sizes[rows] + review_sizes[cols] - intersections.data)
+
+    # Best score per row, ties broken by the lowest review chunk index.
+    order = np.lexsort((cols, -scores, rows))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = rows[order][1:] != rows[order][:-1]
+    best = np.full(rebuttal_matrix.shape[0], -1)
+    best[rows[order][first]] = cols[order][first]
+
+    results = []
+    rebuttal_start = 0
+    for pair_idx, (rebuttal_chunks, _) in enumerate(pairs):
+        pair_best = best[rebuttal_start:rebuttal_start + len(rebuttal_chunks)]
+        results.append([int(i - review_starts[pair_idx]) if i >= 0 else -1
+            for i in pair_best])
+        rebuttal_start += len(rebuttal_chunks)
+    return results
+
+
+def score_corpus(corpus_dbfile):
+    """Best Jaccard matches for every pair in every split of an OR database."""
+    conn = dbl.create_connection(corpus_dbfile, profile=dbl.Profiles.READ)
+    c = conn.cursor()
+    matches = []
+    for table_name in dbl.TextTables.ALL:
+        for set_split in ["train", "dev", "test"]:
+            text = dict(dbl.iter_comments(c, table_name, set_split))
+            pairs = c.execute(
+                "SELECT * FROM {0} WHERE split=?".format(
+                    table_name + "_pairs"), (set_split,)).fetchall()
+            chunk_pairs = [(text[pair["rebuttal_supernote"]],
+                text[pair["review_supernote"]]) for pair in pairs]
+            for pair, best in zip(pairs,
+                batch_best_jaccard_matches(chunk_pairs)):
+                for i, review_chunk_idx in enumerate(best):
+                    matches.append((pair["rebuttal_supernote"], i,
+                        review_chunk_idx))
+    return matches
+
+
 def main():
     args = parser.parse_args()
-    conn = create_connection(args.dbfile)
+    if args.corpus_dbfile is not None:
+        for i in score_corpus(args.corpus_dbfile):
+            print("\t".join(str(j) for j in i))
+        return
 
-    c = conn.cursor()
+    conn = dbl.create_connection(args.dbfile, profile=dbl.Profiles.READ)
+    annotations = al.load_annotations(conn)
+
+    chunk_pairs = [(annotations.text[pair["rebuttal_supernote"]],
+        annotations.text[pair["review_supernote"]])
+        for pair in annotations.pairs]
+    best_matches = batch_best_jaccard_matches(chunk_pairs)
 
-    pairs = c.execute(("SELECT DISTINCT review_supernote, rebuttal_supernote "
-    "FROM alignments_annotatedpair;")).fetchall()
     matches = []
-    for pair in pairs:
-        review_chunks, = get_text(c, pair["review_supernote"]).values()
-        rebuttal_chunks,  = get_text(c, pair["rebuttal_supernote"]).values()
+    for pair, (rebuttal_chunks, _), best in zip(annotations.pairs,
+        chunk_pairs, best_matches):
         for i, chunk in enumerate(rebuttal_chunks):
-            human_labels = c.execute(("SELECT * FROM "
-            "alignments_alignmentannotation WHERE rebuttal_supernote=? AND "
-            "rebuttal_chunk=?"),
-            (pair["rebuttal_supernote"], i))
-            label_set = []
-            for x in human_labels:
-                if x["annotator"] == "TJO" or "test" in x["annotator"]:
-                    continue
-                else:
-                    label_set.append(x["label"])
+            label_set = [x["label"] for x in annotations.by_chunk.get(
+                (pair["rebuttal_supernote"], i), [])]
             matches.append((pair["rebuttal_supernote"], i,
-                best_jaccard_match(chunk, review_chunks),
+                best[i],
                 agreement.get_match_value(label_set), *label_set))
             
     for i in matches:
@@ -0,0 +1,218 @@
+import argparse
+import collections
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import lib.characterization as chz
+import lib.db_lib as dbl
+import lib.forum_tree as ft
+import lib.karp_rabin as kr
+import lib.path_store as ps
+import lib.synthetic as synthetic
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(
+    description='Time the analysis pipeline on synthetic corpora.')
+parser.add_argument('-n', '--scales', default="1000", type=str,
+    help='comma-separated corpus sizes in forums, e.g. 1000,10000,100000')
+parser.add_argument('-b', '--benchmarks', default=None, type=str,
+    help='comma-separated benchmark names to run (default: all)')
+parser.add_argument('-r', '--repeats', default=3, type=int,
+    help='runs per benchmark; the fastest is reported')
+parser.add_argument('-s', '--seed', default=0, type=int,
+    help='seed for the synthetic corpora')
+parser.add_argument('--db_dir', default="bench", type=str,
+    help='directory for generated databases, reused across runs')
+parser.add_argument('-o', '--output', default="bench/results.jsonl",
+    type=str, help='JSON lines file that results are appended to')
+
+
+def bench_crunch_text_rows(db_file):
+  conn = dbl.create_connection(db_file, profile=dbl.Profiles.READ)
+  cur = conn.cursor()
+  cur.execute("SELECT * FROM traindev WHERE split=? ORDER BY rowid",
+      ("train",))
+  return len(dbl.crunch_text_rows(cur.fetchall()))
+
+
+def bench_find_matches(db_file):
+  """kr.find_matches over every train pair; text is loaded untimed first."""
+  conn = dbl.create_connection(db_file, profile=dbl.Profiles.READ)
+  cur = conn.cursor()
+  text_map = dict(dbl.iter_comments(cur, "traindev", "train"))
+  cur.execute("SELECT review_supernote, rebuttal_supernote FROM "
+      "traindev_pairs WHERE split=?", ("train",))
+  maps = [({row["review_supernote"]: text_map[row["review_supernote"]]},
+    {row["rebuttal_supernote"]: text_map[row["rebuttal_supernote"]]})
+    for row in cur.fetchall()]
+  start = time.perf_counter()
+  for review_chunk_map, rebuttal_chunk_map in maps:
+    kr.find_matches(review_chunk_map, rebuttal_chunk_map)
+  return len(maps), time.perf_counter() - start
+
+
+def bench_best_jaccard_match(db_file):
+  sys.path.insert(0, os.path.join(REPO_DIR, "annotation_analysis"))
+  import annotations as al
+  import jaccard
+  conn = dbl.create_connection(db_file, profile=dbl.Profiles.READ)
+  annotations = al.load_annotations(conn)
+  start = time.perf_counter()
+  num_chunks = 0
+  for pair in annotations.pairs:
+    review_chunks = annotations.text[pair["review_supernote"]]
+    for chunk in annotations.text[pair["rebuttal_supernote"]]:
+      jaccard.best_jaccard_match(chunk, review_chunks)
+      num_chunks += 1
+  return num_chunks, time.perf_counter() - start
+
+
+# The fields of openreview_db.Comment that path characterization uses.
+Comment = collections.namedtuple("Comment",
+    "comment_id parent_id author forum_id")
+
+
+def bench_characterize_paths(db_file):
+  """What characteristic_paths.py does after loading the train structure:
+  build the forest, prune it, characterize every path and write them all.
+  """
+  conn = dbl.create_connection(db_file, profile=dbl.Profiles.READ)
+  cur = conn.cursor()
+  cur.execute("SELECT forum_id, comment_id, parent_id, author FROM structure "
+      "WHERE split=?", ("train",))
+  structure_map = collections.defaultdict(dict)
+  comment_map = {}
+  for row in cur.fetchall():
+    structure_map[row["forum_id"]][row["comment_id"]] = row["parent_id"]
+    comment_map[row["comment_id"]] = Comment(row["comment_id"],
+        row["parent_id"], row["author"], row["forum_id"])
+  with tempfile.TemporaryDirectory() as scratch:
+    start = time.perf_counter()
+    forest = ft.ForumForest(structure_map, comment_map)
+    keep = forest.prune(chz.is_official)
+    num_paths = 0
+    with ps.PathWriter(os.path.join(scratch, "paths.jsonl")) as writer:
+      for comments, label in chz.characterize_forest(forest, keep):
+        writer.write(comments, label)
+        num_paths += 1
+    return num_paths, time.perf_counter() - start
+
+
+def run_script(script, db_file, *args):
+  # Scripts that write output files run in a scratch directory.
+  with tempfile.TemporaryDirectory() as scratch:
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, script), "-d",
+      os.path.abspath(db_file)] + list(args), cwd=scratch, check=True,
+      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+# (name, function, writes). Benchmarks that write to the database run on a
+# fresh copy of the corpus each time, so the cached corpus is never modified.
+BENCHMARKS = [
+    ("crunch_text_rows", bench_crunch_text_rows, False),
+    ("kr.find_matches", bench_find_matches, False),
+    ("best_jaccard_match", bench_best_jaccard_match, False),
+    ("exact_matches.py", lambda db_file: run_script(
+      "exact_matches.py", db_file, "--bulk", "--force"), True),
+    ("characterize_paths", bench_characterize_paths, False),
+    ("generate_tables.py", lambda db_file: run_script(
+      "analysis_scripts/generate_tables.py", db_file), False),
+]
+
+
+def copy_db(db_file, copy_file):
+  """Consistent copy of db_file, including anything still in its WAL."""
+  source = sqlite3.connect("file:{0}?mode=ro".format(db_file), uri=True)
+  target = sqlite3.connect(copy_file)
+  with target:
+    source.backup(target)
+  source.close()
+  target.close()
+
+
+def time_benchmark(function, db_file, repeats, writes=False):
+  """(fastest seconds, items) over repeats.
+
+  A benchmark returns None, an item count, or (items, seconds) if it times
+  only part of its own work. With writes, every repeat runs on an untimed
+  scratch copy of db_file.
+  """
+  best, items = None, None
+  for _ in range(repeats):
+    with tempfile.TemporaryDirectory() as scratch:
+      run_file = db_file
+      if writes:
+        run_file = os.path.join(scratch, os.path.basename(db_file))
+        copy_db(db_file, run_file)
+      start = time.perf_counter()
+      result = function(run_file)
+      seconds = time.perf_counter() - start
+    if isinstance(result, tuple):
+      result, seconds = result
+    items = result
+    best = seconds if best is None else min(best, seconds)
+  return best, items
+
+
+def git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+        check=True, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL).stdout.decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def corpus(db_dir, num_forums, seed):
+  db_file = os.path.join(db_dir, "synthetic_{0}_s{1}.db".format(
+    num_forums, seed))
+  if not os.path.exists(db_file):
+    print("Generating {0}".format(db_file))
+    os.makedirs(db_dir, exist_ok=True)
+    synthetic.generate(db_file + ".tmp", num_forums, seed=seed)
+    os.replace(db_file + ".tmp", db_file)
+  return db_file
+
+
+def main():
+
+  args = parser.parse_args()
+  selected = None if args.benchmarks is None else set(
+      args.benchmarks.split(","))
+  commit = git_commit()
+  os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+
+  for num_forums in [int(scale) for scale in args.scales.split(",")]:
+    db_file = corpus(args.db_dir, num_forums, args.seed)
+    for name, function, writes in BENCHMARKS:
+      if selected is not None and name not in selected:
+        continue
+      record = {"commit": commit, "timestamp": time.time(),
+          "python": platform.python_version(), "forums": num_forums,
+          "seed": args.seed, "benchmark": name, "repeats": args.repeats}
+      try:
+        record["seconds"], record["items"] = time_benchmark(function,
+            db_file, args.repeats, writes)
+        record["status"] = "ok"
+      except subprocess.CalledProcessError as e:
+        record["status"] = "error"
+        record["error"] = e.stderr.decode(errors="replace").strip()[-500:]
+      except ImportError as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+      print("{0:>7} forums  {1:<24} {2}".format(num_forums, name,
+        "{0:.3f}s".format(record["seconds"]) if record["status"] == "ok"
+        else record["status"]))
+      with open(args.output, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,8 +1,18 @@
 import argparse
 import corenlp
+import json
+import openreview
 import sys
 import lib.openreview_lib as orl
 import lib.openreview_db as ordb
+import lib.bulk_load as bulk
+import lib.db_lib as dbl
+import lib.fetch as fetch
+import lib.instrument as instrument
+import lib.ptb_tokenizer as ptb
+import lib.schema as schema
+import lib.summary as summary
+import lib.tokenization as tok
 import sqlite3
 
 parser = argparse.ArgumentParser(
@@ -11,23 +21,100 @@ parser.add_argument('-d', '--dbfile', default="db/or.db",
     type=str, help='path to database file')
 parser.add_argument('-i', '--inputfile', default="splits/iclr19_split.json",
     type=str, help='path to database file')
-parser.add_argument('-d', '--djangoinputfile', 
+parser.add_argument('-j', '--djangoinputfile',
         default="django_input.json", type=str,
         help='path to output that will be django input')
 parser.add_argument('-s', '--debug', action="store_true",
     help='if True, truncate the example list')
+parser.add_argument('-e', '--corenlp_endpoints', default=None, type=str,
+    help='comma-separated URLs of running CoreNLP servers; if given, '
+    'tokenize through a pipelined pool instead of starting a server')
+parser.add_argument('-c', '--tokenization_cache', default="tok_cache",
+    type=str, help='directory for cached tokenizations (with endpoints)')
+parser.add_argument('-n', '--in_flight', default=8, type=int,
+    help='maximum concurrent CoreNLP requests (with endpoints)')
+parser.add_argument('-t', '--tokenizer', default="corenlp",
+    choices=["corenlp", "ptb"],
+    help='corenlp, or ptb for the in-process tokenizer (no JVM; check it '
+    'against an existing database with tokenizer_agreement.py first)')
+parser.add_argument('-w', '--workers', default=None, type=int,
+    help='processes for the ptb tokenizer (default: one per CPU)')
+parser.add_argument('-b', '--bulk', action="store_true",
+    help='batch text table inserts into large transactions and build '
+    'indexes after the load; reloading a conference replaces its forums')
+parser.add_argument('--batch_size', default=50000, type=int,
+    help='rows per executemany in bulk mode')
+parser.add_argument('--transaction_rows', default=1000000, type=int,
+    help='rows per transaction in bulk mode')
+parser.add_argument('--summary_triggers', action="store_true",
+    help='keep the per-comment summary tables current with triggers on the '
+    'text tables instead of refreshing them after ingest')
+parser.add_argument('-f', '--fetch_invitation', default=None, type=str,
+    help='submission invitation, e.g. ICLR.cc/2019/Conference/-/'
+    'Blind_Submission; if given, sync new or changed forums into the note '
+    'cache concurrently and read notes from the cache')
+parser.add_argument('--note_cache', default="note_cache", type=str,
+    help='directory of the content-addressed raw note cache')
+parser.add_argument('--baseurl', default="https://api.openreview.net",
+    type=str, help='OpenReview API URL to fetch from')
+parser.add_argument('--rate', default=10.0, type=float,
+    help='maximum OpenReview requests per second')
+parser.add_argument('--concurrency', default=16, type=int,
+    help='maximum OpenReview requests in flight')
+instrument.add_argument(parser)
 
 ANNOTATORS = "ssplit tokenize".split()
 
+METADATA_FIELDS = ("forum_id split parent_supernote comment_supernote "
+    "author").split()
+
 def create_metadata_json(conn):
     c = conn.cursor()
+    c.row_factory = None
     rows = c.execute(("SELECT DISTINCT forum_id, split, parent_supernote,"
             "comment_supernote, author FROM traindev WHERE comment_type=?"),
-            ("rebuttal",))
+            ("rebuttal",)).fetchall()
     print(len(rows))
+    return [dict(zip(METADATA_FIELDS, row)) for row in rows]
+
+def create_text_json(conn, metadata):
+    """Chunks of every rebuttal in metadata and of the comment it replies to.
+    """
+    wanted = set(row["comment_supernote"] for row in metadata) | set(
+        row["parent_supernote"] for row in metadata)
+    return {supernote: chunks for supernote, chunks
+        in dbl.iter_comments(conn.cursor(), dbl.TextTables.TRAIN_DEV)
+        if supernote in wanted}
+
+def ingest(args, corenlp_client, conn):
+  """Load the conferences in args.inputfile into conn with get_datasets."""
+  # get_datasets makes its own client unless it is given one; only pass
+  # client= when notes come from the cache or are prefetched.
+  client = None
+  if args.fetch_invitation is not None:
+    fetched, num_requests = fetch.sync_conference(args.baseurl,
+        args.fetch_invitation, args.note_cache, rate=args.rate,
+        concurrency=args.concurrency)
+    print("Fetched {0} new or changed forums in {1} requests".format(
+      len(fetched), num_requests))
+    client = fetch.CachedClient(args.note_cache,
+        make_note=openreview.Note.from_json)
+  if hasattr(corenlp_client, "prefetch"):
+    # get_datasets annotates one document at a time; tokenize each page of
+    # notes concurrently as soon as it has been read.
+    if client is None:
+      client = openreview.Client(baseurl=args.baseurl)
+    client = tok.PrefetchingClient(client, corenlp_client)
+  if client is None:
+    orl.get_datasets(args.inputfile, corenlp_client, conn,
+        debug=args.debug)
+  else:
+    orl.get_datasets(args.inputfile, corenlp_client, conn,
+        debug=args.debug, client=client)
 
 def main():
   args = parser.parse_args()
+  instrument.enable_from_args(args)
   conn = ordb.create_connection(args.dbfile)
   if conn is not None:
     ordb.create_table(conn, ordb.CREATE_COMMENTS_TABLE)
@@ -35,15 +122,61 @@ def main():
     print("Error! cannot create the database connection.")
 
 
-  conn = ordb.create_connection(args.dbfile)
-  with corenlp.CoreNLPClient(
-      annotators=ANNOTATORS, output_format='conll') as corenlp_client:
-    orl.get_datasets(
-        args.inputfile, corenlp_client, conn, debug=args.debug)
+  conn = instrument.instrument_connection(
+      ordb.create_connection(args.dbfile))
+  if args.tokenizer == "ptb":
+    corenlp_client = ptb.PTBTokenizerPool(args.workers)
+  elif args.corenlp_endpoints is not None:
+    corenlp_client = tok.TokenizerPool(args.corenlp_endpoints.split(","),
+        cache_dir=args.tokenization_cache, max_in_flight=args.in_flight)
+  else:
+    corenlp_client = corenlp.CoreNLPClient(
+      annotators=ANNOTATORS, output_format='conll')
+  restored = bulk.recover(conn)
+  if restored:
+    print("Restored indexes after an unfinished bulk load of " +
+        ", ".join(restored))
+  if args.summary_triggers:
+    cur = conn.cursor()
+    for table_name in dbl.TextTables.ALL:
+      if schema.table_exists(cur, table_name):
+        summary.install_triggers(cur, table_name)
+    conn.commit()
+  if args.bulk:
+    conn = bulk.BulkLoader(conn, batch_size=args.batch_size,
+        transaction_rows=args.transaction_rows)
+  with corenlp_client, instrument.stage("ingest"):
+    try:
+      ingest(args, corenlp_client, conn)
+    except BaseException:
+      if args.bulk:
+        # Put back the indexes and triggers the loader dropped.
+        conn.abort()
+      raise
+  if args.bulk:
+    with instrument.stage("finish bulk load"):
+      stats = conn.finish()
+    print(("Loaded {0} rows in {1:.1f}s ({2:.0f} rows/s); replaced {3} old "
+      "rows; indexes built in {4:.1f}s").format(stats.rows, stats.seconds,
+        bulk.rows_per_second(stats), stats.replaced, stats.index_seconds))
+    conn = conn.connection
+  else:
+    cur = conn.cursor()
+    for table_name in dbl.TextTables.ALL:
+      if not schema.table_exists(cur, table_name):
+        continue
+      if not args.summary_triggers:
+        summary.rebuild(cur, table_name)
+      elif not summary.summary_exists(cur, table_name):
+        # Created during this ingest, so there were no triggers yet.
+        summary.install_triggers(cur, table_name)
+    conn.commit()
 
   metadata = create_metadata_json(conn)
-  relevant_text = create_text_json(conn)
-    
+  relevant_text = create_text_json(conn, metadata)
+  with open(args.djangoinputfile, "w") as f:
+    json.dump({"metadata": metadata, "text": relevant_text}, f)
+
 
 if __name__ == "__main__":
   main()
@@ -1,16 +1,45 @@
 import argparse
+import collections
+import functools
+import hashlib
+import json
+import multiprocessing
 import sqlite3
 import sys
 
 from tqdm import tqdm
 
 import lib.db_lib as dbl
+import lib.instrument as instrument
 import lib.karp_rabin as kr
+import lib.schema as schema
+import lib.suffix_array as sfx
+
+ENGINES = {
+    "hash": kr.find_matches_multi,
+    "suffix": sfx.find_matches_multi,
+}
 
 parser = argparse.ArgumentParser(
     description='Load OpenReview data from a sqlite3 database.')
 parser.add_argument('-d', '--dbfile', default="db/or.db",
     type=str, help='path to database file')
+parser.add_argument('-e', '--engine', default="hash",
+    choices=sorted(ENGINES), help='exact match engine; suffix reports '
+    'every maximal match instead of one match per hash seed')
+parser.add_argument('--windows', default=str(kr.WINDOW), type=str,
+    help='comma-separated minimum match lengths in tokens; all are computed '
+    'in one pass and _em rows are tagged with their window_size')
+parser.add_argument('-b', '--bulk', action="store_true",
+    help='prefetch each split in one scan and batch inserts, instead of '
+    'querying and committing per pair')
+parser.add_argument('--batch_size', default=50000, type=int,
+    help='approximate number of rows per transaction in bulk mode')
+parser.add_argument('-w', '--workers', default=1, type=int,
+    help='number of matching processes; more than one implies --bulk')
+parser.add_argument('-f', '--force', action="store_true",
+    help='discard existing results and recompute every pair')
+instrument.add_argument(parser)
 
 EXACT_MATCH_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
     review_supernote text NOT NULL,
@@ -20,53 +49,278 @@ EXACT_MATCH_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
     review_token_offset text NOT NULL,
     rebuttal_token_offset text NOT NULL,
     lcs text NOT NULL,
-    split text NOT NULL)"""
+    split text NOT NULL,
+    window_size integer NOT NULL)"""
 
 FIELDS = ("review_supernote rebuttal_supernote review_chunk_idx "
           "rebuttal_chunk_idx review_token_offset rebuttal_token_offset "
-          "lcs split")
+          "lcs split window_size")
 COM_SEPARATED_EM = ", ".join(FIELDS.split())
+INSERT_EM = "INSERT INTO {0} ({1}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+# One row per pair whose results are in _em, keyed by the content hash of its
+# inputs. Written in the same transaction as the pair's _em rows.
+EXACT_MATCH_DONE_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
+    review_supernote text NOT NULL,
+    rebuttal_supernote text NOT NULL,
+    split text NOT NULL,
+    content_hash text NOT NULL,
+    PRIMARY KEY (review_supernote, rebuttal_supernote))"""
+
+PREFETCH_TEXT = """SELECT forum_id, comment_supernote, chunk_idx,
+    sentence_idx, token
+    FROM {0} WHERE comment_supernote IN (
+      SELECT review_supernote FROM {0}_pairs WHERE split=?
+      UNION SELECT rebuttal_supernote FROM {0}_pairs WHERE split=?)
+    ORDER BY rowid"""
 
-def flatten_match(match, set_split):
+def flatten_match(match, set_split, window):
   return (match.review_location.supernote, match.rebuttal_location.supernote,
       match.review_location.chunk_idx, match.rebuttal_location.chunk_idx,
       match.review_location.token_idx, match.rebuttal_location.token_idx,
-      match.lcs, set_split)
+      match.lcs, set_split, window)
+
+
+def flatten_matches(matches, set_split):
+  """_em rows for {window: matches}, ordered by window."""
+  return [flatten_match(match, set_split, window)
+      for window, window_matches in sorted(matches.items())
+      for match in window_matches]
+
+def get_pairs(cur, table_name, set_split):
+  cur.execute("SELECT * FROM {0} WHERE split=(?)".format(
+        table_name +"_pairs"), (set_split, ))
+  return cur.fetchall()
+
+
+def content_hash(review_chunk_map, rebuttal_chunk_map, engine, windows):
+  """Hash of everything a pair's results depend on."""
+  # A single window is keyed as before windows were configurable, so results
+  # already in _em_done stay valid.
+  key = [engine, windows[0] if len(windows) == 1 else windows,
+      review_chunk_map, rebuttal_chunk_map]
+  return hashlib.sha1(
+      json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def prepare_tables(cur, table_name, set_split, force):
+  cur.execute(EXACT_MATCH_TABLE.format(table_name + "_em"))
+  schema.add_em_window_column(cur, table_name)
+  schema.create_indexes(cur, table_name + "_em",
+      schema.em_table_indexes(table_name))
+  cur.execute(EXACT_MATCH_DONE_TABLE.format(table_name + "_em_done"))
+  if force:
+    cur.execute("DELETE FROM {0} WHERE split=?".format(table_name + "_em"),
+        (set_split,))
+    cur.execute("DELETE FROM {0} WHERE split=?".format(
+      table_name + "_em_done"), (set_split,))
+
+
+def get_done(cur, table_name):
+  cur.execute("SELECT * FROM {0}".format(table_name + "_em_done"))
+  return {(row["review_supernote"], row["rebuttal_supernote"]):
+      row["content_hash"] for row in cur}
+
+
+def is_done(done, row, digest):
+  return done.get(
+      (row["review_supernote"], row["rebuttal_supernote"])) == digest
+
+
+@instrument.stage("write")
+def write_results(cur, table_name, results):
+  """Replace the stored results of each pair.
+
+  results is a list of (pair row, split, content hash, flattened matches).
+  Old _em rows for these pairs (from a stale or interrupted run) are removed
+  first, at every window, so rerunning never duplicates rows.
+  """
+  pair_keys = [(row["review_supernote"], row["rebuttal_supernote"])
+      for row, _, _, _ in results]
+  # find_matches names its arguments (rebuttal, review) but is passed
+  # (review, rebuttal), so the supernote columns of _em are swapped.
+  cur.executemany(("DELETE FROM {0} WHERE rebuttal_supernote=? AND "
+    "review_supernote=?").format(table_name + "_em"), pair_keys)
+  cur.executemany(INSERT_EM.format(table_name + "_em", COM_SEPARATED_EM),
+      [match_row for _, _, _, match_rows in results
+        for match_row in match_rows])
+  cur.executemany(("INSERT OR REPLACE INTO {0} (review_supernote, "
+    "rebuttal_supernote, split, content_hash) VALUES (?, ?, ?, ?)").format(
+      table_name + "_em_done"),
+      [pair_key + (set_split, digest)
+        for pair_key, (_, set_split, digest, _) in zip(pair_keys, results)])
+  instrument.count("pairs processed", len(results))
+  instrument.count("rows inserted", sum(len(match_rows)
+    for _, _, _, match_rows in results))
+
+
+def match_per_pair(conn, table_name, set_split, pairs, find_matches, engine,
+    windows, done):
+  """Query both comments of each pair separately and commit after each."""
+  cur = conn.cursor()
+  for row in tqdm(pairs):
+    with instrument.stage("fetch"):
+      cur.execute(
+        "SELECT * FROM {0} WHERE comment_supernote=?".format(table_name),
+          (row["review_supernote"],))
+      review_chunk_map = dbl.crunch_text_rows(cur.fetchall())
+      cur.execute(
+          "SELECT * FROM {0} WHERE comment_supernote=?".format(table_name),
+          (row["rebuttal_supernote"],))
+      rebuttal_chunk_map = dbl.crunch_text_rows(cur.fetchall())
+
+    assert len(review_chunk_map) == len(rebuttal_chunk_map) == 1
+    digest = content_hash(review_chunk_map, rebuttal_chunk_map, engine,
+        windows)
+    if is_done(done, row, digest):
+      continue
+    with instrument.stage("match"):
+      matches = find_matches(review_chunk_map, rebuttal_chunk_map)
+    write_results(cur, table_name, [(row, set_split, digest,
+      flatten_matches(matches, set_split))])
+    conn.commit()
+
+
+@instrument.stage("prefetch")
+def prefetch_split_text(cur, table_name, set_split):
+  """Crunched text and forum of every comment in a split's pairs, in one scan.
+  """
+  cur.execute(PREFETCH_TEXT.format(table_name), (set_split, set_split))
+  forum_map = {}
+
+  def rows():
+    for row in cur:
+      forum_map[row["comment_supernote"]] = row["forum_id"]
+      yield row
+
+  return dbl.crunch_text_rows(rows()), forum_map
+
+
+def stale_pairs(pairs, text_map, engine, windows, done):
+  """(pair row, review map, rebuttal map, content hash) of pairs to match."""
+  stale = []
+  for row in pairs:
+    review_id, rebuttal_id = row["review_supernote"], row["rebuttal_supernote"]
+    review_chunk_map = {review_id: text_map[review_id]}
+    rebuttal_chunk_map = {rebuttal_id: text_map[rebuttal_id]}
+    digest = content_hash(review_chunk_map, rebuttal_chunk_map, engine,
+        windows)
+    if not is_done(done, row, digest):
+      stale.append((row, review_chunk_map, rebuttal_chunk_map, digest))
+  return stale
+
+
+def match_bulk(conn, table_name, set_split, pairs, find_matches, engine,
+    windows, done, batch_size):
+  """Prefetch all text for the split and insert matches in large batches.
+
+  Each batch of results is written and committed in one transaction.
+  """
+  cur = conn.cursor()
+  text_map, _ = prefetch_split_text(cur, table_name, set_split)
+  pending = []
+  pending_rows = 0
+  for row, review_chunk_map, rebuttal_chunk_map, digest in tqdm(
+      stale_pairs(pairs, text_map, engine, windows, done)):
+    with instrument.stage("match"):
+      matches = find_matches(review_chunk_map, rebuttal_chunk_map)
+    match_rows = flatten_matches(matches, set_split)
+    pending.append((row, set_split, digest, match_rows))
+    pending_rows += len(match_rows) + 1
+    if pending_rows >= batch_size:
+      write_results(cur, table_name, pending)
+      conn.commit()
+      pending = []
+      pending_rows = 0
+  write_results(cur, table_name, pending)
+  conn.commit()
+
+
+def match_shard(task):
+  """Worker: match every pair of one forum. Pairs carry their own text."""
+  find_matches, set_split, shard = task
+  results = []
+  for pair_idx, review_chunk_map, rebuttal_chunk_map in shard:
+    matches = find_matches(review_chunk_map, rebuttal_chunk_map)
+    results.append((pair_idx, flatten_matches(matches, set_split)))
+  return results
+
+
+def shard_by_forum(stale, forum_map):
+  shards = collections.OrderedDict()
+  for pair_idx, (row, review_chunk_map, rebuttal_chunk_map, _) in enumerate(
+      stale):
+    shards.setdefault(forum_map[row["review_supernote"]], []).append(
+        (pair_idx, review_chunk_map, rebuttal_chunk_map))
+  return list(shards.values())
+
+
+def match_parallel(conn, table_name, set_split, pairs, find_matches, engine,
+    windows, done, batch_size, workers):
+  """Match pairs in a process pool, sharded by forum.
+
+  Text is prefetched once in the parent and shipped with each shard, so
+  workers never touch the database. The parent is the only writer and
+  inserts results in pair order, so _em comes out identical to a serial run.
+  """
+  cur = conn.cursor()
+  text_map, forum_map = prefetch_split_text(cur, table_name, set_split)
+  stale = stale_pairs(pairs, text_map, engine, windows, done)
+  tasks = [(find_matches, set_split, shard)
+      for shard in shard_by_forum(stale, forum_map)]
+
+  finished = {}
+  next_idx = 0
+  pending = []
+  pending_rows = 0
+  # Matching runs in the workers; this stage is the parent waiting on them.
+  with multiprocessing.Pool(workers) as pool, instrument.stage("match"):
+    for results in tqdm(pool.imap_unordered(match_shard, tasks),
+        total=len(tasks)):
+      finished.update(results)
+      while next_idx in finished:
+        row, _, _, digest = stale[next_idx]
+        match_rows = finished.pop(next_idx)
+        pending.append((row, set_split, digest, match_rows))
+        pending_rows += len(match_rows) + 1
+        next_idx += 1
+      if pending_rows >= batch_size:
+        write_results(cur, table_name, pending)
+        conn.commit()
+        pending = []
+        pending_rows = 0
+  assert not finished
+  write_results(cur, table_name, pending)
+  conn.commit()
+
 
 def main():
 
   args = parser.parse_args()
-  conn = dbl.create_connection(args.dbfile)
+  instrument.enable_from_args(args)
+  windows = sorted(set(int(window) for window in args.windows.split(",")))
+  # Every window is matched in one pass; find_matches returns {window: matches}.
+  find_matches = functools.partial(ENGINES[args.engine], windows=windows)
+  conn = dbl.create_connection(args.dbfile, profile=dbl.Profiles.DEFAULT)
   if conn is not None:
     cur = conn.cursor()
 
     for set_split in ["train", "dev", "test"]:
       for table_name in dbl.TextTables.ALL:
-        cur.execute(EXACT_MATCH_TABLE.format(table_name + "_em"))
+        prepare_tables(cur, table_name, set_split, args.force)
+        conn.commit()
+        done = get_done(cur, table_name)
         print(set_split)
-        cur.execute("SELECT * FROM {0} WHERE split=(?)".format(
-              table_name +"_pairs"), (set_split, ))
-        rows = cur.fetchall()
-        for row in tqdm(rows):
-          cur.execute(
-            "SELECT * FROM {0} WHERE comment_supernote=?".format(table_name),
-              (row["review_supernote"],))
-          review_chunk_map = dbl.crunch_text_rows(cur.fetchall())
-          cur.execute(
-              "SELECT * FROM {0} WHERE comment_supernote=?".format(table_name),
-              (row["rebuttal_supernote"],))
-          rebuttal_chunk_map = dbl.crunch_text_rows(cur.fetchall())
-
-
-          assert len(review_chunk_map) == len(rebuttal_chunk_map) == 1
-          matches = kr.find_matches(review_chunk_map, rebuttal_chunk_map)
-          for match in matches:
-            cur.execute(
-                "INSERT INTO {0} ({1}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)".format(
-                  table_name + "_em", COM_SEPARATED_EM), flatten_match(match,
-                    set_split))
-          conn.commit()
-
+        pairs = get_pairs(cur, table_name, set_split)
+        if args.workers > 1:
+          match_parallel(conn, table_name, set_split, pairs, find_matches,
+              args.engine, windows, done, args.batch_size, args.workers)
+        elif args.bulk:
+          match_bulk(conn, table_name, set_split, pairs, find_matches,
+              args.engine, windows, done, args.batch_size)
+        else:
+          match_per_pair(conn, table_name, set_split, pairs, find_matches,
+              args.engine, windows, done)
 
 
 if __name__ == "__main__":
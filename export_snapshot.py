@@ -0,0 +1,39 @@
+import argparse
+import time
+
+import lib.db_lib as dbl
+import lib.instrument as instrument
+import lib.snapshot as snapshot
+
+parser = argparse.ArgumentParser(
+    description='Export text tables to a memory-mapped columnar snapshot.')
+parser.add_argument('-d', '--dbfile', default="db/or.db",
+    type=str, help='path to database file')
+parser.add_argument('-o', '--output', default="db/or.snapshot",
+    type=str, help='path of the snapshot file to write')
+parser.add_argument('-t', '--tables', default=",".join(dbl.TextTables.ALL),
+    type=str, help='comma-separated text tables to export')
+parser.add_argument('-s', '--split', default="all",
+    type=str, help='split to export, or all')
+instrument.add_argument(parser)
+
+
+def main():
+
+  args = parser.parse_args()
+  instrument.enable_from_args(args)
+  conn = dbl.create_connection(args.dbfile, profile=dbl.Profiles.READ)
+  if conn is None:
+    print("Connection error")
+    exit()
+
+  start = time.perf_counter()
+  split = None if args.split == "all" else args.split
+  num_comments = snapshot.export(conn.cursor(), args.output,
+      args.tables.split(","), split)
+  print("Wrote {0} comments to {1} in {2:.1f}s".format(num_comments,
+    args.output, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,294 @@
+"""Bulk-load mode for the token-per-row text tables.
+
+BulkLoader wraps a connection and is handed to the ingest code in its place.
+INSERTs into the text and _pairs tables are buffered and written with
+executemany, commit() only commits every transaction_rows rows, and indexes
+on those tables are dropped for the load and rebuilt by finish().
+
+Reloading a conference into an existing DB replaces it: every row written by
+this load has a rowid above the table's maximum rowid when the load started,
+so finish() deletes the older rows of every forum that was loaded again.
+Other forums are untouched. This covers every table the load inserts into,
+buffered or not (e.g. structure). A table without a forum_id column cannot be
+replaced by forum, so inserting into one that already has rows raises
+ValueError instead of silently duplicating them.
+
+finish() also refreshes the per-comment summary (lib/summary.py) of every
+forum loaded. Summary triggers are dropped for the load and reinstalled.
+
+Every table whose indexes or triggers are dropped is recorded in the
+bulk_load_state table, in the same transaction as the drops. abort() restores
+them after a failed load, and recover() does the same for a load whose
+process died before it could; the next BulkLoader runs it first. Rows the
+failed load already committed are kept and summarized.
+
+Buffered INSERTs are not executed until a flush, so cursor.lastrowid is not
+meaningful for them. Any other statement that names a buffered table flushes
+first, so reads always see every row written so far.
+"""
+
+import collections
+import re
+import time
+
+import lib.db_lib as dbl
+import lib.instrument as instrument
+import lib.schema as schema
+import lib.summary as summary
+
+
+INSERT_RE = re.compile(r"^\s*INSERT\s+(?:OR\s+\w+\s+)?INTO\s+(\w+)",
+    re.IGNORECASE)
+
+LoadStats = collections.namedtuple("LoadStats",
+    "rows seconds replaced index_seconds")
+
+STATE_TABLE = "bulk_load_state"
+
+# Tables a load in progress has dropped indexes (and maybe triggers) from, and
+# the maximum rowid before the load.
+CREATE_STATE_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
+    table_name text PRIMARY KEY,
+    start_rowid integer NOT NULL,
+    had_triggers integer NOT NULL)""".format(STATE_TABLE)
+
+
+def table_indexes(table_name):
+  """Index statements for a text table or a text table's _pairs table."""
+  if table_name.endswith("_pairs"):
+    return schema.pairs_table_indexes(table_name[:-len("_pairs")])
+  return schema.text_table_indexes(table_name)
+
+
+def rows_per_second(stats):
+  return stats.rows / max(stats.seconds, 1e-9)
+
+
+def restore_table(cur, table, start_rowid, had_triggers):
+  """Rebuild a loaded table's indexes, summary and triggers.
+
+  Only the summary rows of forums with rows above start_rowid are rebuilt.
+  """
+  if not schema.create_indexes(cur, table, table_indexes(table)):
+    return
+  if table not in dbl.TextTables.ALL:
+    return
+  cur.execute("SELECT DISTINCT forum_id FROM {0} WHERE rowid > ?".format(
+    table), (start_rowid,))
+  summary.rebuild(cur, table, [row[0] for row in cur.fetchall()])
+  if had_triggers:
+    summary.create_triggers(cur, table)
+
+
+def recover(conn):
+  """Restore what an unfinished bulk load dropped; returns the tables."""
+  cur = conn.cursor()
+  cur.row_factory = None
+  if not schema.table_exists(cur, STATE_TABLE):
+    return []
+  state = cur.execute("SELECT table_name, start_rowid, had_triggers "
+      "FROM {0}".format(STATE_TABLE)).fetchall()
+  for table, start_rowid, had_triggers in state:
+    restore_table(cur, table, start_rowid, had_triggers)
+  cur.execute("DROP TABLE {0}".format(STATE_TABLE))
+  conn.commit()
+  return [table for table, _, _ in state]
+
+
+class _BulkCursor(object):
+
+  def __init__(self, loader):
+    self._loader = loader
+    self._cursor = loader.connection.cursor()
+
+  def execute(self, sql, parameters=()):
+    self._loader._track_insert(sql)
+    if not self._loader._buffer(sql, [parameters]):
+      self._loader._flush_for(sql)
+      self._cursor.execute(sql, parameters)
+    return self
+
+  def executemany(self, sql, seq_of_parameters):
+    self._loader._track_insert(sql)
+    if not self._loader._buffer(sql, seq_of_parameters):
+      self._loader._flush_for(sql)
+      self._cursor.executemany(sql, seq_of_parameters)
+    return self
+
+  def __getattr__(self, name):
+    return getattr(self._cursor, name)
+
+  def __iter__(self):
+    return iter(self._cursor)
+
+
+class BulkLoader(object):
+  """Connection stand-in that batches text table inserts.
+
+  Usage:
+    loader = BulkLoader(conn)
+    try:
+      load_everything(loader)  # uses loader like a sqlite3 connection
+    except BaseException:
+      loader.abort()
+      raise
+    stats = loader.finish()
+  """
+
+  def __init__(self, conn, tables=None, batch_size=50000,
+      transaction_rows=1000000):
+    if tables is None:
+      tables = [name for table_name in dbl.TextTables.ALL
+          for name in (table_name, table_name + "_pairs")]
+    self.connection = conn
+    self.batch_size = batch_size
+    self.transaction_rows = transaction_rows
+    self._tables = set(table.lower() for table in tables)
+    self._table_re = re.compile(r"\b(?:{0})\b".format("|".join(
+      re.escape(table) for table in self._tables)), re.IGNORECASE)
+    # Runs of [sql, rows] in arrival order; consecutive INSERTs with the same
+    # SQL share a run, so rowids come out exactly as if executed one by one.
+    self._pending = []
+    self._pending_rows = 0
+    self._uncommitted = 0
+    self.rows = 0
+
+    recover(conn)
+    for pragma in dbl.Profiles.BULK_LOAD:
+      conn.execute(pragma)
+    cur = conn.cursor()
+    cur.row_factory = None
+    self._start_rowid = {}
+    self._triggers = set()
+    cur.execute(CREATE_STATE_TABLE)
+    for table in tables:
+      if schema.table_exists(cur, table):
+        schema.drop_indexes(cur, table_indexes(table))
+        if summary.drop_triggers(cur, table):
+          self._triggers.add(table)
+        self._track(cur, table)
+        cur.execute("INSERT INTO {0} VALUES (?, ?, ?)".format(STATE_TABLE),
+            (table, self._start_rowid[table], table in self._triggers))
+    conn.commit()
+    self._start_time = time.time()
+
+  def _track(self, cur, table):
+    """Record where this load starts in a table it is about to write."""
+    table = table.lower()
+    if table in self._start_rowid:
+      return
+    start_rowid = 0
+    if schema.table_exists(cur, table):
+      start_rowid, = cur.execute(
+          "SELECT COALESCE(MAX(rowid), 0) FROM {0}".format(table)).fetchone()
+      if start_rowid and "forum_id" not in schema.column_names(cur, table):
+        raise ValueError(("Bulk load cannot replace rows of {0}: it has no "
+          "forum_id column. Load into a new DB or without --bulk.").format(
+            table))
+    self._start_rowid[table] = start_rowid
+
+  def _track_insert(self, sql):
+    match = INSERT_RE.match(sql)
+    if match is not None:
+      cur = self.connection.cursor()
+      cur.row_factory = None
+      self._track(cur, match.group(1))
+
+  def _buffer(self, sql, seq_of_parameters):
+    match = INSERT_RE.match(sql)
+    if match is None or match.group(1).lower() not in self._tables:
+      return False
+    if not self._pending or self._pending[-1][0] != sql:
+      self._pending.append([sql, []])
+    rows = self._pending[-1][1]
+    before = len(rows)
+    rows.extend(seq_of_parameters)
+    self._pending_rows += len(rows) - before
+    if self._pending_rows >= self.batch_size:
+      self.flush()
+    return True
+
+  def _flush_for(self, sql):
+    if self._pending and self._table_re.search(sql):
+      self.flush()
+
+  def flush(self):
+    """Write every buffered row, in the order the rows arrived."""
+    for sql, rows in self._pending:
+      self.connection.executemany(sql, rows)
+    self.rows += self._pending_rows
+    instrument.count("rows inserted", self._pending_rows)
+    self._uncommitted += self._pending_rows
+    self._pending = []
+    self._pending_rows = 0
+
+  def cursor(self):
+    return _BulkCursor(self)
+
+  def execute(self, sql, parameters=()):
+    return self.cursor().execute(sql, parameters)
+
+  def executemany(self, sql, seq_of_parameters):
+    return self.cursor().executemany(sql, seq_of_parameters)
+
+  def commit(self):
+    """Commit once enough rows have accumulated for a large transaction."""
+    if self._uncommitted + self._pending_rows >= self.transaction_rows:
+      self.flush()
+      self.connection.commit()
+      self._uncommitted = 0
+
+  def __getattr__(self, name):
+    return getattr(self.connection, name)
+
+  def replace_reloaded_forums(self, cur):
+    """Delete rows from before this load for forums it loaded again."""
+    replaced = 0
+    for table, start_rowid in self._start_rowid.items():
+      if (not schema.table_exists(cur, table)
+          or "forum_id" not in schema.column_names(cur, table)):
+        continue
+      cur.execute(("DELETE FROM {0} WHERE rowid <= ? AND forum_id IN ("
+        "SELECT forum_id FROM {0} WHERE rowid > ?)").format(table),
+        (start_rowid, start_rowid))
+      replaced += cur.rowcount
+    return replaced
+
+  def _restore(self, cur):
+    """Indexes, summaries and triggers of every table, then clear the state.
+    """
+    for table in self._tables:
+      restore_table(cur, table, self._start_rowid.get(table, 0),
+          table in self._triggers)
+    cur.execute("DROP TABLE IF EXISTS {0}".format(STATE_TABLE))
+
+  def finish(self):
+    """Flush, replace reloaded forums, rebuild indexes and summaries.
+
+    Returns LoadStats; index_seconds includes the summaries.
+    """
+    self.flush()
+    cur = self.connection.cursor()
+    cur.row_factory = None
+    replaced = self.replace_reloaded_forums(cur)
+    self.connection.commit()
+    load_done = time.time()
+    self._restore(cur)
+    cur.execute("ANALYZE")
+    self.connection.commit()
+    return LoadStats(self.rows, load_done - self._start_time, replaced,
+        time.time() - load_done)
+
+  def abort(self):
+    """After a failed load: drop unwritten rows and restore the tables.
+
+    Rows from earlier commits stay, and so do the older rows of the forums
+    they reloaded.
+    """
+    self._pending = []
+    self._pending_rows = 0
+    self.connection.rollback()
+    cur = self.connection.cursor()
+    cur.row_factory = None
+    self._restore(cur)
+    self.connection.commit()
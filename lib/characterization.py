@@ -0,0 +1,113 @@
+"""Characteristic labels of comment paths, by who took part in them.
+
+A path from a forum's root to a leaf is labelled with the participants in
+order of first appearance, e.g. Conference_Reviewer0_Author, with reviewers
+numbered per path. characterize_forest labels every path of a
+lib.forum_tree.ForumForest in one DFS.
+"""
+
+
+class Participants(object):
+  CONFERENCE = "Conference"
+  AUTHOR = "Author"
+  AC = "AC"
+  REVIEWER = "Reviewer"
+  REVIEWER_B = "Reviewer B"
+  MULTIPLE = "Multiple"
+  ANONYMOUS = "Anonymous"
+  NAMED = "Named"
+
+
+def is_official(comment):
+  return shorten_author(comment.author) in [Participants.AUTHOR,
+      Participants.REVIEWER, Participants.AC, Participants.CONFERENCE]
+
+
+def shorten_author(author):
+  if Participants.AUTHOR in author:
+    return Participants.AUTHOR
+  elif Participants.REVIEWER in author:
+    return Participants.REVIEWER
+  elif "Area_Chair" in author:
+    return Participants.AC
+  elif Participants.CONFERENCE in author:
+    return Participants.CONFERENCE
+  elif author == "(anonymous)":
+    return Participants.ANONYMOUS
+  else:
+    assert author.startswith("~")
+    return Participants.NAMED
+
+
+def add_to_characteristic(comment, characteristic_path, reviewer_roles):
+  """Extend a path characterization by one comment, in place.
+
+  Returns whether a label was appended, so a DFS can undo it on the way up.
+  """
+  short_author = shorten_author(comment.author)
+  if short_author in [Participants.CONFERENCE, Participants.AUTHOR,
+      Participants.AC]:
+    if short_author in characteristic_path:
+      return False
+    characteristic_path.append(short_author)
+    return True
+
+  assert short_author == Participants.REVIEWER
+  reviewer_name = comment.author
+  if reviewer_name in reviewer_roles:
+    return False
+  reviewer_roles[reviewer_name] = len(reviewer_roles)
+  characteristic_path.append(
+      Participants.REVIEWER + str(reviewer_roles[reviewer_name]))
+  return True
+
+
+def remove_from_characteristic(comment, characteristic_path, reviewer_roles):
+  """Undo an add_to_characteristic call that returned True."""
+  if characteristic_path.pop().startswith(Participants.REVIEWER):
+    del reviewer_roles[comment.author]
+
+
+def finish_characteristic(characteristic_path):
+  if len(set(characteristic_path)) > 4:
+    characteristic_path = characteristic_path[:3] + [Participants.MULTIPLE]
+
+  assert len(characteristic_path) <= 4
+
+  return "_".join(characteristic_path)
+
+
+def characterize_path(path):
+  reviewer_roles = {}
+  characteristic_path = []
+  for comment in path:
+    add_to_characteristic(comment, characteristic_path, reviewer_roles)
+  return finish_characteristic(characteristic_path)
+
+
+def characterize_forest(forest, keep, make_path=None):
+  """Yield characterized root-to-leaf paths of the kept forest, in one DFS.
+
+  Each path is make_path(comments, label), a tuple by default. The
+  characterization of each prefix is kept on the way down and undone on the
+  way up, so shared ancestors are only processed once.
+  """
+  make_path = make_path or (lambda comments, label: (comments, label))
+  path = []
+  appended = []
+  reviewer_roles = {}
+  characteristic_path = []
+  for node, entering in forest.walk(keep):
+    comment = forest.comments[node]
+    if entering:
+      path.append(comment)
+      appended.append(add_to_characteristic(comment, characteristic_path,
+        reviewer_roles))
+      if forest.is_leaf(node, keep):
+        yield make_path(list(path),
+            finish_characteristic(characteristic_path))
+    else:
+      path.pop()
+      if appended.pop():
+        remove_from_characteristic(comment, characteristic_path,
+            reviewer_roles)
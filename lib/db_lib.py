@@ -1,6 +1,11 @@
 import collections
+import contextlib
+import queue
 import sqlite3
 
+import lib.instrument as instrument
+import lib.summary as summary
+
 class TextTables(object):
   UNSTRUCTURED = "unstructured"
   TRAIN_DEV = "traindev"
@@ -8,21 +13,125 @@ class TextTables(object):
   ALL = [UNSTRUCTURED, TRAIN_DEV, TRUE_TEST]
 
 
-def create_connection(db_file):
+class RowModes(object):
+  DICT = "dict"
+  TUPLE = "tuple"
+  ROW = "row"
+  NAMEDTUPLE = "namedtuple"
+
+
+# Page cache budget, in KiB, of one READ connection or of a whole ReadPool.
+READ_CACHE_KIB = 1 << 20
+
+
+class Profiles(object):
+  """Pragma sets applied when a connection is opened.
+
+  READ only changes per-connection settings. It leaves the file's journal
+  mode alone; see schema.set_journal_mode to opt a DB into WAL.
+  """
+  DEFAULT = []
+  READ = [
+      "PRAGMA mmap_size={0}".format(1 << 31),
+      "PRAGMA cache_size=-{0}".format(READ_CACHE_KIB),
+      "PRAGMA temp_store=MEMORY",
+  ]
+  BULK_LOAD = [
+      "PRAGMA journal_mode=MEMORY",
+      "PRAGMA synchronous=OFF",
+      "PRAGMA cache_size=-2097152",
+      "PRAGMA temp_store=MEMORY",
+  ]
+
+
+def dict_factory(cursor, row):
+  d = {}
+  for idx, col in enumerate(cursor.description):
+    d[col[0]] = row[idx]
+  return d
+
+
+_namedtuple_cache = {}
+
+
+def namedtuple_factory(cursor, row):
+  """Rows as namedtuples; one class is built per distinct column list."""
+  fields = tuple(col[0] for col in cursor.description)
+  row_class = _namedtuple_cache.get(fields)
+  if row_class is None:
+    row_class = collections.namedtuple("Row", fields, rename=True)
+    _namedtuple_cache[fields] = row_class
+  return row_class._make(row)
+
+
+ROW_FACTORIES = {
+    RowModes.DICT: dict_factory,
+    RowModes.TUPLE: None,
+    RowModes.ROW: sqlite3.Row,
+    RowModes.NAMEDTUPLE: namedtuple_factory,
+}
+
+
+def open_connection(db_file, row_mode=RowModes.DICT, profile=Profiles.DEFAULT,
+    read_only=False, check_same_thread=True):
+  """Open a connection; raises sqlite3.Error on failure."""
+  if read_only:
+    conn = sqlite3.connect("file:{0}?mode=ro".format(db_file), uri=True,
+        check_same_thread=check_same_thread)
+  else:
+    conn = sqlite3.connect(db_file, check_same_thread=check_same_thread)
+  conn.row_factory = ROW_FACTORIES[row_mode]
+  for pragma in profile:
+    if read_only and "journal_mode" in pragma:
+      # Changing the journal mode needs a write; the file keeps its mode.
+      continue
+    conn.execute(pragma)
+  return instrument.instrument_connection(conn)
+
+
+def create_connection(db_file, row_mode=RowModes.DICT,
+    profile=Profiles.DEFAULT):
   """ create a database connection to a SQLite database """
   conn = None
   try:
-    conn = sqlite3.connect(db_file)
-    conn.row_factory = dict_factory
+    conn = open_connection(db_file, row_mode, profile)
     return conn
   except sqlite3.Error as e:
     print(e)
 
-def dict_factory(cursor, row):
-  d = {}
-  for idx, col in enumerate(cursor.description):
-    d[col[0]] = row[idx]
-  return d
+
+class ReadPool(object):
+  """Thread-safe pool of read-only connections for parallel readers.
+
+  cache_kib is the page cache budget of the whole pool; each connection gets
+  an equal share of it in place of any cache_size in profile.
+
+  Usage:
+    pool = ReadPool("db/or.db", 8)
+    with pool.connection() as conn:
+      conn.execute(...)
+  """
+
+  def __init__(self, db_file, size, row_mode=RowModes.DICT,
+      profile=Profiles.READ, cache_kib=READ_CACHE_KIB):
+    profile = [pragma for pragma in profile if "cache_size" not in pragma] + [
+        "PRAGMA cache_size=-{0}".format(max(cache_kib // size, 1))]
+    self._connections = queue.Queue()
+    for _ in range(size):
+      self._connections.put(open_connection(db_file, row_mode, profile,
+        read_only=True, check_same_thread=False))
+
+  @contextlib.contextmanager
+  def connection(self):
+    conn = self._connections.get()
+    try:
+      yield conn
+    finally:
+      self._connections.put(conn)
+
+  def close(self):
+    while not self._connections.empty():
+      self._connections.get().close()
 
 
 def collapse_dict(input_dict):
@@ -31,6 +140,7 @@ def collapse_dict(input_dict):
   return [input_dict[i] for i in sorted(input_dict.keys())]
 
 
+@instrument.stage("crunch_text_rows")
 def crunch_text_rows(rows):
   """Crunch rows from text table back into a more readable format.
 
@@ -50,3 +160,111 @@ def crunch_text_rows(rows):
         for sentence in collapse_dict(chunk_dict)]
 
   return texts
+
+
+ORDERED_TEXT = """SELECT comment_supernote, chunk_idx, sentence_idx, token
+    FROM {0} {1} ORDER BY comment_supernote, chunk_idx, sentence_idx, rowid"""
+
+
+def stream_text_rows(rows):
+  """Group text rows into comments, one comment at a time.
+
+  rows are (comment_supernote, chunk_idx, sentence_idx, token) tuples ordered
+  by the first three fields with tokens in their original order, as produced
+  by ORDERED_TEXT. Yields (supernote, chunks) pairs with chunks exactly as in
+  crunch_text_rows.
+  """
+  supernote = chunks = chunk = sentence = None
+  chunk_idx = sentence_idx = None
+  for row_supernote, row_chunk_idx, row_sentence_idx, token in rows:
+    if row_supernote != supernote:
+      if supernote is not None:
+        yield supernote, chunks
+      supernote, chunks = row_supernote, []
+      chunk_idx = sentence_idx = None
+    if row_chunk_idx != chunk_idx:
+      chunk_idx, chunk = row_chunk_idx, []
+      chunks.append(chunk)
+      sentence_idx = None
+    if row_sentence_idx != sentence_idx:
+      sentence_idx, sentence = row_sentence_idx, []
+      chunk.append(sentence)
+    sentence.append(token)
+  if supernote is not None:
+    yield supernote, chunks
+
+
+def iter_comments(cur, table_name, split=None):
+  """Stream (supernote, chunks) for every comment in a text table or split.
+
+  Peak memory is one comment; the output matches crunch_text_rows. Rows are
+  read as plain tuples on a fresh cursor whatever the connection's row mode.
+  """
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  if split is None:
+    cur.execute(ORDERED_TEXT.format(table_name, ""))
+  else:
+    cur.execute(ORDERED_TEXT.format(table_name, "WHERE split=?"), (split,))
+  return stream_text_rows(cur)
+
+
+CommentLengths = collections.namedtuple("CommentLengths", summary.COLUMNS)
+
+LENGTH_FIELDS = ["num_chunks", "num_sentences", "num_tokens"]
+
+LengthStats = collections.namedtuple("LengthStats",
+    "comments histograms percentiles")
+
+
+def iter_comment_lengths(cur, table_name, split=None):
+  """Stream CommentLengths for every comment, ordered by supernote.
+
+  Reads <table>_summary if it exists, otherwise aggregates the token rows in
+  SQL. Either way only one row is held in Python at a time.
+  """
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  if summary.summary_exists(cur, table_name):
+    query = "SELECT {0} FROM {1} {2} ORDER BY comment_supernote".format(
+        ", ".join(summary.COLUMNS), summary.summary_table(table_name), "{0}")
+  else:
+    query = summary.AGGREGATE.format(table_name, "{0}")
+  if split is None:
+    cur.execute(query.format(""))
+  else:
+    cur.execute(query.format("WHERE split=?"), (split,))
+  for row in cur:
+    yield CommentLengths._make(row)
+
+
+def percentile(histogram, p):
+  """Nearest-rank p-th percentile of a {value: count} histogram."""
+  total = sum(histogram.values())
+  rank = max(1, -(-total * p // 100))
+  seen = 0
+  for value in sorted(histogram):
+    seen += histogram[value]
+    if seen >= rank:
+      return value
+
+
+def length_statistics(cur, table_name, split=None,
+    percentiles=(50, 90, 95, 99)):
+  """{(split, comment_type): LengthStats} over comment lengths.
+
+  histograms[field] is a Counter from length to number of comments and
+  percentiles[field] maps each requested percentile to a length, for each
+  field in LENGTH_FIELDS. Memory grows with the number of distinct lengths,
+  not the number of comments.
+  """
+  histograms = collections.defaultdict(
+      lambda: {field: collections.Counter() for field in LENGTH_FIELDS})
+  for lengths in iter_comment_lengths(cur, table_name, split):
+    group = histograms[(lengths.split, lengths.comment_type)]
+    for field in LENGTH_FIELDS:
+      group[field][getattr(lengths, field)] += 1
+  return {key: LengthStats(sum(group["num_tokens"].values()), group,
+    {field: {p: percentile(group[field], p) for p in percentiles}
+      for field in LENGTH_FIELDS})
+    for key, group in histograms.items()}
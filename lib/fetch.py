@@ -0,0 +1,282 @@
+"""Concurrent OpenReview fetching into a content-addressed note cache.
+
+Forums are fetched through the OpenReview REST API (/notes) with many
+requests in flight under asyncio, at most `rate` requests per second, with
+retries and exponential backoff on connection errors, 429 and 5xx. The base
+URL is a parameter, so a local fake server can stand in for OpenReview.
+
+Cache layout under the cache directory:
+
+  notes/<h[:2]>/<h>.json   one raw note, h = SHA-1 of its canonical JSON
+  forums/<forum_id>.json   {"stamp": [tmdate, replyCount], "notes": [h, ...]}
+
+A forum's stamp is the latest tmdate of any of its notes plus the
+submission's replyCount. One request per forum (its single most recently
+modified note) gives the current stamp, and the forum is fetched again only
+when that differs from the stamp in its manifest, i.e. when the submission or
+any reply was added, edited or deleted.
+Identical notes are stored once however many times they are fetched.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+
+PAGE_SIZE = 1000
+RETRY_STATUSES = set([429, 500, 502, 503, 504])
+
+
+def note_hash(note):
+  return hashlib.sha1(json.dumps(note, sort_keys=True,
+    separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def forum_stamp(submission, notes):
+  """Stamp of a forum from its submission and any of its notes.
+
+  notes must include the most recently modified note of the forum.
+  """
+  return [max([note.get("tmdate") or 0 for note in notes] +
+    [submission.get("tmdate") or 0]),
+    submission.get("details", {}).get("replyCount")]
+
+
+def _write_json(path, obj):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = "{0}.{1}.tmp".format(path, threading.get_ident())
+  with open(tmp_path, "w") as f:
+    json.dump(obj, f)
+  os.replace(tmp_path, path)
+
+
+def _read_json(path):
+  try:
+    with open(path, "r") as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return None
+
+
+class NoteCache(object):
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def _note_path(self, h):
+    return os.path.join(self.directory, "notes", h[:2], h + ".json")
+
+  def _forum_path(self, forum_id):
+    return os.path.join(self.directory, "forums", forum_id + ".json")
+
+  def put_note(self, note):
+    h = note_hash(note)
+    path = self._note_path(h)
+    if not os.path.exists(path):
+      _write_json(path, note)
+    return h
+
+  def get_note(self, h):
+    return _read_json(self._note_path(h))
+
+  def get_manifest(self, forum_id):
+    return _read_json(self._forum_path(forum_id))
+
+  def put_forum(self, forum_id, stamp, notes):
+    _write_json(self._forum_path(forum_id), {"stamp": stamp,
+      "notes": [self.put_note(note) for note in notes]})
+
+  def forum_ids(self):
+    directory = os.path.join(self.directory, "forums")
+    if not os.path.isdir(directory):
+      return []
+    return sorted(name[:-len(".json")] for name in os.listdir(directory)
+        if name.endswith(".json"))
+
+  def get_forum(self, forum_id):
+    """Cached notes of a forum, or None if it was never fetched."""
+    manifest = self.get_manifest(forum_id)
+    if manifest is None:
+      return None
+    return [self.get_note(h) for h in manifest["notes"]]
+
+
+class RateLimiter(object):
+  """Spaces request starts at least 1 / rate seconds apart."""
+
+  def __init__(self, rate):
+    self.interval = 0.0 if not rate else 1.0 / rate
+    self._next = 0.0
+    self._lock = asyncio.Lock()
+
+  async def wait(self):
+    async with self._lock:
+      now = time.monotonic()
+      delay = self._next - now
+      self._next = max(now, self._next) + self.interval
+    if delay > 0:
+      await asyncio.sleep(delay)
+
+
+class AsyncFetcher(object):
+  """Fetch notes with up to `concurrency` requests in flight.
+
+  Blocking requests calls run on a thread pool of `concurrency` threads, one
+  Session per thread. Must be created inside a running event loop; call
+  close() when done.
+  """
+
+  def __init__(self, baseurl, rate=10.0, concurrency=16, retries=5,
+      backoff=1.0, timeout=60):
+    self.baseurl = baseurl.rstrip("/")
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.requests_made = 0
+    self._limiter = RateLimiter(rate)
+    self._semaphore = asyncio.Semaphore(concurrency)
+    self._executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+    self._local = threading.local()
+
+  def close(self):
+    self._executor.shutdown()
+
+  def _session(self):
+    if not hasattr(self._local, "session"):
+      self._local.session = requests.Session()
+    return self._local.session
+
+  def _get_blocking(self, path, params):
+    return self._session().get(self.baseurl + path, params=params,
+        timeout=self.timeout)
+
+  async def get(self, path, params):
+    """GET a JSON response, retrying transient failures with backoff."""
+    loop = asyncio.get_event_loop()
+    for attempt in range(self.retries + 1):
+      await self._limiter.wait()
+      delay = self.backoff * 2 ** attempt
+      async with self._semaphore:
+        self.requests_made += 1
+        try:
+          response = await loop.run_in_executor(self._executor,
+              self._get_blocking, path, params)
+        except requests.ConnectionError:
+          if attempt == self.retries:
+            raise
+          response = None
+      if response is not None:
+        if response.status_code not in RETRY_STATUSES:
+          response.raise_for_status()
+          return response.json()
+        if attempt == self.retries:
+          response.raise_for_status()
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+          delay = max(delay, int(retry_after))
+      await asyncio.sleep(delay)
+
+  async def get_all(self, params):
+    """Every note matching params, following offset pagination."""
+    notes = []
+    while True:
+      page = await self.get("/notes", dict(params, offset=len(notes),
+        limit=PAGE_SIZE))
+      notes.extend(page["notes"])
+      if len(page["notes"]) < PAGE_SIZE:
+        return notes
+
+
+async def sync_forums(fetcher, cache, submissions):
+  """Fetch forums that are new or changed. Returns the ids fetched."""
+  async def sync(submission):
+    forum_id = submission["forum"]
+    manifest = cache.get_manifest(forum_id)
+    if manifest is not None:
+      latest = await fetcher.get("/notes", {"forum": forum_id,
+        "sort": "tmdate:desc", "limit": 1})
+      if manifest["stamp"] == forum_stamp(submission, latest["notes"]):
+        return None
+    notes = await fetcher.get_all({"forum": forum_id})
+    # Stamped from what was actually fetched, so an edit made after the
+    # check above is picked up by the next sync.
+    cache.put_forum(forum_id, forum_stamp(submission, notes), notes)
+    return forum_id
+
+  fetched = await asyncio.gather(*[sync(submission)
+    for submission in submissions])
+  return [forum_id for forum_id in fetched if forum_id is not None]
+
+
+async def _sync_conference(baseurl, invitation, cache, forum_ids, **kwargs):
+  fetcher = AsyncFetcher(baseurl, **kwargs)
+  try:
+    submissions = await fetcher.get_all(
+        {"invitation": invitation, "details": "replyCount"})
+    if forum_ids is not None:
+      forum_ids = set(forum_ids)
+      submissions = [submission for submission in submissions
+          if submission["forum"] in forum_ids]
+    fetched = await sync_forums(fetcher, cache, submissions)
+  finally:
+    fetcher.close()
+  return fetched, fetcher.requests_made
+
+
+def sync_conference(baseurl, invitation, cache_dir, forum_ids=None,
+    **kwargs):
+  """Bring the cache up to date with a conference's submissions.
+
+  Only forums in forum_ids are kept if it is given. kwargs go to
+  AsyncFetcher. Returns (forum ids fetched, number of HTTP requests).
+  """
+  return asyncio.run(_sync_conference(baseurl, invitation,
+    NoteCache(cache_dir), forum_ids, **kwargs))
+
+
+class CachedClient(object):
+  """Read-only stand-in for openreview.Client.get_notes over a NoteCache.
+
+  Notes are returned as make_note(raw note), e.g. openreview.Note.from_json.
+  The cache is read from disk once, on the first call that needs every
+  forum; paginated calls after that are served from memory.
+  """
+
+  def __init__(self, cache_dir, make_note=dict):
+    self.cache = NoteCache(cache_dir)
+    self.make_note = make_note
+    self._forums = None
+    self._by_invitation = {}
+
+  def _all_forums(self):
+    if self._forums is None:
+      self._forums = {forum_id: self.cache.get_forum(forum_id)
+          for forum_id in self.cache.forum_ids()}
+    return self._forums
+
+  def _invitation_notes(self, invitation):
+    if invitation not in self._by_invitation:
+      self._by_invitation[invitation] = [note
+          for notes in self._all_forums().values() for note in notes
+          if invitation is None or note.get("invitation") == invitation]
+    return self._by_invitation[invitation]
+
+  def get_notes(self, forum=None, invitation=None, offset=0,
+      limit=PAGE_SIZE, **kwargs):
+    if forum is None:
+      notes = self._invitation_notes(invitation)
+    else:
+      if self._forums is not None:
+        notes = self._forums.get(forum) or []
+      else:
+        notes = self.cache.get_forum(forum) or []
+      if invitation is not None:
+        notes = [note for note in notes
+            if note.get("invitation") == invitation]
+    return [self.make_note(note) for note in notes[offset:offset + limit]]
@@ -0,0 +1,90 @@
+class ForumForest(object):
+  """Comment trees of every forum from the structure table, built once.
+
+  Comments are numbered 0..n-1. For node i, ids[i] is the comment id,
+  comments[i] the Comment, parent[i] the parent node (-1 for roots, i.e.
+  comments whose parent is "None"), and depth[i] the distance from its root.
+  Children are threaded through first_child/next_sibling in the order they
+  appear in the structure map. preorder lists every node reachable from a
+  root, parents before children.
+  """
+
+  def __init__(self, structure_map, comment_map):
+    self.ids = []
+    self.comments = []
+    self.parent = []
+    self.first_child = []
+    self.next_sibling = []
+    self.roots = []
+    node_idx = {}
+    last_child = []
+
+    def get_node(comment_id):
+      if comment_id not in node_idx:
+        node_idx[comment_id] = len(self.ids)
+        self.ids.append(comment_id)
+        self.comments.append(comment_map[comment_id])
+        self.parent.append(-1)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        last_child.append(-1)
+      return node_idx[comment_id]
+
+    for structure in structure_map.values():
+      for child_id, parent_id in structure.items():
+        child = get_node(child_id)
+        if parent_id == "None":
+          self.roots.append(child)
+          continue
+        parent = get_node(parent_id)
+        self.parent[child] = parent
+        if last_child[parent] == -1:
+          self.first_child[parent] = child
+        else:
+          self.next_sibling[last_child[parent]] = child
+        last_child[parent] = child
+
+    self.node_idx = node_idx
+    self.depth = [0] * len(self.ids)
+    self.preorder = []
+    for node, entering in self.walk():
+      if entering:
+        self.preorder.append(node)
+        if self.parent[node] != -1:
+          self.depth[node] = self.depth[self.parent[node]] + 1
+
+  def children(self, node):
+    child = self.first_child[node]
+    while child != -1:
+      yield child
+      child = self.next_sibling[child]
+
+  def walk(self, keep=None):
+    """Iterative DFS over kept nodes, yielding (node, True) on the way down
+    and (node, False) on the way back up. A node is visited only if it and
+    all its ancestors are kept.
+    """
+    stack = [(root, True) for root in reversed(self.roots)
+        if keep is None or keep[root]]
+    while stack:
+      node, entering = stack.pop()
+      yield node, entering
+      if not entering:
+        continue
+      stack.append((node, False))
+      kept_children = [child for child in self.children(node)
+          if keep is None or keep[child]]
+      stack.extend((child, True) for child in reversed(kept_children))
+
+  def prune(self, predicate):
+    """keep[i] is True iff predicate holds for node i and all its ancestors."""
+    keep = [False] * len(self.ids)
+    for node in self.preorder:
+      parent = self.parent[node]
+      keep[node] = (predicate(self.comments[node])
+          and (parent == -1 or keep[parent]))
+    return keep
+
+  def is_leaf(self, node, keep=None):
+    return not any(keep is None or keep[child]
+        for child in self.children(node))
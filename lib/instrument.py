@@ -0,0 +1,264 @@
+"""Opt-in instrumentation: SQL statement stats, stage timers and counters.
+
+Scripts call add_argument(parser) and enable_from_args(args). With
+--profile PREFIX, everything below is recorded and written at exit to
+
+  PREFIX.json     stages, SQL statements and counters
+  PREFIX.folded   collapsed stacks ("main;prefetch;SQL SELECT ... 1234", in
+                  microseconds) for flamegraph.pl or speedscope
+
+Without the flag every hook is a cheap no-op. Only the process that
+enabled it is recorded, not multiprocessing workers.
+
+* stage("name") is a context manager and decorator. Stages nest, and each is
+  keyed by its full stack. Each thread has its own stack, so one stage object
+  can be entered recursively or from several threads at once.
+* count("name", n) adds to a counter.
+* Connections from db_lib are instrumented automatically. A connection made
+  elsewhere can be passed to instrument_connection(), which wraps it so that
+  every execute, executemany and fetch call (including iterating a cursor) is
+  timed directly and charged to the statement the cursor is running. Python
+  code that runs between fetches of a lazily iterated cursor is not counted
+  as SQL time. Literals are replaced by ? so executions of one statement are
+  grouped.
+"""
+
+import atexit
+import collections
+import contextlib
+import json
+import re
+import threading
+import time
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+class _State(object):
+
+  def __init__(self):
+    self.enabled = False
+    self.prefix = None
+    self.start = None
+    self.local = threading.local()
+    self.stages = collections.OrderedDict()
+    self.sql = collections.OrderedDict()
+    self.counters = collections.Counter()
+    self.normalized = {}
+
+
+_state = _State()
+
+
+def enabled():
+  return _state.enabled
+
+
+def enable(prefix):
+  """Start recording; results are written to prefix.* at exit."""
+  if _state.enabled:
+    return
+  _state.enabled = True
+  _state.prefix = prefix
+  _state.start = time.perf_counter()
+  atexit.register(dump)
+
+
+def add_argument(parser):
+  parser.add_argument('--profile', default=None, type=str,
+      help='record SQL, stage timings and counters, and write them to '
+      'PROFILE.json and PROFILE.folded at exit')
+
+
+def enable_from_args(args):
+  if args.profile is not None:
+    enable(args.profile)
+
+
+def _stack():
+  """This thread's open stages, as a list of (name, start time)."""
+  stack = getattr(_state.local, "stack", None)
+  if stack is None:
+    stack = _state.local.stack = []
+  return stack
+
+
+def _path():
+  return tuple(name for name, _ in _stack())
+
+
+def count(name, n=1):
+  if _state.enabled:
+    _state.counters[name] += n
+
+
+class stage(contextlib.ContextDecorator):
+  """Time a named pipeline stage, as `with stage(...)` or `@stage(...)`."""
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    if _state.enabled:
+      _stack().append((self.name, time.perf_counter()))
+    return self
+
+  def __exit__(self, *exc_info):
+    if _state.enabled:
+      path = _path()
+      _, start = _stack().pop()
+      record = _state.stages.setdefault(path, [0, 0.0])
+      record[0] += 1
+      record[1] += time.perf_counter() - start
+    return False
+
+
+def normalize_sql(statement):
+  return _SPACE_RE.sub(" ", _LITERAL_RE.sub("?", statement)).strip()
+
+
+def _sql_record(statement):
+  """[executions, seconds] of a statement in the current stage."""
+  normalized = _state.normalized.get(statement)
+  if normalized is None:
+    normalized = _state.normalized[statement] = normalize_sql(statement)
+  return _state.sql.setdefault((_path(), normalized), [0, 0.0])
+
+
+def _timed(record, function, *args):
+  """function(*args), adding its duration to record if there is one."""
+  start = time.perf_counter()
+  try:
+    return function(*args)
+  finally:
+    if record is not None:
+      record[1] += time.perf_counter() - start
+
+
+class _Cursor(object):
+  """Cursor proxy that times execute and fetch calls."""
+
+  def __init__(self, connection, cursor):
+    object.__setattr__(self, "connection", connection)
+    object.__setattr__(self, "_cursor", cursor)
+    object.__setattr__(self, "_record", None)
+
+  def execute(self, sql, parameters=()):
+    record = _sql_record(sql)
+    record[0] += 1
+    object.__setattr__(self, "_record", record)
+    _timed(record, self._cursor.execute, sql, parameters)
+    return self
+
+  def executemany(self, sql, seq_of_parameters):
+    record = _sql_record(sql)
+    record[0] += 1
+    object.__setattr__(self, "_record", record)
+    _timed(record, self._cursor.executemany, sql, seq_of_parameters)
+    return self
+
+  def fetchone(self):
+    return _timed(self._record, self._cursor.fetchone)
+
+  def fetchmany(self, *args):
+    return _timed(self._record, self._cursor.fetchmany, *args)
+
+  def fetchall(self):
+    return _timed(self._record, self._cursor.fetchall)
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    return _timed(self._record, next, self._cursor)
+
+  def __getattr__(self, name):
+    return getattr(self._cursor, name)
+
+  def __setattr__(self, name, value):
+    setattr(self._cursor, name, value)
+
+
+class _Connection(object):
+  """Connection proxy whose cursors are _Cursors."""
+
+  def __init__(self, conn):
+    object.__setattr__(self, "_conn", conn)
+
+  def cursor(self):
+    return _Cursor(self, self._conn.cursor())
+
+  def execute(self, sql, parameters=()):
+    return self.cursor().execute(sql, parameters)
+
+  def executemany(self, sql, seq_of_parameters):
+    return self.cursor().executemany(sql, seq_of_parameters)
+
+  def commit(self):
+    record = _sql_record("COMMIT")
+    record[0] += 1
+    _timed(record, self._conn.commit)
+
+  def __enter__(self):
+    self._conn.__enter__()
+    return self
+
+  def __exit__(self, *exc_info):
+    return self._conn.__exit__(*exc_info)
+
+  def __getattr__(self, name):
+    return getattr(self._conn, name)
+
+  def __setattr__(self, name, value):
+    setattr(self._conn, name, value)
+
+
+def instrument_connection(conn):
+  """Record statements run on conn; returns conn unless enabled."""
+  if not _state.enabled or conn is None:
+    return conn
+  return _Connection(conn)
+
+
+def report():
+  """Everything recorded so far, as JSON-serializable dicts."""
+  return {
+      "wall_seconds": time.perf_counter() - _state.start,
+      "stages": [{"stage": ";".join(path), "calls": calls,
+        "seconds": seconds}
+        for path, (calls, seconds) in _state.stages.items()],
+      "sql": sorted([{"stage": ";".join(path), "statement": statement,
+        "executions": executions, "seconds": seconds}
+        for (path, statement), (executions, seconds)
+        in _state.sql.items()], key=lambda record: -record["seconds"]),
+      "counters": dict(_state.counters),
+  }
+
+
+def folded_stacks():
+  """{stack: self microseconds}, with SQL as leaf frames under stages."""
+  self_seconds = collections.defaultdict(float)
+  for path, (_, seconds) in _state.stages.items():
+    self_seconds[path] += seconds
+    if len(path) > 1:
+      self_seconds[path[:-1]] -= seconds
+  for (path, statement), (_, seconds) in _state.sql.items():
+    self_seconds[path + ("SQL " + statement.replace(";", ","),)] += seconds
+    if path:
+      self_seconds[path] -= seconds
+  total = time.perf_counter() - _state.start
+  self_seconds[()] = total - sum(seconds
+      for path, (_, seconds) in _state.stages.items() if len(path) == 1) - sum(
+      seconds for (path, _), (_, seconds) in _state.sql.items() if not path)
+  return {";".join(("main",) + path): int(max(seconds, 0.0) * 1e6)
+      for path, seconds in self_seconds.items()}
+
+
+def dump():
+  with open(_state.prefix + ".json", "w") as f:
+    json.dump(report(), f, indent=2)
+  with open(_state.prefix + ".folded", "w") as f:
+    for stack, microseconds in sorted(folded_stacks().items()):
+      if microseconds > 0:
+        f.write("{0} {1}\n".format(stack, microseconds))
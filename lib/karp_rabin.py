@@ -1,35 +1,76 @@
 import collections
 import json
-import math 
 import sys
 
+import lib.instrument as instrument
+
 
 WINDOW = 5
-Q = 2124749677  # Is this too big for Python int
+Q = (1 << 61) - 1  # Mersenne prime; Python ints don't overflow
+BASE = 1000003
+
+
+def token_ids(tokens, vocab):
+  """Map tokens to integer ids, growing vocab as new tokens are seen."""
+  return [vocab.setdefault(token, len(vocab)) for token in tokens]
 
 
-def myhash(tokens):
-  tok_str = "".join(tokens)
+def num_windows(tokens, window=WINDOW):
+  # The final window is not hashed; this matches the original implementation
+  # so that results stay comparable with existing _em tables.
+  return max(len(tokens) - window, 0)
+
+
+def rolling_hashes(ids, window=WINDOW):
+  """Polynomial hash of every window-length run of ids, updated in O(1)."""
+  count = num_windows(ids, window)
+  if not count:
+    return []
+  top = pow(BASE, window - 1, Q)
   hash_acc = 0
-  for i, ch in enumerate(reversed(tok_str)):
-    hash_acc += math.pow(2, i) * ord(ch)
+  for token_id in ids[:window]:
+    hash_acc = (hash_acc * BASE + token_id) % Q
+  hashes = [hash_acc]
+  for i in range(1, count):
+    hash_acc = ((hash_acc - ids[i - 1] * top) * BASE + ids[i + window - 1]) % Q
+    hashes.append(hash_acc)
+  return hashes
+
 
-  return hash_acc % Q
+def get_hashes(tokens, window=WINDOW):
+  return dict(enumerate(rolling_hashes(token_ids(tokens, {}), window)))
 
 
-def get_hashes(tokens):
-  return {i:myhash(tokens[i:i+WINDOW]) for i in range(len(tokens) - WINDOW)}
+def build_index(hashes, index=None, key=None):
+  """Hash-join table from window hash to the offsets that produce it.
 
+  If key is given, entries are (key, offset) so that several token streams can
+  share one index.
+  """
+  if index is None:
+    index = collections.defaultdict(list)
+  for offset, hash_value in enumerate(hashes):
+    index[hash_value].append(offset if key is None else (key, offset))
+  return index
 
-def karp_rabin(tokens_1, tokens_2):
-  hashes_1 = get_hashes(tokens_1)
-  hashes_2 = get_hashes(tokens_2)
+
+def same_window(ids_1, offset_1, ids_2, offset_2, window=WINDOW):
+  return ids_1[offset_1:offset_1 + window] == ids_2[offset_2:offset_2 + window]
+
+
+def karp_rabin(tokens_1, tokens_2, window=WINDOW):
+  """Sorted (offset_1, offset_2) pairs of identical windows."""
+  vocab = {}
+  ids_1 = token_ids(tokens_1, vocab)
+  ids_2 = token_ids(tokens_2, vocab)
+  index = build_index(rolling_hashes(ids_2, window))
   matches = []
-  for k1, v1 in hashes_1.items():
-    for k2, v2 in hashes_2.items():
-      if v1 == v2:
+  for k1, v1 in enumerate(rolling_hashes(ids_1, window)):
+    for k2 in index.get(v1, ()):
+      if same_window(ids_1, k1, ids_2, k2, window):
         matches.append((k1, k2))
-  return sorted(matches)
+  return matches
+
 
 def find_lcs(review_tokens, rebuttal_tokens, review_offset, rebuttal_offset):
   review_idx = review_offset
@@ -50,27 +91,76 @@ Match = collections.namedtuple("Match",
     "review_location rebuttal_location lcs".split())
 
 
-def find_matches(rebuttal, review):
-  (review_id, review_chunks), = review.items()
-  (rebuttal_id, rebuttal_chunks), = rebuttal.items()
+def flatten_chunks(chunks):
+  return [[token for sentence in chunk for token in sentence]
+      for chunk in chunks]
 
-  matches = []
-  for i, review_chunk in enumerate(review_chunks):
-    for j, rebuttal_chunk in enumerate(rebuttal_chunks):
-      review_chunk_tokens  = sum(review_chunk, [])
-      rebuttal_chunk_tokens  = sum(rebuttal_chunk, [])
-      match_offsets = karp_rabin(review_chunk_tokens, rebuttal_chunk_tokens)
-      if match_offsets:
-        for (review_offset, rebuttal_offset) in match_offsets:
-          lcs = find_lcs(review_chunk_tokens, rebuttal_chunk_tokens,
-            review_offset, rebuttal_offset)
-          if matches and " ".join(lcs) in matches[-1].lcs:
-            continue
-          else:
-            matches.append(Match(Location(review_id, i, review_offset),
-              Location(rebuttal_id, j, rebuttal_offset), " ".join(lcs)))
-  return matches
 
+def find_matches(rebuttal, review, window=WINDOW):
+  return find_matches_multi(rebuttal, review, [window])[window]
 
 
+def find_matches_multi(rebuttal, review, windows=(WINDOW,)):
+  """{window: matches} for several window sizes in one pass.
 
+  Seeds are found once, at the smallest window, and each is extended to its
+  maximal match. A seed of a larger window w is exactly such a seed whose match
+  is at least w tokens long and whose offsets are both hashed at w, so every
+  window gets the same matches as a separate find_matches(..., window=w).
+  """
+  windows = sorted(set(windows))
+  seed_window = windows[0]
+  (review_id, review_chunks), = review.items()
+  (rebuttal_id, rebuttal_chunks), = rebuttal.items()
+
+  vocab = {}
+  review_tokens = flatten_chunks(review_chunks)
+  rebuttal_tokens = flatten_chunks(rebuttal_chunks)
+  review_ids = [token_ids(tokens, vocab) for tokens in review_tokens]
+  rebuttal_ids = [token_ids(tokens, vocab) for tokens in rebuttal_tokens]
+
+  # Every rebuttal chunk is hashed once into a shared index; each review chunk
+  # is then hashed once and joined against it.
+  index = collections.defaultdict(list)
+  num_hashes = num_seeds = 0
+  for j, ids in enumerate(rebuttal_ids):
+    hashes = rolling_hashes(ids, seed_window)
+    num_hashes += len(hashes)
+    build_index(hashes, index, key=j)
+
+  matches = {window: [] for window in windows}
+  for i, ids in enumerate(review_ids):
+    offsets_by_chunk = collections.defaultdict(list)
+    hashes = rolling_hashes(ids, seed_window)
+    num_hashes += len(hashes)
+    for review_offset, hash_value in enumerate(hashes):
+      for j, rebuttal_offset in index.get(hash_value, ()):
+        num_seeds += 1
+        if same_window(ids, review_offset, rebuttal_ids[j], rebuttal_offset,
+            seed_window):
+          offsets_by_chunk[j].append((review_offset, rebuttal_offset))
+
+    for j in sorted(offsets_by_chunk):
+      for (review_offset, rebuttal_offset) in offsets_by_chunk[j]:
+        lcs = find_lcs(review_tokens[i], rebuttal_tokens[j],
+          review_offset, rebuttal_offset)
+        lcs_text = " ".join(lcs)
+        match = None
+        for window in windows:
+          # Windows are ascending, so once a seed fails one it fails the rest.
+          if (len(lcs) < window
+              or review_offset >= num_windows(ids, window)
+              or rebuttal_offset >= num_windows(rebuttal_ids[j], window)):
+            break
+          window_matches = matches[window]
+          if window_matches and lcs_text in window_matches[-1].lcs:
+            continue
+          if match is None:
+            match = Match(Location(review_id, i, review_offset),
+              Location(rebuttal_id, j, rebuttal_offset), lcs_text)
+          window_matches.append(match)
+  instrument.count("hashes computed", num_hashes)
+  instrument.count("candidate seeds", num_seeds)
+  instrument.count("matches emitted",
+      sum(len(window_matches) for window_matches in matches.values()))
+  return matches
@@ -0,0 +1,215 @@
+"""MinHash signatures and a banded LSH index over text table chunks.
+
+Each chunk is reduced to its set of lowercased SHINGLE_SIZE-token shingles
+and summarized by NUM_PERM min-hashes. Signatures are stored in
+<table>_minhash and split into BANDS bands of ROWS hashes; each band is hashed
+into a bucket in <table>_lsh. Two chunks become candidates if they share a
+bucket in any band, which happens with probability 1 - (1 - s^ROWS)^BANDS for
+Jaccard similarity s (about 0.42 at the midpoint for the defaults).
+
+Every indexing run is tagged with a batch number, so chunks from a newly
+loaded conference can be added and compared against the existing index
+without recomputing anything already stored. Each comment's signatures are
+stored with a hash of its text; a comment whose text has changed since (or
+that was indexed before hashes were stored) is re-indexed in the new batch,
+and the rows of comments no longer in the text table are dropped.
+"""
+
+import hashlib
+import json
+import zlib
+
+import numpy as np
+
+import lib.db_lib as dbl
+import lib.schema as schema
+
+
+SHINGLE_SIZE = 3
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+PRIME = (1 << 31) - 1
+# Rows buffered before they are written.
+WRITE_BATCH = 50000
+
+# Fixed seed: stored signatures are only comparable under the same hashes.
+_rng = np.random.RandomState(20200901)
+PERM_A = _rng.randint(1, PRIME, size=NUM_PERM).astype(np.uint64)
+PERM_B = _rng.randint(0, PRIME, size=NUM_PERM).astype(np.uint64)
+
+
+MINHASH_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
+    comment_supernote text NOT NULL,
+    chunk_idx integer NOT NULL,
+    forum_id text NOT NULL,
+    batch integer NOT NULL,
+    signature blob NOT NULL,
+    text_hash text,
+    PRIMARY KEY (comment_supernote, chunk_idx))"""
+
+LSH_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
+    band integer NOT NULL,
+    bucket integer NOT NULL,
+    comment_supernote text NOT NULL,
+    chunk_idx integer NOT NULL,
+    batch integer NOT NULL)"""
+
+LSH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS {0}_bucket_idx ON {0} (band, bucket)",
+    "CREATE INDEX IF NOT EXISTS {0}_batch_idx ON {0} (batch)",
+    "CREATE INDEX IF NOT EXISTS {0}_comment_idx ON {0} (comment_supernote)",
+]
+
+INSERT_MINHASH = """INSERT INTO {0} (comment_supernote, chunk_idx, forum_id,
+    batch, signature, text_hash) VALUES (?, ?, ?, ?, ?, ?)"""
+
+INSERT_LSH = """INSERT INTO {0} (band, bucket, comment_supernote, chunk_idx,
+    batch) VALUES (?, ?, ?, ?, ?)"""
+
+# Pairs sharing a bucket where at least one side is from the given batch,
+# with both signatures and forums. Each unordered pair is reported once. The
+# batch's own rows are found through the batch index, their bucket-mates
+# through the (band, bucket) index, and signatures by _minhash's primary key,
+# so a query costs in proportion to the batch and its candidates.
+CANDIDATES = """SELECT pairs.*, m1.forum_id, m1.signature, m2.forum_id,
+      m2.signature
+    FROM (SELECT DISTINCT a.comment_supernote AS supernote_1,
+          a.chunk_idx AS chunk_1, b.comment_supernote AS supernote_2,
+          b.chunk_idx AS chunk_2
+        FROM {0} a JOIN {0} b ON a.band = b.band AND a.bucket = b.bucket
+        WHERE a.batch = ? AND a.comment_supernote != b.comment_supernote
+          AND (b.batch < a.batch OR (a.comment_supernote, a.chunk_idx) <
+            (b.comment_supernote, b.chunk_idx))) pairs
+    JOIN {1} m1 ON m1.comment_supernote = pairs.supernote_1
+      AND m1.chunk_idx = pairs.chunk_1
+    JOIN {1} m2 ON m2.comment_supernote = pairs.supernote_2
+      AND m2.chunk_idx = pairs.chunk_2"""
+
+
+def shingles(tokens):
+  tokens = [token.lower() for token in tokens]
+  if len(tokens) <= SHINGLE_SIZE:
+    return set([" ".join(tokens)]) if tokens else set()
+  return set(" ".join(tokens[i:i + SHINGLE_SIZE])
+      for i in range(len(tokens) - SHINGLE_SIZE + 1))
+
+
+def signature(tokens):
+  """MinHash signature (uint32 array of NUM_PERM) or None for no tokens."""
+  shingle_set = shingles(tokens)
+  if not shingle_set:
+    return None
+  ids = np.array([zlib.crc32(shingle.encode("utf-8")) % PRIME
+      for shingle in shingle_set], dtype=np.uint64)
+  hashed = (PERM_A[:, None] * ids[None, :] + PERM_B[:, None]) % PRIME
+  return hashed.min(axis=1).astype(np.uint32)
+
+
+def band_buckets(sig):
+  """One signed 64-bit bucket id per band."""
+  return [int.from_bytes(hashlib.blake2b(
+    sig[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest(),
+    "big", signed=True) for band in range(BANDS)]
+
+
+def estimate_jaccard(sig_1, sig_2):
+  return float(np.mean(sig_1 == sig_2))
+
+
+def text_hash(chunks):
+  """Hash of a comment's tokens and their chunk and sentence structure."""
+  return hashlib.blake2b(json.dumps(chunks).encode("utf-8"),
+      digest_size=16).hexdigest()
+
+
+def create_tables(cur, table_name):
+  cur.execute(MINHASH_TABLE.format(table_name + "_minhash"))
+  if "text_hash" not in schema.column_names(cur, table_name + "_minhash"):
+    cur.execute("ALTER TABLE {0} ADD COLUMN text_hash text".format(
+      table_name + "_minhash"))
+  cur.execute(LSH_TABLE.format(table_name + "_lsh"))
+  for index in LSH_INDEXES:
+    cur.execute(index.format(table_name + "_lsh"))
+
+
+def _remove_comments(cur, table_name, supernotes):
+  for table in [table_name + "_minhash", table_name + "_lsh"]:
+    cur.executemany("DELETE FROM {0} WHERE comment_supernote=?".format(table),
+        [(supernote,) for supernote in supernotes])
+
+
+def index_new_chunks(conn, table_name):
+  """Index new and changed comments. Returns the batch number.
+
+  Rows are written every WRITE_BATCH rows and committed once at the end, so
+  a run is indexed completely or not at all.
+  """
+  cur = conn.cursor()
+  create_tables(cur, table_name)
+  cur.execute("SELECT DISTINCT comment_supernote, text_hash FROM {0}".format(
+    table_name + "_minhash"))
+  indexed = {row["comment_supernote"]: row["text_hash"]
+      for row in cur.fetchall()}
+  cur.execute("SELECT COALESCE(MAX(batch), -1) + 1 AS batch FROM {0}".format(
+    table_name + "_minhash"))
+  batch = cur.fetchone()["batch"]
+  cur.execute("SELECT DISTINCT comment_supernote, forum_id FROM {0}".format(
+    table_name))
+  forums = {row["comment_supernote"]: row["forum_id"]
+      for row in cur.fetchall()}
+  _remove_comments(cur, table_name,
+      [supernote for supernote in indexed if supernote not in forums])
+
+  minhash_rows, lsh_rows = [], []
+
+  def write():
+    cur.executemany(INSERT_MINHASH.format(table_name + "_minhash"),
+        minhash_rows)
+    cur.executemany(INSERT_LSH.format(table_name + "_lsh"), lsh_rows)
+    del minhash_rows[:], lsh_rows[:]
+
+  for supernote, chunks in dbl.iter_comments(cur, table_name):
+    comment_hash = text_hash(chunks)
+    if supernote in indexed:
+      if indexed[supernote] == comment_hash:
+        continue
+      _remove_comments(cur, table_name, [supernote])
+    for chunk_idx, chunk in enumerate(chunks):
+      sig = signature([token for sentence in chunk for token in sentence])
+      if sig is None:
+        continue
+      minhash_rows.append((supernote, chunk_idx, forums[supernote], batch,
+        sig.tobytes(), comment_hash))
+      lsh_rows.extend((band, bucket, supernote, chunk_idx, batch)
+          for band, bucket in enumerate(band_buckets(sig)))
+    if len(lsh_rows) >= WRITE_BATCH:
+      write()
+  write()
+  conn.commit()
+  return batch
+
+
+def find_candidates(conn, table_name, batch, threshold, cross_forum=False):
+  """Near-duplicate chunk pairs involving the given batch.
+
+  Returns (supernote_1, chunk_1, supernote_2, chunk_2, estimated Jaccard)
+  for pairs at or above threshold. With cross_forum, pairs within one forum
+  are dropped.
+  """
+  cur = conn.cursor()
+  cur.row_factory = None
+  cur.execute(CANDIDATES.format(table_name + "_lsh", table_name + "_minhash"),
+      (batch,))
+
+  results = []
+  for (supernote_1, chunk_1, supernote_2, chunk_2, forum_1, sig_1, forum_2,
+      sig_2) in cur:
+    if cross_forum and forum_1 == forum_2:
+      continue
+    similarity = estimate_jaccard(np.frombuffer(sig_1, dtype=np.uint32),
+        np.frombuffer(sig_2, dtype=np.uint32))
+    if similarity >= threshold:
+      results.append(
+          (supernote_1, chunk_1, supernote_2, chunk_2, similarity))
+  return sorted(results)
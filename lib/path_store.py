@@ -0,0 +1,170 @@
+"""Compact on-disk store for characterized paths.
+
+The data file is JSON lines. Each characteristic label is written once, the
+first time a path uses it. Each comment is written the first time a path uses
+it within a run of consecutive paths with the same root (one forum tree, as
+characterize_forest emits them). Paths refer to both by index:
+
+  ["C", field, field, ...]             comment, numbered in order of appearance
+  ["L", "Conference_Reviewer0_Author"] label, numbered in order of appearance
+  ["P", label_idx, comment_idx, ...]   path, root first
+
+Records are only ever written after everything they refer to, so the file can
+be read front to back in one pass. The writer only remembers the comments of
+the current root, so its memory is bounded by the largest tree; a comment
+whose tree is written again later is simply written again. A binary sidecar index (<filename>.idx)
+holds the record counts and the byte offset of every record, so a reader can
+also jump straight to any path:
+
+  uint64 num_comments, num_labels, num_paths
+  uint64 offsets of comments, then labels, then paths
+"""
+
+import json
+import struct
+
+
+COMMENT = "C"
+LABEL = "L"
+PATH = "P"
+KINDS = [COMMENT, LABEL, PATH]
+
+_UINT64 = struct.Struct("<Q")
+
+
+def index_filename(filename):
+  return filename + ".idx"
+
+
+class PathWriter(object):
+  """Streaming writer; use as a context manager and call write per path."""
+
+  def __init__(self, filename):
+    self._filename = filename
+    self._f = open(filename, "wb")
+    self._offset = 0
+    self._offsets = {kind: [] for kind in KINDS}
+    self._root = None
+    self._comment_idx = {}
+    self._label_idx = {}
+
+  def _write_record(self, kind, record):
+    line = (json.dumps([kind] + record) + "\n").encode("utf-8")
+    self._offsets[kind].append(self._offset)
+    self._f.write(line)
+    self._offset += len(line)
+
+  def _intern(self, table, kind, key, record):
+    if key not in table:
+      table[key] = len(self._offsets[kind])
+      self._write_record(kind, record)
+    return table[key]
+
+  def write(self, comments, label):
+    if comments and tuple(comments[0]) != self._root:
+      # Paths with different roots share no comments.
+      self._root = tuple(comments[0])
+      self._comment_idx = {}
+    comment_idxs = [self._intern(self._comment_idx, COMMENT, tuple(comment),
+      list(comment)) for comment in comments]
+    label_idx = self._intern(self._label_idx, LABEL, label, [label])
+    self._write_record(PATH, [label_idx] + comment_idxs)
+
+  def close(self):
+    self._f.close()
+    with open(index_filename(self._filename), "wb") as f:
+      for kind in KINDS:
+        f.write(_UINT64.pack(len(self._offsets[kind])))
+      for kind in KINDS:
+        for offset in self._offsets[kind]:
+          f.write(_UINT64.pack(offset))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class PathReader(object):
+  """Lazy reader for files from PathWriter.
+
+  Iterating streams paths front to back. Indexing (reader[i]) seeks to path
+  i and loads only the comments and label it refers to, caching them.
+  Paths are returned as make_path(comments, label), and comments as
+  make_comment(*fields).
+  """
+
+  def __init__(self, filename, make_comment=None, make_path=None):
+    self._filename = filename
+    self._make_comment = make_comment or (lambda *fields: fields)
+    self._make_path = make_path or (lambda comments, label: (comments, label))
+    self._data = None
+    self._index = None
+    self._counts = None
+    self._cache = {COMMENT: {}, LABEL: {}}
+
+  def _build(self, kind, record):
+    if kind == COMMENT:
+      return self._make_comment(*record)
+    return record[0]
+
+  def __iter__(self):
+    loaded = {COMMENT: [], LABEL: []}
+    with open(self._filename, "rb") as f:
+      for line in f:
+        kind, *record = json.loads(line)
+        if kind == PATH:
+          label_idx, *comment_idxs = record
+          yield self._make_path(
+              [loaded[COMMENT][i] for i in comment_idxs],
+              loaded[LABEL][label_idx])
+        else:
+          loaded[kind].append(self._build(kind, record))
+
+  def _open(self):
+    if self._index is None:
+      self._data = open(self._filename, "rb")
+      self._index = open(index_filename(self._filename), "rb")
+      self._counts = [_UINT64.unpack(self._index.read(_UINT64.size))[0]
+          for _ in KINDS]
+
+  def _record(self, kind, i):
+    """Seek to record i of a kind via the index."""
+    self._open()
+    position = len(KINDS) + sum(self._counts[:KINDS.index(kind)]) + i
+    self._index.seek(position * _UINT64.size)
+    offset, = _UINT64.unpack(self._index.read(_UINT64.size))
+    self._data.seek(offset)
+    record_kind, *record = json.loads(self._data.readline())
+    assert record_kind == kind
+    return record
+
+  def _get(self, kind, i):
+    cache = self._cache[kind]
+    if i not in cache:
+      cache[i] = self._build(kind, self._record(kind, i))
+    return cache[i]
+
+  def __len__(self):
+    self._open()
+    return self._counts[KINDS.index(PATH)]
+
+  def __getitem__(self, i):
+    if not 0 <= i < len(self):
+      raise IndexError(i)
+    label_idx, *comment_idxs = self._record(PATH, i)
+    return self._make_path([self._get(COMMENT, j) for j in comment_idxs],
+        self._get(LABEL, label_idx))
+
+  def close(self):
+    if self._index is not None:
+      self._data.close()
+      self._index.close()
+      self._index = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
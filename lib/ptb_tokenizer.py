@@ -0,0 +1,183 @@
+"""Pure-Python tokenizer and sentence splitter imitating CoreNLP.
+
+Follows the PTB3 conventions of CoreNLP's default tokenize/ssplit pipeline
+closely enough for exact matching and chunk indices:
+
+* brackets are escaped (-LRB-, -RRB-, -LSB-, ...), double quotes become ``
+  and '', and en/em dashes become --
+* clitics are split off (do n't, it 's, they 're), cannot becomes can not
+* URLs, e-mail addresses, numbers with separators, hyphenated words, initials
+  (U.S.) and common abbreviations (e.g., Fig., et al.) stay one token
+* a sentence ends after . ! ? (plus any closing quotes or brackets), or at a
+  blank line, as with ssplit.newlineIsSentenceBreak=two
+
+tokenizer_agreement.py measures how often it reproduces CoreNLP's
+tokenization of the same raw note text.
+"""
+
+import multiprocessing
+import re
+
+import lib.tokenization as tok
+
+
+# Initialisms such as e.g. and U.S. are handled by the pattern itself.
+ABBREVIATIONS = ("Dr Mr Mrs Ms Prof Jr Sr St vs etc al cf approx resp "
+    "Fig Figs fig figs Eq Eqs Eqn eq eqn Sec Secs sec Tab Ref Refs Thm Lem "
+    "Def Prop Cor Alg Appx App Ch No Nos Vol pp Inc Ltd Corp Jan Feb Mar Apr "
+    "Jun Jul Aug Sep Sept Oct Nov Dec").split()
+
+TOKEN_RE = re.compile(r"""
+    (?P<url>(?:https?://|www\.)[^\s<>"]*[^\s<>".,;:!?)\]}'])
+  | (?P<email>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)
+  | (?P<ellipsis>\.\.\.+|…)
+  | (?P<abbrev>\b(?:(?:[A-Za-z]\.){2,}|(?:"""
+    + "|".join(ABBREVIATIONS) + r""")\.))
+  | (?P<number>\d+(?:[,.:/]\d+)*\w*(?:-\w+)*)
+  | (?P<word>\w+(?:[-'’]\w+)*)
+  | (?P<dashes>--+|[–—])
+  | (?P<bangs>[!?]+)
+  | (?P<other>\S)
+""", re.VERBOSE)
+
+CLITIC_RE = re.compile(r"(?i)^(.+?)(n['’]t|['’](?:s|m|d|re|ve|ll))$")
+
+BRACKETS = {"(": "-LRB-", ")": "-RRB-", "[": "-LSB-", "]": "-RSB-",
+    "{": "-LCB-", "}": "-RCB-"}
+CLOSING = set(["''", "'", "-RRB-", "-RSB-", "-RCB-"])
+
+
+def _split_word(word):
+  if word.lower() == "cannot":
+    return [word[:3], word[3:]]
+  match = CLITIC_RE.match(word)
+  if match is None:
+    return [word]
+  stem, clitic = match.groups()
+  return [stem, clitic.replace("’", "'")]
+
+
+def _quote(ch, text, start, end):
+  """`` / '' (or ` / ') depending on whether the quote opens or closes."""
+  before = text[start - 1] if start > 0 else " "
+  after = text[end] if end < len(text) else " "
+  opens = before.isspace() or before in "([{" or (
+      before in "\"'“‘" and not after.isspace())
+  if ch in "“‘":
+    opens = True
+  elif ch in "”’":
+    opens = False
+  double = ch in "\"“”"
+  if opens and not after.isspace():
+    return "``" if double else "`"
+  return "''" if double else "'"
+
+
+def tokenize_with_offsets(text):
+  """(token, start, end) triples, with PTB escaping applied to the tokens."""
+  tokens = []
+  for match in TOKEN_RE.finditer(text):
+    kind, token = match.lastgroup, match.group()
+    start, end = match.span()
+    if kind == "word":
+      position = start
+      for piece in _split_word(token):
+        tokens.append((piece, position, position + len(piece)))
+        position += len(piece)
+      continue
+    if kind == "ellipsis":
+      token = "..."
+    elif kind == "dashes":
+      token = "--"
+    elif kind == "other":
+      if token in BRACKETS:
+        token = BRACKETS[token]
+      elif token in "\"'“”‘’":
+        token = _quote(token, text, start, end)
+    elif kind == "abbrev" and end == len(text.rstrip()):
+      # CoreNLP ends a text-final abbreviation with an extra period.
+      tokens.append((token, start, end))
+      token, start = ".", end
+    tokens.append((token, start, end))
+  return tokens
+
+
+def _ends_sentence(tokens):
+  return bool(tokens) and (tokens[-1] == "." or tokens[-1][0] in "!?")
+
+
+def split_sentences(text, tokens):
+  """Group (token, start, end) triples into sentences of token strings."""
+  sentences = []
+  current = []
+  sentence_over = False
+  previous_end = 0
+  for token, start, end in tokens:
+    gap = text[previous_end:start]
+    blank_line = gap.count("\n") >= 2
+    if current and (blank_line or (sentence_over and token not in CLOSING)):
+      sentences.append(current)
+      current = []
+      sentence_over = False
+    current.append(token)
+    if _ends_sentence([token]):
+      sentence_over = True
+    previous_end = end
+  if current:
+    sentences.append(current)
+  return sentences
+
+
+def tokenize(text):
+  """Sentences of tokens, like CoreNLP tokenize/ssplit."""
+  return split_sentences(text, tokenize_with_offsets(text))
+
+
+class PTBTokenizerPool(object):
+  """Drop-in for TokenizerPool that needs no JVM; parallel over processes."""
+
+  def __init__(self, workers=None, chunksize=64):
+    self.chunksize = chunksize
+    self._pool = None if workers == 1 else multiprocessing.Pool(workers)
+    # text -> (AsyncResult of a prefetched batch, index in the batch)
+    self._in_flight = {}
+
+  def tokenize_many(self, texts):
+    if self._pool is None:
+      return [tokenize(text) for text in texts]
+    return self._pool.map(tokenize, texts, chunksize=self.chunksize)
+
+  def tokenize(self, text):
+    if text in self._in_flight:
+      batch, idx = self._in_flight.pop(text)
+      return batch.get()[idx]
+    return tokenize(text)
+
+  def prefetch(self, texts):
+    """Start tokenizing texts in the worker processes; returns at once."""
+    if self._pool is None:
+      return
+    texts = [text for text in dict.fromkeys(texts)
+        if text not in self._in_flight]
+    batch = self._pool.map_async(tokenize, texts, chunksize=self.chunksize)
+    for idx, text in enumerate(texts):
+      self._in_flight[text] = (batch, idx)
+
+  def discard_prefetched(self):
+    """Forget prefetched texts that were never collected."""
+    self._in_flight.clear()
+
+  def annotate(self, text):
+    return tok.to_conll(self.tokenize(text))
+
+  def close(self):
+    self._in_flight.clear()
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
@@ -0,0 +1,84 @@
+"""Forum-level quote attribution: which review chunk each quoted span is from.
+
+karp_rabin.find_matches compares one review with one rebuttal, so a forum
+with R reviews and B replies hashes every chunk R * B times. A QuoteIndex
+hashes every chunk of every review in a forum once into a shared seed table.
+Each reply is then hashed once and joined against all of the reviews at the
+same time.
+
+For one review and one reply, the quotes attributed to that review are
+exactly the matches find_matches(reply, review) reports, with the same
+window, final-window rule and dedup.
+"""
+
+import collections
+
+import lib.instrument as instrument
+import lib.karp_rabin as kr
+
+
+Quote = collections.namedtuple("Quote",
+    "review_location comment_location lcs".split())
+
+
+class QuoteIndex(object):
+  """Seed table over the reviews of one forum."""
+
+  def __init__(self, window=kr.WINDOW):
+    self.window = window
+    self.vocab = {}
+    self.index = collections.defaultdict(list)
+    self.review_order = []
+    self.tokens = {}
+    self.ids = {}
+
+  def add_review(self, review_id, chunks):
+    self.review_order.append(review_id)
+    num_hashes = 0
+    for i, tokens in enumerate(kr.flatten_chunks(chunks)):
+      ids = kr.token_ids(tokens, self.vocab)
+      self.tokens[(review_id, i)] = tokens
+      self.ids[(review_id, i)] = ids
+      hashes = kr.rolling_hashes(ids, self.window)
+      num_hashes += len(hashes)
+      kr.build_index(hashes, self.index, key=(review_id, i))
+    instrument.count("hashes computed", num_hashes)
+
+  def find_quotes(self, comment_id, chunks):
+    """Quotes of the indexed reviews in one comment.
+
+    Ordered by review (in the order they were added), then as find_matches
+    orders the matches of one pair.
+    """
+    seeds = collections.defaultdict(lambda: collections.defaultdict(list))
+    comment_tokens = kr.flatten_chunks(chunks)
+    num_hashes = num_seeds = 0
+    for j, tokens in enumerate(comment_tokens):
+      ids = kr.token_ids(tokens, self.vocab)
+      hashes = kr.rolling_hashes(ids, self.window)
+      num_hashes += len(hashes)
+      for comment_offset, hash_value in enumerate(hashes):
+        for (review_id, i), review_offset in self.index.get(hash_value, ()):
+          num_seeds += 1
+          if kr.same_window(self.ids[(review_id, i)], review_offset, ids,
+              comment_offset, self.window):
+            seeds[review_id][(i, j)].append((review_offset, comment_offset))
+
+    quotes = []
+    for review_id in self.review_order:
+      # Dedup only against the previous quote of the same review, as
+      # find_matches does within a pair.
+      last_lcs = None
+      for (i, j), offsets in sorted(seeds[review_id].items()):
+        for review_offset, comment_offset in sorted(offsets):
+          lcs = " ".join(kr.find_lcs(self.tokens[(review_id, i)],
+            comment_tokens[j], review_offset, comment_offset))
+          if last_lcs is not None and lcs in last_lcs:
+            continue
+          quotes.append(Quote(kr.Location(review_id, i, review_offset),
+            kr.Location(comment_id, j, comment_offset), lcs))
+          last_lcs = lcs
+    instrument.count("hashes computed", num_hashes)
+    instrument.count("candidate seeds", num_seeds)
+    instrument.count("quotes attributed", len(quotes))
+    return quotes
@@ -0,0 +1,213 @@
+"""Versioned indexes for the text, pairs, _em and _quotes tables, and the
+per-comment summary tables (lib/summary.py) built from the text tables.
+
+The schema version is kept in SQLite's user_version pragma. migrate() applies
+every migration newer than the stored version, in order, so existing DB files
+are upgraded in place.
+
+Indexes on the token-per-row text tables deliberately never include the token
+itself: queries without an ORDER BY return rows in index order, and
+crunch_text_rows relies on tokens within a sentence coming back in rowid
+order.
+"""
+
+import sqlite3
+
+import lib.db_lib as dbl
+import lib.summary as summary
+
+
+def text_table_indexes(table_name):
+  return [
+      ("CREATE INDEX IF NOT EXISTS {0}_supernote_idx ON {0} "
+       "(comment_supernote, chunk_idx, sentence_idx)").format(table_name),
+      ("CREATE INDEX IF NOT EXISTS {0}_split_idx ON {0} "
+       "(split, comment_supernote, comment_type, author_type)").format(
+         table_name),
+      ("CREATE INDEX IF NOT EXISTS {0}_forum_idx ON {0} "
+       "(forum_id, split)").format(table_name),
+  ]
+
+
+def pairs_table_indexes(table_name):
+  return [
+      ("CREATE INDEX IF NOT EXISTS {0}_split_idx ON {0} "
+       "(split)").format(table_name + "_pairs"),
+  ]
+
+
+def em_table_indexes(table_name):
+  # The supernote columns of _em are swapped relative to their names; see
+  # exact_matches.write_results. Lookups are by (rebuttal, review) pair.
+  return [
+      ("CREATE INDEX IF NOT EXISTS {0}_pair_idx ON {0} "
+       "(rebuttal_supernote, review_supernote)").format(table_name + "_em"),
+      ("CREATE INDEX IF NOT EXISTS {0}_split_idx ON {0} "
+       "(split)").format(table_name + "_em"),
+  ]
+
+
+def quote_table_indexes(table_name):
+  return [
+      ("CREATE INDEX IF NOT EXISTS {0}_comment_idx ON {0} "
+       "(comment_supernote)").format(table_name + "_quotes"),
+      ("CREATE INDEX IF NOT EXISTS {0}_review_idx ON {0} "
+       "(review_supernote, review_chunk_idx)").format(table_name + "_quotes"),
+      ("CREATE INDEX IF NOT EXISTS {0}_split_idx ON {0} "
+       "(split, forum_id)").format(table_name + "_quotes"),
+  ]
+
+
+def table_exists(cur, table_name):
+  cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+      (table_name,))
+  return cur.fetchone() is not None
+
+
+def create_indexes(cur, table_name, indexes):
+  """Run index statements if the table exists; returns whether it did."""
+  if not table_exists(cur, table_name):
+    return False
+  for statement in indexes:
+    cur.execute(statement)
+  return True
+
+
+def index_name(statement):
+  """Name of the index a CREATE INDEX IF NOT EXISTS statement creates."""
+  return statement.split("IF NOT EXISTS", 1)[1].split()[0]
+
+
+def drop_indexes(cur, indexes):
+  for statement in indexes:
+    cur.execute("DROP INDEX IF EXISTS {0}".format(index_name(statement)))
+
+
+def column_names(cur, table_name):
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  return [row[1] for row in cur.execute(
+      "PRAGMA table_info({0})".format(table_name))]
+
+
+def add_em_window_column(cur, table_name):
+  """Tag _em rows with the window they were matched at.
+
+  Rows written before windows were configurable were all matched at 5 tokens.
+  """
+  em = table_name + "_em"
+  if table_exists(cur, em) and "window_size" not in column_names(cur, em):
+    cur.execute("ALTER TABLE {0} ADD COLUMN window_size integer NOT NULL "
+        "DEFAULT 5".format(em))
+
+
+def migrate_v1(cur):
+  for table_name in dbl.TextTables.ALL:
+    create_indexes(cur, table_name, text_table_indexes(table_name))
+    create_indexes(cur, table_name + "_pairs", pairs_table_indexes(table_name))
+    create_indexes(cur, table_name + "_em", em_table_indexes(table_name))
+
+
+def migrate_v2(cur):
+  for table_name in dbl.TextTables.ALL:
+    if table_exists(cur, table_name):
+      summary.rebuild(cur, table_name)
+
+
+def migrate_v3(cur):
+  for table_name in dbl.TextTables.ALL:
+    add_em_window_column(cur, table_name)
+
+
+# MIGRATIONS[i] upgrades a DB from version i to version i + 1.
+MIGRATIONS = [migrate_v1, migrate_v2, migrate_v3]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def set_journal_mode(conn, mode):
+  """Persistently switch a DB's journal mode, e.g. to "wal" or "delete".
+
+  WAL lets readers run alongside a writer, but the file then needs its -wal
+  and -shm companions and a sqlite3 new enough to read it, so it is opt-in
+  (migrate_db.py --journal_mode wal) rather than part of MIGRATIONS. Returns
+  the mode in effect afterwards.
+  """
+  cur = conn.cursor()
+  cur.row_factory = None
+  new_mode, = cur.execute("PRAGMA journal_mode={0}".format(mode)).fetchone()
+  return new_mode
+
+
+def get_version(cur):
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  version, = cur.execute("PRAGMA user_version").fetchone()
+  return version
+
+
+def migrate(conn):
+  """Bring a DB up to SCHEMA_VERSION. Returns the version it started at."""
+  cur = conn.cursor()
+  start_version = get_version(cur)
+  for version in range(start_version, SCHEMA_VERSION):
+    MIGRATIONS[version](cur)
+    cur.execute("PRAGMA user_version = {0}".format(version + 1))
+    conn.commit()
+  if start_version < SCHEMA_VERSION:
+    cur.execute("ANALYZE")
+    conn.commit()
+  return start_version
+
+
+def script_queries(table_name):
+  """(description, query, params) for queries the analysis scripts run."""
+  pairs, em = table_name + "_pairs", table_name + "_em"
+  return [
+      ("pairs in split", "SELECT * FROM {0} WHERE split=?".format(pairs),
+        ("train",)),
+      ("comment text",
+        "SELECT * FROM {0} WHERE comment_supernote=?".format(table_name),
+        ("",)),
+      ("split text", "SELECT * FROM {0} WHERE split=?".format(table_name),
+        ("train",)),
+      ("prefetch split text",
+        ("SELECT forum_id, comment_supernote, chunk_idx, sentence_idx, token "
+         "FROM {0} WHERE comment_supernote IN ("
+         "SELECT review_supernote FROM {1} WHERE split=? "
+         "UNION SELECT rebuttal_supernote FROM {1} WHERE split=?) "
+         "ORDER BY rowid").format(table_name, pairs), ("train", "train")),
+      ("forum count",
+        "SELECT COUNT(DISTINCT forum_id) FROM {0} WHERE split=?".format(
+          table_name), ("train",)),
+      ("comment count",
+        "SELECT COUNT(DISTINCT comment_supernote) FROM {0} WHERE "
+        "split=?".format(table_name), ("train",)),
+      ("comment types",
+        "SELECT DISTINCT comment_type, comment_supernote FROM {0} WHERE "
+        "split=?".format(table_name), ("train",)),
+      ("author types",
+        "SELECT DISTINCT author_type, comment_supernote FROM {0} WHERE "
+        "split=?".format(table_name), ("train",)),
+      ("delete pair matches",
+        "DELETE FROM {0} WHERE rebuttal_supernote=? AND "
+        "review_supernote=?".format(em), ("", "")),
+  ]
+
+
+def explain(cur, query, params):
+  cur.execute("EXPLAIN QUERY PLAN " + query, params)
+  return [row["detail"] for row in cur.fetchall()]
+
+
+def query_plans(conn):
+  """{(table, description): plan lines} for the queries that can run."""
+  cur = conn.cursor()
+  plans = {}
+  for table_name in dbl.TextTables.ALL:
+    for description, query, params in script_queries(table_name):
+      try:
+        plans[(table_name, description)] = explain(cur, query, params)
+      except sqlite3.OperationalError:
+        # Table not created yet, e.g. _em before exact_matches has run.
+        continue
+  return plans
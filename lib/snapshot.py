@@ -0,0 +1,279 @@
+"""Columnar, memory-mapped snapshots of the text tables.
+
+A snapshot is one file holding the tokens of a set of comments as flat
+arrays:
+
+  tokens            int32 token ids, in comment, chunk, sentence order
+  sentence_offsets  int64, sentence s is tokens[o[s]:o[s + 1]]
+  chunk_offsets     int64, chunk c is sentences o[c]:o[c + 1]
+  comment_offsets   int64, comment k is chunks o[k]:o[k + 1]
+  vocabulary        token id -> token string
+  metadata columns  one string per comment: table, supernote, forum_id,
+                    split, parent_supernote, comment_type, author,
+                    author_type
+
+Strings are stored as a UTF-8 blob plus int64 offsets, so nothing has to be
+parsed when a snapshot is opened. The file starts with MAGIC, the length of a
+JSON header and the header itself, which records the dtype, length and
+position of every array. Arrays are aligned to ALIGNMENT bytes.
+
+Snapshot maps the file read-only and exposes every array as a NumPy view of
+the mapping, so opening is O(1), nothing is copied, and processes on one
+machine share a single copy of the corpus through the page cache.
+Comments are in the order dbl.iter_comments returns them, and
+Snapshot.iter_comments yields the same (supernote, chunks) pairs.
+"""
+
+import array
+import collections
+import json
+import os
+import struct
+
+import numpy as np
+
+import lib.db_lib as dbl
+
+
+MAGIC = b"ORSNAP01"
+VERSION = 1
+ALIGNMENT = 64
+
+METADATA_FIELDS = ("table supernote forum_id split parent_supernote "
+                   "comment_type author author_type").split()
+
+CommentMetadata = collections.namedtuple("CommentMetadata", METADATA_FIELDS)
+
+EXPORT_TEXT = """SELECT comment_supernote, chunk_idx, sentence_idx, token,
+    forum_id, split, parent_supernote, comment_type, author, author_type
+    FROM {0} {1} ORDER BY comment_supernote, chunk_idx, sentence_idx, rowid"""
+
+
+def _string_arrays(strings):
+  """(UTF-8 blob, int64 offsets) for a list of strings."""
+  encoded = [("" if s is None else s).encode("utf-8") for s in strings]
+  offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+  np.cumsum(np.array([len(e) for e in encoded], dtype=np.int64),
+      out=offsets[1:])
+  return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class StringColumn(object):
+  """Read-only sequence of strings over a blob and an offsets array."""
+
+  def __init__(self, blob, offsets):
+    self.blob = blob
+    self.offsets = offsets
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self)
+    return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode(
+        "utf-8")
+
+  def __iter__(self):
+    blob = self.blob.tobytes()
+    offsets = self.offsets.tolist()
+    for start, end in zip(offsets, offsets[1:]):
+      yield blob[start:end].decode("utf-8")
+
+
+class _Builder(object):
+  """Accumulates comments into flat arrays while the DB is streamed."""
+
+  def __init__(self):
+    self.vocab = {}
+    self.tokens = array.array("i")
+    self.sentence_offsets = array.array("q", [0])
+    self.chunk_offsets = array.array("q", [0])
+    self.comment_offsets = array.array("q", [0])
+    self.metadata = {field: [] for field in METADATA_FIELDS}
+
+  def add_comment(self, metadata, chunks):
+    for field, value in zip(METADATA_FIELDS, metadata):
+      self.metadata[field].append(value)
+    for chunk in chunks:
+      for sentence in chunk:
+        self.tokens.extend(self.vocab.setdefault(token, len(self.vocab))
+            for token in sentence)
+        self.sentence_offsets.append(len(self.tokens))
+      self.chunk_offsets.append(len(self.sentence_offsets) - 1)
+    self.comment_offsets.append(len(self.chunk_offsets) - 1)
+
+  def arrays(self):
+    arrays = collections.OrderedDict([
+        ("tokens", np.frombuffer(self.tokens, dtype=np.int32)),
+        ("sentence_offsets", np.frombuffer(self.sentence_offsets,
+          dtype=np.int64)),
+        ("chunk_offsets", np.frombuffer(self.chunk_offsets, dtype=np.int64)),
+        ("comment_offsets", np.frombuffer(self.comment_offsets,
+          dtype=np.int64)),
+    ])
+    vocabulary = sorted(self.vocab, key=self.vocab.get)
+    for name, strings in [("vocabulary", vocabulary)] + [
+        (field, self.metadata[field]) for field in METADATA_FIELDS]:
+      arrays[name + "_blob"], arrays[name + "_offsets"] = _string_arrays(
+          strings)
+    return arrays
+
+
+def _align(n):
+  return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write(path, arrays, info):
+  """Write named 1-d arrays and a JSON-serializable info dict to path."""
+  layout = collections.OrderedDict()
+  position = 0
+  for name, values in arrays.items():
+    layout[name] = {"dtype": values.dtype.str, "length": len(values),
+        "offset": position}
+    position = _align(position + values.nbytes)
+  header = json.dumps({"version": VERSION, "info": info,
+    "arrays": layout}).encode("utf-8")
+  data_start = _align(len(MAGIC) + 8 + len(header))
+
+  with open(path + ".tmp", "wb") as f:
+    f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+    for name, values in arrays.items():
+      f.seek(data_start + layout[name]["offset"])
+      f.write(values.tobytes())
+    f.truncate(data_start + position)
+  os.replace(path + ".tmp", path)
+
+
+def export(cur, path, table_names=None, split=None):
+  """Snapshot every comment of the given text tables (or one split of them).
+
+  Returns the number of comments written.
+  """
+  if table_names is None:
+    table_names = dbl.TextTables.ALL
+  builder = _Builder()
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  for table_name in table_names:
+    if split is None:
+      cur.execute(EXPORT_TEXT.format(table_name, ""))
+    else:
+      cur.execute(EXPORT_TEXT.format(table_name, "WHERE split=?"), (split,))
+    metadata = {}
+
+    def rows():
+      for row in cur:
+        if row[0] not in metadata:
+          metadata[row[0]] = (table_name, row[0]) + row[4:]
+        yield row[:4]
+
+    for supernote, chunks in dbl.stream_text_rows(rows()):
+      builder.add_comment(metadata.pop(supernote), chunks)
+  write(path, builder.arrays(), {"tables": list(table_names), "split": split})
+  return len(builder.comment_offsets) - 1
+
+
+class Snapshot(object):
+  """Zero-copy reader for a snapshot file.
+
+  Token id arrays returned by the methods below are views of the mapped
+  file; use decode() or vocabulary to turn ids back into strings.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    if self.buffer[:len(MAGIC)].tobytes() != MAGIC:
+      raise ValueError("{0} is not a snapshot file".format(path))
+    header_length, = struct.unpack("<Q",
+        self.buffer[len(MAGIC):len(MAGIC) + 8].tobytes())
+    header_start = len(MAGIC) + 8
+    header = json.loads(self.buffer[header_start:
+      header_start + header_length].tobytes().decode("utf-8"))
+    self.info = header["info"]
+    data_start = _align(header_start + header_length)
+
+    self.arrays = {}
+    for name, entry in header["arrays"].items():
+      dtype = np.dtype(entry["dtype"])
+      start = data_start + entry["offset"]
+      self.arrays[name] = self.buffer[
+          start:start + entry["length"] * dtype.itemsize].view(dtype)
+
+    self.tokens = self.arrays["tokens"]
+    self.sentence_offsets = self.arrays["sentence_offsets"]
+    self.chunk_offsets = self.arrays["chunk_offsets"]
+    self.comment_offsets = self.arrays["comment_offsets"]
+    self.vocabulary = self._strings("vocabulary")
+    self.columns = {field: self._strings(field) for field in METADATA_FIELDS}
+    self._index = None
+    self._decoder = None
+
+  def _strings(self, name):
+    return StringColumn(self.arrays[name + "_blob"],
+        self.arrays[name + "_offsets"])
+
+  def __len__(self):
+    return len(self.comment_offsets) - 1
+
+  def metadata(self, k):
+    return CommentMetadata(*[self.columns[field][k]
+      for field in METADATA_FIELDS])
+
+  def index(self, supernote):
+    """Position of a comment, by supernote."""
+    if self._index is None:
+      self._index = {supernote: k
+          for k, supernote in enumerate(self.columns["supernote"])}
+    return self._index[supernote]
+
+  def num_chunks(self, k):
+    return int(self.comment_offsets[k + 1] - self.comment_offsets[k])
+
+  def _token_span(self, first_chunk, end_chunk):
+    return self.tokens[self.sentence_offsets[self.chunk_offsets[first_chunk]]:
+        self.sentence_offsets[self.chunk_offsets[end_chunk]]]
+
+  def comment_tokens(self, k):
+    """Token ids of comment k, all chunks concatenated."""
+    return self._token_span(self.comment_offsets[k],
+        self.comment_offsets[k + 1])
+
+  def chunk_tokens(self, k, chunk_idx):
+    chunk = self.comment_offsets[k] + chunk_idx
+    return self._token_span(chunk, chunk + 1)
+
+  def chunks(self, k):
+    """Token ids of each chunk of comment k, one view per chunk."""
+    return [self.chunk_tokens(k, chunk_idx)
+        for chunk_idx in range(self.num_chunks(k))]
+
+  def sentences(self, k, chunk_idx):
+    chunk = self.comment_offsets[k] + chunk_idx
+    offsets = self.sentence_offsets[
+        self.chunk_offsets[chunk]:self.chunk_offsets[chunk + 1] + 1]
+    return [self.tokens[start:end]
+        for start, end in zip(offsets[:-1], offsets[1:])]
+
+  def decode(self, ids):
+    if self._decoder is None:
+      self._decoder = list(self.vocabulary)
+    return [self._decoder[i] for i in ids.tolist()]
+
+  def text(self, k):
+    """Comment k as chunks of sentences of tokens, as crunch_text_rows."""
+    return [[self.decode(sentence) for sentence in self.sentences(k, chunk_idx)]
+        for chunk_idx in range(self.num_chunks(k))]
+
+  def iter_comments(self, table_name=None, split=None):
+    """(supernote, chunks) pairs, as dbl.iter_comments yields them."""
+    tables = list(self.columns["table"])
+    splits = list(self.columns["split"])
+    supernotes = list(self.columns["supernote"])
+    for k in range(len(self)):
+      if table_name is not None and tables[k] != table_name:
+        continue
+      if split is not None and splits[k] != split:
+        continue
+      yield supernotes[k], self.text(k)
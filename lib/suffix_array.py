@@ -0,0 +1,206 @@
+"""Maximal exact matches between a review and a rebuttal via a suffix array.
+
+This is an alternative to karp_rabin.find_matches. All chunks of both
+comments are concatenated into one token id stream (each chunk followed by a
+unique separator), a suffix array and LCP array are built over it, and the
+LCP interval tree is walked bottom-up to report every maximal common
+substring of at least WINDOW tokens (or a given window) between a review
+chunk and a rebuttal chunk.
+"""
+
+import lib.instrument as instrument
+from lib.karp_rabin import WINDOW, Location, Match, flatten_chunks, token_ids
+
+
+REVIEW = 0
+REBUTTAL = 1
+
+
+def _bucket_sort(positions, rank, num_ranks):
+  """Stable sort of positions by rank, in O(len(positions) + num_ranks)."""
+  buckets = [[] for _ in range(num_ranks)]
+  for i in positions:
+    buckets[rank[i]].append(i)
+  return [i for bucket in buckets for i in bucket]
+
+
+def suffix_array(seq):
+  """Suffix array of a sequence of ints by prefix doubling.
+
+  Each round orders suffixes by (rank[i], rank[i + k]) with a two-pass radix
+  sort: the order by the second key is read off the previous round's array,
+  and one stable bucket pass by the first key finishes it. That makes a round
+  O(n) and the whole build O(n log n).
+  """
+  n = len(seq)
+  if n == 0:
+    return []
+  sorted_values = {v: r for r, v in enumerate(sorted(set(seq)))}
+  rank = [sorted_values[v] for v in seq]
+  num_ranks = len(sorted_values)
+  sa = _bucket_sort(range(n), rank, num_ranks)
+  k = 1
+  while num_ranks < n:
+    # Suffixes with no second half sort first, then the rest by the rank of
+    # their second half, which is the order of sa.
+    by_second = list(range(n - k, n)) + [i - k for i in sa if i >= k]
+    sa = _bucket_sort(by_second, rank, num_ranks)
+    new_rank = [0] * n
+    for prev, curr in zip(sa, sa[1:]):
+      new_rank[curr] = new_rank[prev] + (rank[prev] != rank[curr] or (
+          rank[prev + k] if prev + k < n else -1) != (
+          rank[curr + k] if curr + k < n else -1))
+    rank = new_rank
+    num_ranks = rank[sa[-1]] + 1
+    k *= 2
+  return sa
+
+
+def lcp_array(seq, sa):
+  """Kasai's algorithm: lcp[i] is the LCP of suffixes sa[i-1] and sa[i]."""
+  n = len(seq)
+  rank = [0] * n
+  for i, suffix in enumerate(sa):
+    rank[suffix] = i
+  lcp = [0] * n
+  h = 0
+  for suffix in range(n):
+    if rank[suffix] == 0:
+      h = 0
+      continue
+    other = sa[rank[suffix] - 1]
+    while (suffix + h < n and other + h < n
+        and seq[suffix + h] == seq[other + h]):
+      h += 1
+    lcp[rank[suffix]] = h
+    if h:
+      h -= 1
+  return lcp
+
+
+def build_stream(review_ids, rebuttal_ids):
+  """Concatenate chunks with unique negative separators.
+
+  Returns the stream, plus for every position either None (a separator) or a
+  (side, chunk_idx, token_idx) triple.
+  """
+  stream = []
+  owners = []
+  for side, chunks in ((REVIEW, review_ids), (REBUTTAL, rebuttal_ids)):
+    for chunk_idx, ids in enumerate(chunks):
+      stream.extend(ids)
+      owners.extend((side, chunk_idx, token_idx)
+          for token_idx in range(len(ids)))
+      stream.append(-len(stream) - 1)
+      owners.append(None)
+  return stream, owners
+
+
+def _left_key(stream, owners, position):
+  # Suffixes that start a chunk are left-maximal against anything, so they get
+  # a key no other position can share.
+  if owners[position][2] == 0:
+    return ("start", position)
+  return stream[position - 1]
+
+
+def _merge(node_groups, child_groups, length, emit, min_length):
+  """Add a child's suffixes to a node, emitting pairs that diverge at length.
+
+  Every (review, rebuttal) position pair with different left contexts is
+  emitted, so the output is not bounded by the input size: a phrase repeated
+  r times in the review and b times in the rebuttal yields r * b matches.
+  karp_rabin.find_matches reports the same r * b seeds.
+  """
+  if length < min_length:
+    return
+  for child_key, (child_reviews, child_rebuttals) in child_groups.items():
+    for node_key, (node_reviews, node_rebuttals) in node_groups.items():
+      if child_key == node_key:
+        continue
+      for review_pos in child_reviews:
+        for rebuttal_pos in node_rebuttals:
+          emit(review_pos, rebuttal_pos, length)
+      for review_pos in node_reviews:
+        for rebuttal_pos in child_rebuttals:
+          emit(review_pos, rebuttal_pos, length)
+  for key, (reviews, rebuttals) in child_groups.items():
+    group = node_groups.setdefault(key, ([], []))
+    group[0].extend(reviews)
+    group[1].extend(rebuttals)
+
+
+def maximal_matches(stream, owners, min_length=WINDOW):
+  """All (review_pos, rebuttal_pos, length) maximal matches of >= min_length.
+
+  Building the arrays is O(n log n) in the stream length; the number of
+  matches can be quadratic on repetitive text (see _merge).
+  """
+  sa = suffix_array(stream)
+  lcp = lcp_array(stream, sa)
+  results = []
+  emit = lambda review_pos, rebuttal_pos, length: results.append(
+      (review_pos, rebuttal_pos, length))
+
+  def leaf_groups(position):
+    if owners[position] is None:
+      return {}
+    side = owners[position][0]
+    group = ([], [])
+    group[side].append(position)
+    return {_left_key(stream, owners, position): group}
+
+  # Each stack entry is [lcp value, groups]. Groups are only kept for
+  # intervals of at least min_length, since shallower ones cannot emit.
+  stack = [[0, {}]]
+  n = len(sa)
+  for i in range(n):
+    h = lcp[i + 1] if i + 1 < n else 0
+    child = leaf_groups(sa[i])
+    while h < stack[-1][0]:
+      length, groups = stack.pop()
+      _merge(groups, child, length, emit, min_length)
+      child = groups
+    if h > stack[-1][0]:
+      stack.append([h, child if h >= min_length else {}])
+    elif stack[-1][0] >= min_length:
+      _merge(stack[-1][1], child, stack[-1][0], emit, min_length)
+  return results
+
+
+def find_matches(rebuttal, review, window=WINDOW):
+  return find_matches_multi(rebuttal, review, [window])[window]
+
+
+def find_matches_multi(rebuttal, review, windows=(WINDOW,)):
+  """{window: matches} for several window sizes from one suffix array.
+
+  Maximal matches are found once at the smallest window; each window keeps
+  those at least that long.
+  """
+  windows = sorted(set(windows))
+  (review_id, review_chunks), = review.items()
+  (rebuttal_id, rebuttal_chunks), = rebuttal.items()
+
+  vocab = {}
+  review_tokens = flatten_chunks(review_chunks)
+  review_ids = [token_ids(tokens, vocab) for tokens in review_tokens]
+  rebuttal_ids = [token_ids(tokens, vocab)
+      for tokens in flatten_chunks(rebuttal_chunks)]
+
+  stream, owners = build_stream(review_ids, rebuttal_ids)
+  found = []
+  for review_pos, rebuttal_pos, length in maximal_matches(stream, owners,
+      windows[0]):
+    _, i, review_offset = owners[review_pos]
+    _, j, rebuttal_offset = owners[rebuttal_pos]
+    found.append((Match(Location(review_id, i, review_offset),
+      Location(rebuttal_id, j, rebuttal_offset),
+      " ".join(review_tokens[i][review_offset:review_offset + length])),
+      length))
+  found.sort()
+  matches = {window: [match for match, length in found if length >= window]
+      for window in windows}
+  instrument.count("matches emitted",
+      sum(len(window_matches) for window_matches in matches.values()))
+  return matches
@@ -0,0 +1,215 @@
+"""Per-comment summary of the token-per-row text tables.
+
+<table>_summary has one row per comment with its forum, split, types and
+chunk/sentence/token counts, so per-split statistics need a pass over a few
+thousand summary rows instead of millions of token rows.
+
+The summary is refreshed by the ingest code (see bulk_load) or by rebuild().
+Alternatively, install_triggers() keeps it current on every token INSERT or
+DELETE. The trigger SQL depends on the table's columns. If the table has a
+token_idx column (as synthetic corpora do), a token with token_idx 0 starts a
+sentence and one that also has sentence_idx 0 starts a chunk; these triggers
+assume whole sentences are inserted and deleted, which is how the text tables
+are written. Tables written by ingest have no token_idx, so a token starts
+(or its deletion ends) a sentence or chunk if no other row of that sentence
+or chunk exists, which is an index lookup on
+(comment_supernote, chunk_idx, sentence_idx); install_triggers() creates
+that index if it is missing.
+"""
+
+import collections
+
+SUMMARY_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
+    comment_supernote text PRIMARY KEY,
+    forum_id text,
+    split text,
+    comment_type text,
+    author_type text,
+    num_chunks integer NOT NULL,
+    num_sentences integer NOT NULL,
+    num_tokens integer NOT NULL)"""
+
+SUMMARY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS {0}_split_idx ON {0} (split, forum_id)",
+]
+
+COLUMNS = ("comment_supernote forum_id split comment_type author_type "
+    "num_chunks num_sentences num_tokens").split()
+
+# Per-comment rows in COLUMNS order, straight from a text table ({0}), with an
+# optional WHERE clause ({1}). Grouping by sentence first lets the outer
+# GROUP BY count sentences as rows; both passes follow the
+# (comment_supernote, chunk_idx, sentence_idx) index.
+AGGREGATE = """SELECT comment_supernote, MIN(forum_id), MIN(split),
+      MIN(comment_type), MIN(author_type), COUNT(DISTINCT chunk_idx),
+      COUNT(*), SUM(num_tokens)
+    FROM (SELECT comment_supernote, MIN(forum_id) AS forum_id,
+        MIN(split) AS split, MIN(comment_type) AS comment_type,
+        MIN(author_type) AS author_type, chunk_idx, sentence_idx,
+        COUNT(*) AS num_tokens
+      FROM {0} {1}
+      GROUP BY comment_supernote, chunk_idx, sentence_idx)
+    GROUP BY comment_supernote"""
+
+REBUILD = "INSERT OR REPLACE INTO {0} (" + ", ".join(COLUMNS) + ") {1}"
+
+# {2} and {3} are whether the inserted token starts a new chunk and a new
+# sentence.
+INSERT_TRIGGER = """CREATE TRIGGER IF NOT EXISTS {0}_insert_trigger
+    AFTER INSERT ON {1} BEGIN
+      INSERT INTO {0} (comment_supernote, forum_id, split, comment_type,
+        author_type, num_chunks, num_sentences, num_tokens)
+      VALUES (NEW.comment_supernote, NEW.forum_id, NEW.split,
+        NEW.comment_type, NEW.author_type, {2}, {3}, 1)
+      ON CONFLICT (comment_supernote) DO UPDATE SET
+        num_chunks = num_chunks + excluded.num_chunks,
+        num_sentences = num_sentences + excluded.num_sentences,
+        num_tokens = num_tokens + 1;
+    END"""
+
+# {2} and {3} are whether the deleted token ended a chunk and a sentence.
+DELETE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS {0}_delete_trigger
+    AFTER DELETE ON {1} BEGIN
+      UPDATE {0} SET
+        num_chunks = num_chunks - ({2}),
+        num_sentences = num_sentences - ({3}),
+        num_tokens = num_tokens - 1
+      WHERE comment_supernote = OLD.comment_supernote;
+      DELETE FROM {0} WHERE comment_supernote = OLD.comment_supernote
+        AND num_tokens <= 0;
+    END"""
+
+# Chunk and sentence boundary tests, for the inserted (NEW) and deleted (OLD)
+# token, on tables with token_idx.
+TOKEN_IDX_BOUNDARIES = {
+    "NEW": ("NEW.token_idx = 0 AND NEW.sentence_idx = 0", "NEW.token_idx = 0"),
+    "OLD": ("OLD.token_idx = 0 AND OLD.sentence_idx = 0", "OLD.token_idx = 0"),
+}
+
+# The same for tables without token_idx: whether no other row of the token's
+# chunk or sentence is in the text table ({1}).
+LOOKUP_BOUNDARIES = {
+    "NEW": (
+        """NOT EXISTS (SELECT 1 FROM {1}
+          WHERE comment_supernote = NEW.comment_supernote
+            AND chunk_idx = NEW.chunk_idx AND rowid != NEW.rowid)""",
+        """NOT EXISTS (SELECT 1 FROM {1}
+          WHERE comment_supernote = NEW.comment_supernote
+            AND chunk_idx = NEW.chunk_idx AND sentence_idx = NEW.sentence_idx
+            AND rowid != NEW.rowid)"""),
+    "OLD": (
+        """NOT EXISTS (SELECT 1 FROM {1}
+          WHERE comment_supernote = OLD.comment_supernote
+            AND chunk_idx = OLD.chunk_idx)""",
+        """NOT EXISTS (SELECT 1 FROM {1}
+          WHERE comment_supernote = OLD.comment_supernote
+            AND chunk_idx = OLD.chunk_idx
+            AND sentence_idx = OLD.sentence_idx)"""),
+}
+
+
+def summary_table(table_name):
+  return table_name + "_summary"
+
+
+def summary_exists(cur, table_name):
+  cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+      (summary_table(table_name),))
+  return cur.fetchone() is not None
+
+
+def create_table(cur, table_name):
+  cur.execute(SUMMARY_TABLE.format(summary_table(table_name)))
+  for index in SUMMARY_INDEXES:
+    cur.execute(index.format(summary_table(table_name)))
+
+
+def rebuild(cur, table_name, forum_ids=None):
+  """Recompute summary rows for every comment, or those of some forums."""
+  create_table(cur, table_name)
+  summary_name = summary_table(table_name)
+  if forum_ids is None:
+    cur.execute("DELETE FROM {0}".format(summary_name))
+    cur.execute(REBUILD.format(summary_name,
+      AGGREGATE.format(table_name, "")))
+    return
+  cur.execute("CREATE TEMP TABLE IF NOT EXISTS summary_forums "
+      "(forum_id text PRIMARY KEY)")
+  cur.execute("DELETE FROM summary_forums")
+  cur.executemany("INSERT OR IGNORE INTO summary_forums VALUES (?)",
+      [(forum_id,) for forum_id in forum_ids])
+  cur.execute("DELETE FROM {0} WHERE forum_id IN "
+      "(SELECT forum_id FROM summary_forums)".format(summary_name))
+  cur.execute(REBUILD.format(summary_name, AGGREGATE.format(table_name,
+    "WHERE forum_id IN (SELECT forum_id FROM summary_forums)")))
+
+
+def trigger_statements(cur, table_name):
+  """CREATE TRIGGER statements for the columns table_name actually has."""
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  columns = [row[1] for row in cur.execute(
+      "PRAGMA table_info({0})".format(table_name))]
+  boundaries = (TOKEN_IDX_BOUNDARIES if "token_idx" in columns
+      else LOOKUP_BOUNDARIES)
+  return [trigger.format(summary_table(table_name), table_name,
+      *[boundary.format(summary_table(table_name), table_name)
+        for boundary in boundaries[row]])
+      for trigger, row in ((INSERT_TRIGGER, "NEW"), (DELETE_TRIGGER, "OLD"))]
+
+
+def install_triggers(cur, table_name):
+  """Keep the summary current from now on; rebuilds it once first.
+
+  Also creates the text table's indexes, which the lookup triggers need to
+  avoid a table scan per inserted token.
+  """
+  # schema imports this module for its migrations.
+  import lib.schema as schema
+  for index in schema.text_table_indexes(table_name):
+    cur.execute(index)
+  rebuild(cur, table_name)
+  create_triggers(cur, table_name)
+
+
+def create_triggers(cur, table_name):
+  """Install the triggers on a summary that is already up to date."""
+  for statement in trigger_statements(cur, table_name):
+    cur.execute(statement)
+
+
+def drop_triggers(cur, table_name):
+  """Drop the summary triggers; returns whether there were any."""
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  cur.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND "
+      "tbl_name=? AND name LIKE ?", (table_name,
+        summary_table(table_name) + "%"))
+  names = [row[0] for row in cur.fetchall()]
+  for name in names:
+    cur.execute("DROP TRIGGER {0}".format(name))
+  return bool(names)
+
+
+SplitStats = collections.namedtuple("SplitStats",
+    "forums comments comment_types author_types")
+
+
+def split_stats(cur, table_name):
+  """{split: SplitStats} from a single GROUP BY over the summary table."""
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  cur.execute(("SELECT split, forum_id, comment_type, author_type, "
+    "COUNT(*) FROM {0} GROUP BY split, forum_id, comment_type, "
+    "author_type").format(summary_table(table_name)))
+  forums = collections.defaultdict(set)
+  comments = collections.Counter()
+  comment_types = collections.defaultdict(collections.Counter)
+  author_types = collections.defaultdict(collections.Counter)
+  for split, forum_id, comment_type, author_type, count in cur.fetchall():
+    forums[split].add(forum_id)
+    comments[split] += count
+    comment_types[split][comment_type] += count
+    author_types[split][author_type] += count
+  return {split: SplitStats(len(forums[split]), comments[split],
+    comment_types[split], author_types[split]) for split in forums}
@@ -0,0 +1,293 @@
+"""Synthetic OpenReview corpora for benchmarking without the real database.
+
+generate() writes every table the pipeline reads, with the same columns:
+
+  traindev / truetest     reviews and rebuttals, one row per token
+  unstructured            meta-reviews, follow-ups and public comments
+  <table>_pairs           (review, rebuttal) pairs
+  structure               one row per note: forum_id, split, comment_id,
+                          parent_id ("None" for the submission), author
+  alignments_*            annotation tables for a sample of pairs, as written
+                          by the rd-annotator site
+  synthetic_quotes        every quote planted in a rebuttal, for checking
+                          exact-match recall
+
+Lengths follow the ICLR data roughly: three reviews of about six paragraphs
+per forum, sentences of about twenty tokens from a Zipfian vocabulary, most
+reviews rebutted, and reply chains a few levels deep. Half of the rebuttal
+paragraphs open by quoting a span of a review.
+
+Output depends only on the arguments, so a scale can be regenerated exactly.
+"""
+
+import math
+import random
+
+import lib.db_lib as dbl
+import lib.schema as schema
+
+
+TEXT_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
+    forum_id text, split text, comment_supernote text, parent_supernote text,
+    comment_type text, author text, author_type text, chunk_idx integer,
+    sentence_idx integer, token_idx integer, token text)"""
+
+PAIRS_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
+    forum_id text, split text, review_supernote text,
+    rebuttal_supernote text)"""
+
+STRUCTURE_TABLE = """CREATE TABLE IF NOT EXISTS structure (
+    forum_id text, split text, comment_id text, parent_id text, author text)"""
+
+QUOTES_TABLE = """CREATE TABLE IF NOT EXISTS synthetic_quotes (
+    review_supernote text, rebuttal_supernote text, review_chunk_idx integer,
+    rebuttal_chunk_idx integer, review_token_offset integer,
+    rebuttal_token_offset integer, length integer)"""
+
+ANNOTATION_TABLES = [
+    """CREATE TABLE IF NOT EXISTS alignments_annotatedpair (
+      id integer PRIMARY KEY, review_supernote text,
+      rebuttal_supernote text)""",
+    """CREATE TABLE IF NOT EXISTS alignments_text (
+      id integer PRIMARY KEY, comment_supernote text, chunk_idx integer,
+      sentence_idx integer, token text)""",
+    """CREATE TABLE IF NOT EXISTS alignments_alignmentannotation (
+      id integer PRIMARY KEY, review_supernote text, rebuttal_supernote text,
+      annotator text, label text, rebuttal_chunk integer)""",
+]
+
+VOCAB_SIZE = 20000
+SPLITS = [("train", 0.8), ("dev", 0.1), ("test", 0.1)]
+REVIEWS_PER_FORUM = 3
+ANNOTATORS = ["anno1", "anno2", "anno3"]
+TEST_ANNOTATOR = "test_annotator"
+ID_CHARS = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# (paragraphs, sentences per paragraph, tokens per sentence) means.
+LENGTHS = {
+    "review": (6, 3, 20),
+    "rebuttal": (5, 3, 20),
+    "metareview": (2, 3, 20),
+    "comment": (2, 2, 18),
+}
+
+
+class Generator(object):
+
+  def __init__(self, seed, conference="ICLR.cc/2019/Conference"):
+    self.rng = random.Random(seed)
+    self.conference = conference
+    syllables = [c + v for c in "bdfgklmnprstvz" for v in "aeiou"]
+    words = set()
+    while len(words) < VOCAB_SIZE:
+      words.add("".join(self.rng.choice(syllables)
+        for _ in range(self.rng.randint(1, 4))))
+    self.vocab = sorted(words)
+    self.rng.shuffle(self.vocab)
+    cumulative, total = [], 0.0
+    for rank in range(1, VOCAB_SIZE + 1):
+      total += 1.0 / rank
+      cumulative.append(total)
+    self.cum_weights = cumulative
+
+  def note_id(self):
+    return "".join(self.rng.choice(ID_CHARS) for _ in range(10))
+
+  def count(self, mean):
+    """Geometric-ish positive count with the given mean."""
+    return max(1, int(round(self.rng.expovariate(1.0 / mean) + 0.5)))
+
+  def sentence(self, mean_tokens):
+    length = max(3, int(self.rng.lognormvariate(math.log(mean_tokens), 0.5)))
+    return self.rng.choices(self.vocab, cum_weights=self.cum_weights,
+        k=length) + ["."]
+
+  def text(self, comment_type):
+    chunks, sentences, tokens = LENGTHS[comment_type]
+    return [[self.sentence(tokens) for _ in range(self.count(sentences))]
+        for _ in range(self.count(chunks))]
+
+  def plant_quotes(self, review, rebuttal):
+    """Open about half the rebuttal chunks with a quote from the review.
+
+    Returns (review_chunk_idx, rebuttal_chunk_idx, review_token_offset,
+    length) for each quote; quotes become the chunk's first sentence.
+    """
+    quotes = []
+    for rebuttal_chunk_idx, chunk in enumerate(rebuttal):
+      if self.rng.random() >= 0.5:
+        continue
+      review_chunk_idx = self.rng.randrange(len(review))
+      tokens = [token for sentence in review[review_chunk_idx]
+          for token in sentence]
+      length = min(len(tokens), self.rng.randint(6, 20))
+      offset = self.rng.randint(0, len(tokens) - length)
+      chunk.insert(0, tokens[offset:offset + length])
+      quotes.append((review_chunk_idx, rebuttal_chunk_idx, offset, length))
+    return quotes
+
+
+def token_rows(forum_id, split, supernote, parent, comment_type, author,
+    author_type, chunks):
+  for chunk_idx, chunk in enumerate(chunks):
+    for sentence_idx, sentence in enumerate(chunk):
+      for token_idx, token in enumerate(sentence):
+        yield (forum_id, split, supernote, parent, comment_type, author,
+            author_type, chunk_idx, sentence_idx, token_idx, token)
+
+
+def make_forum(gen, forum_num):
+  """Notes of one forum as (comment_id, parent_id, author, comment_type,
+  author_type, chunks) plus its (review, rebuttal, quotes) pairs."""
+  forum_id = gen.note_id()
+  paper = "{0}/Paper{1}".format(gen.conference, forum_num + 1)
+  authors = paper + "/Authors"
+  notes = [(forum_id, "None", gen.conference, "submission", "author", None)]
+  pairs = []
+
+  def reply_chain(parent_id, reviewer, depth):
+    # Alternating reviewer/author follow-ups, each less likely than the last.
+    while depth < 8 and gen.rng.random() < 0.45 ** (depth / 2.0):
+      author, author_type = ((reviewer, "reviewer") if depth % 2 == 0
+          else (authors, "author"))
+      note_id = gen.note_id()
+      notes.append((note_id, parent_id, author, "comment", author_type,
+        gen.text("comment")))
+      parent_id, depth = note_id, depth + 1
+
+  for review_num in range(REVIEWS_PER_FORUM):
+    reviewer = "{0}/AnonReviewer{1}".format(paper, review_num + 1)
+    review_id, review = gen.note_id(), gen.text("review")
+    notes.append((review_id, forum_id, reviewer, "review", "reviewer",
+      review))
+    if gen.rng.random() < 0.8:
+      rebuttal_id, rebuttal = gen.note_id(), gen.text("rebuttal")
+      quotes = gen.plant_quotes(review, rebuttal)
+      notes.append((rebuttal_id, review_id, authors, "rebuttal", "author",
+        rebuttal))
+      pairs.append((review_id, rebuttal_id, review, rebuttal, quotes))
+      reply_chain(rebuttal_id, reviewer, 2)
+
+  notes.append((gen.note_id(), forum_id, paper + "/Area_Chair1",
+    "metareview", "ac", gen.text("metareview")))
+  for _ in range(gen.rng.choice([0, 0, 1, 2])):
+    author = gen.rng.choice(["(anonymous)", "~Jane_Doe1", "~John_Smith1"])
+    note_id = gen.note_id()
+    notes.append((note_id, forum_id, author, "comment", "public",
+      gen.text("comment")))
+    reply_chain(note_id, author, 1)
+  return forum_id, notes, pairs
+
+
+def annotate(gen, cur, review_id, rebuttal_id, review, rebuttal, quotes):
+  """Two annotators per rebuttal chunk who mostly find the planted quote."""
+  cur.execute("INSERT INTO alignments_annotatedpair (review_supernote, "
+      "rebuttal_supernote) VALUES (?, ?)", (review_id, rebuttal_id))
+  for supernote, chunks in [(review_id, review), (rebuttal_id, rebuttal)]:
+    cur.executemany("INSERT INTO alignments_text (comment_supernote, "
+        "chunk_idx, sentence_idx, token) VALUES (?, ?, ?, ?)",
+        [(supernote, chunk_idx, sentence_idx, token)
+          for chunk_idx, chunk in enumerate(chunks)
+          for sentence_idx, sentence in enumerate(chunk)
+          for token in sentence])
+  quoted = {rebuttal_chunk: review_chunk
+      for review_chunk, rebuttal_chunk, _, _ in quotes}
+  rows = []
+  for chunk_idx in range(len(rebuttal)):
+    annotators = gen.rng.sample(ANNOTATORS, 2)
+    if gen.rng.random() < 0.05:
+      annotators.append(TEST_ANNOTATOR)
+    for annotator in annotators:
+      if chunk_idx in quoted and gen.rng.random() < 0.85:
+        label = str(quoted[chunk_idx])
+      elif gen.rng.random() < 0.5:
+        label = "-1"
+      else:
+        label = "|".join(str(i) for i in sorted(gen.rng.sample(
+          range(len(review)), gen.rng.randint(1, min(2, len(review))))))
+      rows.append((review_id, rebuttal_id, annotator, label, chunk_idx))
+  cur.executemany("INSERT INTO alignments_alignmentannotation ("
+      "review_supernote, rebuttal_supernote, annotator, label, "
+      "rebuttal_chunk) VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def create_tables(cur):
+  for table_name in dbl.TextTables.ALL:
+    cur.execute(TEXT_TABLE.format(table_name))
+    cur.execute(PAIRS_TABLE.format(table_name + "_pairs"))
+  cur.execute(STRUCTURE_TABLE)
+  cur.execute(QUOTES_TABLE)
+  for statement in ANNOTATION_TABLES:
+    cur.execute(statement)
+
+
+def generate(db_file, num_forums, seed=0, annotated_pairs=200,
+    batch_size=50000, progress=None):
+  """Write a synthetic corpus of num_forums forums to a new db_file.
+
+  annotated_pairs pairs are copied into the annotation tables. Returns
+  {table: row count}.
+  """
+  conn = dbl.open_connection(db_file, row_mode=dbl.RowModes.TUPLE,
+      profile=dbl.Profiles.BULK_LOAD)
+  cur = conn.cursor()
+  create_tables(cur)
+  gen = Generator(seed)
+  annotate_every = max(1, num_forums * 2 // max(annotated_pairs, 1))
+  insert_text = "INSERT INTO {0} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+  pending = {table_name: [] for table_name in dbl.TextTables.ALL}
+  counts = {}
+  num_annotated = 0
+
+  def flush(table_name):
+    cur.executemany(insert_text.format(table_name), pending[table_name])
+    counts[table_name] = counts.get(table_name, 0) + len(pending[table_name])
+    pending[table_name] = []
+
+  for forum_num in range(num_forums):
+    split = gen.rng.choices([s for s, _ in SPLITS],
+        weights=[w for _, w in SPLITS])[0]
+    paired_table = (dbl.TextTables.TRUE_TEST if split == "test"
+        else dbl.TextTables.TRAIN_DEV)
+    forum_id, notes, pairs = make_forum(gen, forum_num)
+
+    cur.executemany("INSERT INTO structure VALUES (?, ?, ?, ?, ?)",
+        [(forum_id, split, note_id, parent_id, author)
+          for note_id, parent_id, author, _, _, _ in notes])
+    for note_id, parent_id, author, comment_type, author_type, chunks in notes:
+      if chunks is None:
+        continue
+      table_name = (paired_table if comment_type in ("review", "rebuttal")
+          else dbl.TextTables.UNSTRUCTURED)
+      pending[table_name].extend(token_rows(forum_id, split, note_id,
+        parent_id, comment_type, author, author_type, chunks))
+      if len(pending[table_name]) >= batch_size:
+        flush(table_name)
+
+    for review_id, rebuttal_id, review, rebuttal, quotes in pairs:
+      cur.execute("INSERT INTO {0} VALUES (?, ?, ?, ?)".format(
+        paired_table + "_pairs"), (forum_id, split, review_id, rebuttal_id))
+      cur.executemany("INSERT INTO synthetic_quotes VALUES "
+          "(?, ?, ?, ?, ?, ?, ?)", [(review_id, rebuttal_id, review_chunk,
+            rebuttal_chunk, offset, 0, length)
+            for review_chunk, rebuttal_chunk, offset, length in quotes])
+      if (num_annotated < annotated_pairs
+          and gen.rng.randrange(annotate_every) == 0):
+        annotate(gen, cur, review_id, rebuttal_id, review, rebuttal, quotes)
+        num_annotated += 1
+
+    if progress is not None:
+      progress(forum_num + 1)
+
+  for table_name in dbl.TextTables.ALL:
+    flush(table_name)
+  conn.commit()
+  schema.migrate(conn)
+
+  for table_name in ["structure", "synthetic_quotes",
+      "alignments_annotatedpair", "alignments_alignmentannotation"] + [
+      table_name + "_pairs" for table_name in dbl.TextTables.ALL]:
+    counts[table_name], = cur.execute(
+        "SELECT COUNT(*) FROM {0}".format(table_name)).fetchone()
+  conn.close()
+  return counts
@@ -0,0 +1,275 @@
+"""Pipelined, cached tokenization against a pool of CoreNLP servers.
+
+TokenizerPool talks to already-running CoreNLP servers over HTTP (any URL
+works, so a local stand-in server can replace CoreNLP in tests). Documents
+are returned as lists of sentences, each a list of token strings.
+
+* Results are cached on disk, keyed by a hash of the text and the annotator
+  configuration, so rebuilding a database does not re-tokenize anything.
+* Short documents are packed into one request, separated by blank lines.
+  CoreNLP's default ssplit.newlineIsSentenceBreak=two always ends a sentence
+  there, and sentences are mapped back to their document by character offset.
+* Up to max_in_flight requests are outstanding at once, spread round-robin
+  over the endpoints.
+* prefetch() submits documents without waiting for them. Ingest tokenizes
+  one document at a time through annotate(), so build_or_db wraps its
+  OpenReview client in a PrefetchingClient: every page of notes the ingest
+  reads is submitted as it arrives, and the annotate() calls that follow
+  collect results that are already in flight or done. Only the fields ingest
+  tokenizes are prefetched, and whatever a forum left uncollected is
+  discarded when the next forum is read.
+"""
+
+import bisect
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import threading
+
+import requests
+
+
+ANNOTATORS = "tokenize ssplit".split()
+DOCUMENT_SEPARATOR = "\n\n"
+# Note content fields whose text ingest tokenizes.
+TEXT_FIELDS = "abstract review metareview comment".split()
+
+
+def java_length(text):
+  """Length in UTF-16 code units, which is what CoreNLP offsets count."""
+  return len(text.encode("utf-16-le")) // 2
+
+
+def to_conll(sentences):
+  """Render sentences like CoreNLP's CoNLL output for tokenize/ssplit."""
+  return "\n\n".join("\n".join(
+    "\t".join([str(i), token, "_", "_", "_", "_", "_"])
+    for i, token in enumerate(sentence, 1))
+    for sentence in sentences) + "\n"
+
+
+class TokenCache(object):
+  """Tokenized documents on disk, one JSON file per (text, config) hash."""
+
+  def __init__(self, directory, config):
+    self.directory = directory
+    self.config = json.dumps(config, sort_keys=True)
+
+  def _path(self, text):
+    key = hashlib.sha1(
+        (self.config + "\0" + text).encode("utf-8")).hexdigest()
+    return os.path.join(self.directory, key[:2], key + ".json")
+
+  def get(self, text):
+    try:
+      with open(self._path(text), "r") as f:
+        return json.load(f)
+    except FileNotFoundError:
+      return None
+
+  def put(self, text, sentences):
+    path = self._path(text)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so a crash never leaves a truncated entry.
+    tmp_path = "{0}.{1}.tmp".format(path, threading.get_ident())
+    with open(tmp_path, "w") as f:
+      json.dump(sentences, f)
+    os.replace(tmp_path, path)
+
+
+class TokenizerPool(object):
+  """Tokenize documents with several requests in flight to several servers.
+
+  Usage:
+    pool = TokenizerPool(["http://localhost:9000"], cache_dir="tok_cache")
+    sentences_per_doc = pool.tokenize_many(texts)
+
+  annotate(text) returns CoNLL text, so the pool can stand in for a
+  corenlp.CoreNLPClient(annotators=..., output_format='conll').
+  """
+
+  def __init__(self, endpoints, cache_dir=None, annotators=ANNOTATORS,
+      max_in_flight=8, batch_chars=20000, timeout=300):
+    self.annotators = annotators
+    self.properties = {"annotators": ",".join(annotators),
+        "outputFormat": "json"}
+    self.cache = None if cache_dir is None else TokenCache(cache_dir,
+        self.properties)
+    self.max_in_flight = max_in_flight
+    self.batch_chars = batch_chars
+    self.timeout = timeout
+    self._endpoints = itertools.cycle(endpoints)
+    self._endpoint_lock = threading.Lock()
+    self._local = threading.local()
+    self._executor = concurrent.futures.ThreadPoolExecutor(max_in_flight)
+    # text -> future of its sentences, for prefetched texts not yet collected.
+    self._in_flight = {}
+    self._in_flight_lock = threading.Lock()
+
+  def _session(self):
+    if not hasattr(self._local, "session"):
+      self._local.session = requests.Session()
+    return self._local.session
+
+  def _next_endpoint(self):
+    with self._endpoint_lock:
+      return next(self._endpoints)
+
+  def _request(self, texts):
+    """Tokenize a batch of documents in one server round-trip."""
+    starts = []
+    offset = 0
+    for text in texts:
+      starts.append(offset)
+      offset += java_length(text) + java_length(DOCUMENT_SEPARATOR)
+    response = self._session().post(self._next_endpoint(),
+        params={"properties": json.dumps(self.properties)},
+        data=DOCUMENT_SEPARATOR.join(texts).encode("utf-8"),
+        timeout=self.timeout)
+    response.raise_for_status()
+
+    documents = [[] for _ in texts]
+    for sentence in response.json()["sentences"]:
+      tokens = sentence["tokens"]
+      if not tokens:
+        continue
+      doc_idx = bisect.bisect_right(
+          starts, tokens[0]["characterOffsetBegin"]) - 1
+      documents[doc_idx].append([token["word"] for token in tokens])
+    return documents
+
+  def _batches(self, texts):
+    """Group texts so each request carries about batch_chars characters."""
+    batch, size = [], 0
+    for text in texts:
+      if batch and size + len(text) > self.batch_chars:
+        yield batch
+        batch, size = [], 0
+      batch.append(text)
+      size += len(text)
+    if batch:
+      yield batch
+
+  def _request_and_cache(self, texts):
+    documents = self._request(texts)
+    if self.cache is not None:
+      for text, sentences in zip(texts, documents):
+        self.cache.put(text, sentences)
+    return documents
+
+  def _submit(self, texts):
+    """{text: future of its sentences}, with uncached texts sent in batches.
+
+    Texts already in flight from an earlier prefetch share its future.
+    """
+    futures = {}
+    missing = []
+    with self._in_flight_lock:
+      for text in dict.fromkeys(texts):
+        if text in self._in_flight:
+          futures[text] = self._in_flight[text]
+          continue
+        cached = None if self.cache is None else self.cache.get(text)
+        if cached is not None or not text.strip():
+          futures[text] = concurrent.futures.Future()
+          futures[text].set_result(cached or [])
+        else:
+          missing.append(text)
+      for batch in self._batches(missing):
+        batch_future = self._executor.submit(self._request_and_cache, batch)
+        for doc_idx, text in enumerate(batch):
+          futures[text] = self._document_future(batch_future, doc_idx)
+    return futures
+
+  @staticmethod
+  def _document_future(batch_future, doc_idx):
+    future = concurrent.futures.Future()
+
+    def done(batch_future):
+      if batch_future.exception() is not None:
+        future.set_exception(batch_future.exception())
+      else:
+        future.set_result(batch_future.result()[doc_idx])
+
+    batch_future.add_done_callback(done)
+    return future
+
+  def tokenize_many(self, texts):
+    """Sentences for each text, in order. Blank texts have no sentences."""
+    futures = self._submit(texts)
+    with self._in_flight_lock:
+      for text in futures:
+        self._in_flight.pop(text, None)
+    return [futures[text].result() for text in texts]
+
+  def tokenize(self, text):
+    return self.tokenize_many([text])[0]
+
+  def prefetch(self, texts):
+    """Start tokenizing texts that will be annotated later; returns at once.
+
+    Results are kept until a later tokenize or annotate call collects them,
+    or until discard_prefetched().
+    """
+    futures = self._submit(texts)
+    with self._in_flight_lock:
+      self._in_flight.update(futures)
+
+  def discard_prefetched(self):
+    """Forget prefetched texts that were never collected.
+
+    Their requests still finish, and their results still reach the cache.
+    """
+    with self._in_flight_lock:
+      self._in_flight.clear()
+
+  def annotate(self, text):
+    return to_conll(self.tokenize(text))
+
+  def close(self):
+    self._executor.shutdown()
+    self._in_flight.clear()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def note_texts(note, fields=TEXT_FIELDS):
+  """Non-blank text fields of an OpenReview note (object or JSON dict)."""
+  content = note["content"] if isinstance(note, dict) else note.content
+  return [content[field] for field in fields
+      if isinstance(content.get(field), str) and content[field].strip()]
+
+
+class PrefetchingClient(object):
+  """OpenReview client proxy that prefetches the text of notes it returns.
+
+  Every get_notes page is handed to tokenizer.prefetch before it is returned,
+  so by the time ingest annotates those notes one by one their tokenization
+  is already in flight. Reading a different forum discards prefetched texts
+  the previous one never annotated, so they cannot pile up over an ingest.
+  All other attributes go to the wrapped client.
+  """
+
+  def __init__(self, client, tokenizer):
+    self.client = client
+    self.tokenizer = tokenizer
+    self._forum = None
+
+  def get_notes(self, *args, **kwargs):
+    forum = kwargs.get("forum")
+    if forum != self._forum:
+      self.tokenizer.discard_prefetched()
+      self._forum = forum
+    notes = self.client.get_notes(*args, **kwargs)
+    self.tokenizer.prefetch([text for note in notes
+      for text in note_texts(note)])
+    return notes
+
+  def __getattr__(self, name):
+    return getattr(self.client, name)
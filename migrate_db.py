@@ -0,0 +1,52 @@
+import argparse
+
+import lib.db_lib as dbl
+import lib.instrument as instrument
+import lib.schema as schema
+
+parser = argparse.ArgumentParser(
+    description='Create or upgrade indexes in an OpenReview sqlite3 database.')
+parser.add_argument('-d', '--dbfile', default="db/or.db",
+    type=str, help='path to database file')
+parser.add_argument('--journal_mode', default=None, type=str,
+    choices=["wal", "delete"],
+    help='also switch the file to this journal mode (wal is opt-in)')
+instrument.add_argument(parser)
+
+
+def print_plans(before, after):
+  for key in sorted(after):
+    table_name, description = key
+    print("{0}: {1}".format(table_name, description))
+    for line in before.get(key, []):
+      print("  before: " + line)
+    for line in after[key]:
+      print("  after:  " + line)
+    print()
+
+
+def main():
+
+  args = parser.parse_args()
+  instrument.enable_from_args(args)
+  conn = dbl.create_connection(args.dbfile)
+  if conn is None:
+    print("Connection error")
+    exit()
+
+  before = schema.query_plans(conn)
+  start_version = schema.migrate(conn)
+  after = schema.query_plans(conn)
+
+  print("Schema version {0} -> {1}".format(start_version,
+    schema.SCHEMA_VERSION))
+  print()
+  print_plans(before, after)
+
+  if args.journal_mode is not None:
+    print("Journal mode: {0}".format(schema.set_journal_mode(conn,
+      args.journal_mode)))
+
+
+if __name__ == "__main__":
+  main()
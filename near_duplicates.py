@@ -0,0 +1,40 @@
+import argparse
+
+import lib.db_lib as dbl
+import lib.instrument as instrument
+import lib.minhash as mh
+
+parser = argparse.ArgumentParser(
+    description='Find near-duplicate chunks across reviews and rebuttals.')
+parser.add_argument('-d', '--dbfile', default="db/or.db",
+    type=str, help='path to database file')
+parser.add_argument('-t', '--threshold', default=0.8, type=float,
+    help='minimum estimated Jaccard similarity of chunk shingles')
+parser.add_argument('-x', '--cross_forum', action="store_true",
+    help='only report pairs from different forums')
+parser.add_argument('-a', '--all', action="store_true",
+    help='report candidates from every indexed batch, not just the chunks '
+    'added by this run')
+instrument.add_argument(parser)
+
+
+def main():
+
+  args = parser.parse_args()
+  instrument.enable_from_args(args)
+  conn = dbl.create_connection(args.dbfile, profile=dbl.Profiles.READ)
+  if conn is None:
+    print("Connection error")
+    exit()
+
+  for table_name in dbl.TextTables.ALL:
+    batch = mh.index_new_chunks(conn, table_name)
+    batches = range(batch + 1) if args.all else [batch]
+    for query_batch in batches:
+      for candidate in mh.find_candidates(conn, table_name, query_batch,
+          args.threshold, args.cross_forum):
+        print("\t".join(str(i) for i in (table_name,) + candidate))
+
+
+if __name__ == "__main__":
+  main()
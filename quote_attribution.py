@@ -0,0 +1,160 @@
+import argparse
+
+from tqdm import tqdm
+
+import lib.db_lib as dbl
+import lib.instrument as instrument
+import lib.karp_rabin as kr
+import lib.quote_index as qi
+import lib.schema as schema
+
+parser = argparse.ArgumentParser(
+    description='Attribute quoted spans in rebuttals and comments to the '
+    'review chunks they come from, one forum at a time.')
+parser.add_argument('-d', '--dbfile', default="db/or.db",
+    type=str, help='path to database file')
+parser.add_argument('-w', '--window', default=kr.WINDOW, type=int,
+    help='minimum quote length in tokens')
+parser.add_argument('--batch_size', default=50000, type=int,
+    help='approximate number of rows per transaction')
+instrument.add_argument(parser)
+
+REVIEW = "review"
+
+QUOTE_TABLE = """CREATE TABLE IF NOT EXISTS {0} (
+    forum_id text NOT NULL,
+    split text NOT NULL,
+    comment_supernote text NOT NULL,
+    comment_chunk_idx integer NOT NULL,
+    comment_token_offset integer NOT NULL,
+    review_supernote text NOT NULL,
+    review_chunk_idx integer NOT NULL,
+    review_token_offset integer NOT NULL,
+    lcs text NOT NULL,
+    window_size integer NOT NULL)"""
+
+FIELDS = ("forum_id split comment_supernote comment_chunk_idx "
+          "comment_token_offset review_supernote review_chunk_idx "
+          "review_token_offset lcs window_size")
+INSERT_QUOTE = ("INSERT INTO {0} (" + ", ".join(FIELDS.split()) +
+    ") VALUES (" + ", ".join("?" for _ in FIELDS.split()) + ")")
+
+FORUM_TEXT = """SELECT comment_supernote, comment_type, chunk_idx,
+    sentence_idx, token
+    FROM {0} WHERE forum_id=? AND split=?
+    ORDER BY comment_supernote, chunk_idx, sentence_idx, rowid"""
+
+
+def get_forums(cur, table_name, set_split):
+  cur.execute("SELECT DISTINCT forum_id FROM {0} WHERE split=?".format(
+    table_name), (set_split,))
+  return [row["forum_id"] for row in cur.fetchall()]
+
+
+@instrument.stage("fetch")
+def forum_comments(cur, table_name, forum_id, set_split):
+  """(reviews, others): lists of (supernote, chunks) in one forum."""
+  cur = cur.connection.cursor()
+  cur.row_factory = None
+  cur.execute(FORUM_TEXT.format(table_name), (forum_id, set_split))
+  comment_types = {}
+
+  def rows():
+    for supernote, comment_type, chunk_idx, sentence_idx, token in cur:
+      comment_types[supernote] = comment_type
+      yield supernote, chunk_idx, sentence_idx, token
+
+  reviews, others = [], []
+  for supernote, chunks in dbl.stream_text_rows(rows()):
+    (reviews if comment_types[supernote] == REVIEW else others).append(
+        (supernote, chunks))
+  return reviews, others
+
+
+@instrument.stage("index")
+def index_reviews(reviews, window):
+  index = qi.QuoteIndex(window)
+  for review_id, chunks in reviews:
+    index.add_review(review_id, chunks)
+  return index
+
+
+@instrument.stage("match")
+def attribute_forum(index, comments):
+  """Quotes of the forum's indexed reviews in each of comments."""
+  return [quote for comment_id, chunks in comments
+      for quote in index.find_quotes(comment_id, chunks)]
+
+
+def flatten_quote(quote, forum_id, set_split, window):
+  return (forum_id, set_split, quote.comment_location.supernote,
+      quote.comment_location.chunk_idx, quote.comment_location.token_idx,
+      quote.review_location.supernote, quote.review_location.chunk_idx,
+      quote.review_location.token_idx, quote.lcs, window)
+
+
+@instrument.stage("write")
+def write_quotes(cur, table_name, rows):
+  cur.executemany(INSERT_QUOTE.format(table_name + "_quotes"), rows)
+  instrument.count("rows inserted", len(rows))
+
+
+def attribute_split(conn, set_split, window, batch_size):
+  """Replace a split's quotes in every text table.
+
+  A forum's comments are spread over the text tables: its reviews are in
+  traindev or truetest, while meta-reviews and public comments are in
+  unstructured. The reviews of a forum from every table go into one index,
+  and the non-review comments of every table are scanned against it, with
+  their quotes written to <table>_quotes. Commits every batch_size rows.
+  """
+  cur = conn.cursor()
+  table_names = [table_name for table_name in dbl.TextTables.ALL
+      if schema.table_exists(cur, table_name)]
+  for table_name in table_names:
+    cur.execute(QUOTE_TABLE.format(table_name + "_quotes"))
+    schema.create_indexes(cur, table_name + "_quotes",
+        schema.quote_table_indexes(table_name))
+    cur.execute("DELETE FROM {0} WHERE split=?".format(
+      table_name + "_quotes"), (set_split,))
+  forum_ids = sorted(set(forum_id for table_name in table_names
+    for forum_id in get_forums(cur, table_name, set_split)))
+
+  pending = {table_name: [] for table_name in table_names}
+  for forum_id in tqdm(forum_ids):
+    comments = {table_name: forum_comments(cur, table_name, forum_id,
+      set_split) for table_name in table_names}
+    reviews = [review for table_reviews, _ in comments.values()
+        for review in table_reviews]
+    if not reviews:
+      continue
+    index = index_reviews(reviews, window)
+    for table_name, (_, others) in comments.items():
+      pending[table_name] += [flatten_quote(quote, forum_id, set_split,
+        window) for quote in attribute_forum(index, others)]
+    if sum(len(rows) for rows in pending.values()) >= batch_size:
+      for table_name, rows in pending.items():
+        write_quotes(cur, table_name, rows)
+        pending[table_name] = []
+      conn.commit()
+  for table_name, rows in pending.items():
+    write_quotes(cur, table_name, rows)
+  conn.commit()
+
+
+def main():
+
+  args = parser.parse_args()
+  instrument.enable_from_args(args)
+  conn = dbl.create_connection(args.dbfile, profile=dbl.Profiles.READ)
+  if conn is None:
+    print("Connection error")
+    exit()
+
+  for set_split in ["train", "dev", "test"]:
+    print(set_split)
+    attribute_split(conn, set_split, args.window, args.batch_size)
+
+
+if __name__ == "__main__":
+  main()
@@ -5,4 +5,5 @@ rm -rf db/
 mkdir db
 python create_db.py --dbfile db/or.db
 python build_or_db.py --dbfile db/or.db --inputfile splits/iclr19_split.json
+python migrate_db.py --dbfile db/or.db
 python example.py --dbfile db/or.db
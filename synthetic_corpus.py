@@ -0,0 +1,40 @@
+import argparse
+import os
+import time
+
+import lib.synthetic as synthetic
+
+parser = argparse.ArgumentParser(
+    description='Write a synthetic OpenReview database for benchmarking.')
+parser.add_argument('-d', '--dbfile', default="db/synthetic.db",
+    type=str, help='path to the database file to create')
+parser.add_argument('-n', '--forums', default=1000, type=int,
+    help='number of forums')
+parser.add_argument('-s', '--seed', default=0, type=int,
+    help='random seed; the same seed and size give the same database')
+parser.add_argument('-a', '--annotated_pairs', default=200, type=int,
+    help='number of pairs copied into the annotation tables')
+parser.add_argument('-f', '--force', action="store_true",
+    help='overwrite an existing database file')
+
+
+def main():
+
+  args = parser.parse_args()
+  if os.path.exists(args.dbfile):
+    if not args.force:
+      print("{0} exists; pass --force to overwrite".format(args.dbfile))
+      exit()
+    os.remove(args.dbfile)
+
+  start = time.time()
+  counts = synthetic.generate(args.dbfile, args.forums, seed=args.seed,
+      annotated_pairs=args.annotated_pairs)
+  for table_name, count in sorted(counts.items()):
+    print("{0}\t{1}".format(table_name, count))
+  print("Generated {0} forums in {1:.1f}s".format(args.forums,
+    time.time() - start))
+
+
+if __name__ == "__main__":
+  main()
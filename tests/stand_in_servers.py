@@ -0,0 +1,161 @@
+"""Local HTTP servers that stand in for CoreNLP and OpenReview in tests."""
+
+import contextlib
+import http.server
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+import lib.tokenization as tok
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def whitespace_sentences(text):
+  """What the stand-in CoreNLP returns: (start, words) per sentence."""
+  sentences = []
+  for paragraph_match in re.finditer(r"(?:(?!\n\n).)+", text, re.S):
+    paragraph = paragraph_match.group(0)
+    for match in re.finditer(r"[^.!?]+[.!?]*", paragraph):
+      tokens = [(paragraph_match.start() + match.start() + token.start(),
+        token.group(0)) for token in TOKEN_RE.finditer(match.group(0))]
+      if tokens:
+        sentences.append(tokens)
+  return sentences
+
+
+class _Server(object):
+
+  def __init__(self, handler):
+    self.requests = 0
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.lock = threading.Lock()
+    server = self
+
+    class Handler(handler):
+      stand_in = server
+
+      def log_message(self, *args):
+        pass
+
+    self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    self.url = "http://127.0.0.1:{0}".format(self.httpd.server_address[1])
+    self.thread = threading.Thread(target=self.httpd.serve_forever,
+        daemon=True)
+
+  @contextlib.contextmanager
+  def track(self):
+    with self.lock:
+      self.requests += 1
+      self.in_flight += 1
+      self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    try:
+      yield
+    finally:
+      with self.lock:
+        self.in_flight -= 1
+
+
+class _CoreNLPHandler(http.server.BaseHTTPRequestHandler):
+
+  def do_POST(self):
+    with self.stand_in.track():
+      text = self.rfile.read(int(self.headers["Content-Length"])).decode(
+          "utf-8")
+      time.sleep(self.stand_in.delay)
+      sentences = [{"tokens": [{"word": word,
+        "characterOffsetBegin": tok.java_length(text[:start])}
+        for start, word in sentence]}
+        for sentence in whitespace_sentences(text)]
+      body = json.dumps({"sentences": sentences}).encode("utf-8")
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.end_headers()
+      self.wfile.write(body)
+
+
+class _OpenReviewHandler(http.server.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    with self.stand_in.track():
+      url = urllib.parse.urlparse(self.path)
+      query = {key: values[0]
+          for key, values in urllib.parse.parse_qs(url.query).items()}
+      if "forum" in query:
+        self.stand_in.wait_at_barrier()
+      time.sleep(self.stand_in.delay)
+      if self.stand_in.fail_next > 0:
+        self.stand_in.fail_next -= 1
+        self.send_response(503)
+        self.end_headers()
+        return
+      notes = self.stand_in.find(query)
+      if query.get("sort") == "tmdate:desc":
+        notes = sorted(notes, key=lambda note: -note["tmdate"])
+      offset = int(query.get("offset", 0))
+      limit = int(query.get("limit", 1000))
+      body = json.dumps({"notes": notes[offset:offset + limit]}).encode(
+          "utf-8")
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.end_headers()
+      self.wfile.write(body)
+
+
+@contextlib.contextmanager
+def corenlp(delay=0.0):
+  server = _Server(_CoreNLPHandler)
+  server.delay = delay
+  server.thread.start()
+  try:
+    yield server
+  finally:
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+@contextlib.contextmanager
+def openreview(notes, delay=0.0, barrier=None, barrier_timeout=10.0):
+  """notes: list of note dicts, each with id, forum, invitation, tmdate.
+
+  With barrier=n, the first n forum requests are held until all n are in
+  flight at once. If they are not within barrier_timeout seconds, they are
+  released and server.barrier_broken is set.
+  """
+  server = _Server(_OpenReviewHandler)
+  server.delay = delay
+  server.fail_next = 0
+  server.notes = notes
+  server.barrier_broken = False
+  arrivals = [0]
+  parties = threading.Barrier(barrier) if barrier is not None else None
+
+  def wait_at_barrier():
+    if parties is None:
+      return
+    with server.lock:
+      arrivals[0] += 1
+      if arrivals[0] > parties.parties:
+        return
+    try:
+      parties.wait(barrier_timeout)
+    except threading.BrokenBarrierError:
+      server.barrier_broken = True
+
+  def find(query):
+    if "forum" in query:
+      return [note for note in server.notes if note["forum"] == query["forum"]]
+    return [note for note in server.notes
+        if note["invitation"] == query.get("invitation")]
+
+  server.find = find
+  server.wait_at_barrier = wait_at_barrier
+  server.thread.start()
+  try:
+    yield server
+  finally:
+    server.httpd.shutdown()
+    server.httpd.server_close()
@@ -0,0 +1,84 @@
+import sqlite3
+
+import lib.bulk_load as bulk
+import lib.schema as schema
+import lib.summary as summary
+
+COLUMNS = ("forum_id split comment_supernote parent_supernote comment_type "
+    "author author_type chunk_idx sentence_idx token").split()
+INSERT = "INSERT INTO traindev ({0}) VALUES ({1})".format(", ".join(COLUMNS),
+    ", ".join("?" for _ in COLUMNS))
+
+
+def rows(forum_id, comment, num_tokens):
+  return [(forum_id, "train", comment, "None", "review", "a", "reviewer", 0,
+    i // 3, "t{0}".format(i)) for i in range(num_tokens)]
+
+
+def objects(cur):
+  return sorted(cur.execute("SELECT type, name FROM sqlite_master WHERE "
+    "type IN ('index', 'trigger') AND tbl_name = 'traindev'").fetchall())
+
+
+def summary_rows(cur):
+  return sorted(cur.execute(
+    "SELECT * FROM traindev_summary").fetchall())
+
+
+def make_db():
+  conn = sqlite3.connect(":memory:")
+  cur = conn.cursor()
+  cur.execute("CREATE TABLE traindev ({0})".format(", ".join(COLUMNS)))
+  cur.executemany(INSERT, rows("f", "c1", 6) + rows("g", "c2", 4))
+  summary.install_triggers(cur, "traindev")
+  conn.commit()
+  return conn, objects(cur)
+
+
+def expected_summary(conn):
+  cur = conn.cursor()
+  summary.rebuild(cur, "traindev")
+  return summary_rows(cur)
+
+
+def test_finish_restores_triggers_and_replaces_reloaded_forums():
+  conn, before = make_db()
+  loader = bulk.BulkLoader(conn)
+  assert objects(conn.cursor()) == []
+  loader.executemany(INSERT, rows("f", "c1", 5) + rows("h", "c3", 2))
+  stats = loader.finish()
+  assert stats.replaced == 6
+  cur = conn.cursor()
+  assert objects(cur) == before
+  assert not schema.table_exists(cur, bulk.STATE_TABLE)
+  loaded = summary_rows(cur)
+  assert loaded == expected_summary(conn)
+  assert [row[0] for row in loaded] == ["c1", "c2", "c3"]
+
+
+def test_unfinished_load_is_recovered():
+  conn, before = make_db()
+  loader = bulk.BulkLoader(conn, transaction_rows=1)
+  loader.executemany(INSERT, rows("h", "c3", 3))
+  loader.commit()
+  loader.executemany(INSERT, rows("i", "c4", 3))
+  # The process dies here: nothing restores the dropped objects.
+  conn.rollback()
+  assert objects(conn.cursor()) == []
+
+  assert bulk.recover(conn) == ["traindev"]
+  cur = conn.cursor()
+  assert objects(cur) == before
+  assert summary_rows(cur) == expected_summary(conn)
+  assert bulk.recover(conn) == []
+
+
+def test_abort_restores_dropped_objects():
+  conn, before = make_db()
+  loader = bulk.BulkLoader(conn)
+  loader.executemany(INSERT, rows("h", "c3", 3))
+  loader.abort()
+  cur = conn.cursor()
+  assert objects(cur) == before
+  assert cur.execute("SELECT COUNT(*) FROM traindev").fetchone() == (10,)
+  assert not schema.table_exists(cur, bulk.STATE_TABLE)
@@ -0,0 +1,86 @@
+import lib.fetch as fetch
+
+import stand_in_servers
+
+INVITATION = "Conf/-/Blind_Submission"
+
+
+def make_notes(num_forums=5, replies=3):
+  notes = []
+  for i in range(num_forums):
+    forum = "f{0}".format(i)
+    notes.append({"id": forum, "forum": forum, "invitation": INVITATION,
+      "tmdate": 10, "details": {"replyCount": replies},
+      "content": {"title": "Paper {0}".format(i)}})
+    notes += [{"id": "{0}_r{1}".format(forum, j), "forum": forum,
+      "replyto": forum, "invitation": "Conf/-/Review", "tmdate": 20 + j,
+      "content": {"review": "Review {0} of {1}".format(j, forum)}}
+      for j in range(replies)]
+  return notes
+
+
+def sync(server, cache_dir, **kwargs):
+  kwargs.setdefault("rate", 0)
+  kwargs.setdefault("backoff", 0.01)
+  fetched, _ = fetch.sync_conference(server.url, INVITATION, cache_dir,
+      **kwargs)
+  return sorted(fetched)
+
+
+def test_sync_fetches_only_new_or_edited_forums(tmp_path):
+  notes = make_notes()
+  with stand_in_servers.openreview(notes) as server:
+    assert sync(server, str(tmp_path)) == ["f0", "f1", "f2", "f3", "f4"]
+    assert sync(server, str(tmp_path)) == []
+
+    # Editing a reply changes neither the submission's tmdate nor its
+    # replyCount.
+    edited = next(note for note in notes if note["id"] == "f2_r1")
+    edited["tmdate"] = 99
+    edited["content"]["review"] = "Edited review"
+    assert sync(server, str(tmp_path)) == ["f2"]
+    assert sync(server, str(tmp_path)) == []
+
+  cached = fetch.NoteCache(str(tmp_path)).get_forum("f2")
+  assert "Edited review" in [note["content"].get("review") for note in cached]
+
+
+def test_concurrency_is_not_capped_by_the_default_executor(tmp_path):
+  # The default executor has at most 32 threads.
+  with stand_in_servers.openreview(make_notes(num_forums=60),
+      barrier=48) as server:
+    assert len(sync(server, str(tmp_path), concurrency=48)) == 60
+  assert not server.barrier_broken
+  assert server.max_in_flight == 48
+
+
+def test_transient_errors_are_retried(tmp_path):
+  with stand_in_servers.openreview(make_notes()) as server:
+    server.fail_next = 3
+    assert len(sync(server, str(tmp_path))) == 5
+
+
+def test_cached_client_pages_match_the_server(tmp_path):
+  notes = make_notes()
+  with stand_in_servers.openreview(notes) as server:
+    sync(server, str(tmp_path))
+  client = fetch.CachedClient(str(tmp_path))
+  pages = [client.get_notes(invitation=INVITATION, offset=offset, limit=2)
+      for offset in range(0, 6, 2)]
+  submissions = [note for note in notes if note["invitation"] == INVITATION]
+  assert sum(pages, []) == submissions
+  assert client.get_notes(forum="f3") == [note for note in notes
+      if note["forum"] == "f3"]
+
+
+def test_cached_client_reads_the_cache_once(tmp_path, monkeypatch):
+  with stand_in_servers.openreview(make_notes()) as server:
+    sync(server, str(tmp_path))
+  client = fetch.CachedClient(str(tmp_path))
+  reads = []
+  get_forum = client.cache.get_forum
+  monkeypatch.setattr(client.cache, "get_forum",
+      lambda forum_id: reads.append(forum_id) or get_forum(forum_id))
+  for offset in range(5):
+    client.get_notes(invitation=INVITATION, offset=offset, limit=1)
+  assert sorted(reads) == ["f0", "f1", "f2", "f3", "f4"]
@@ -0,0 +1,64 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import lib.instrument as instrument
+
+
+@pytest.fixture
+def recording(monkeypatch):
+  state = instrument._State()
+  state.enabled = True
+  state.start = time.perf_counter()
+  monkeypatch.setattr(instrument, "_state", state)
+  return state
+
+
+def test_recursive_stage_times_each_level(recording):
+  @instrument.stage("walk")
+  def walk(depth):
+    time.sleep(0.01)
+    if depth:
+      walk(depth - 1)
+
+  walk(2)
+  stages = {path: seconds for path, (_, seconds) in recording.stages.items()}
+  assert set(stages) == {("walk",), ("walk",) * 2, ("walk",) * 3}
+  assert stages[("walk",)] >= 0.03
+  assert stages[("walk",) * 2] >= 0.02
+  assert stages[("walk",) * 3] >= 0.01
+
+
+def test_threads_share_a_stage_object(recording):
+  shared = instrument.stage("work")
+
+  def work(seconds):
+    with shared:
+      time.sleep(seconds)
+
+  threads = [threading.Thread(target=work, args=(0.05 * (i + 1),))
+      for i in range(3)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  calls, seconds = recording.stages[("work",)]
+  assert calls == 3
+  assert 0.3 <= seconds < 0.5
+
+
+def test_python_between_fetches_is_not_sql(recording):
+  conn = instrument.instrument_connection(sqlite3.connect(":memory:"))
+  cur = conn.cursor()
+  cur.execute("CREATE TABLE t (x integer)")
+  cur.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(5)])
+  with instrument.stage("scan"):
+    for _ in cur.execute("SELECT x FROM t WHERE x > 1"):
+      time.sleep(0.02)
+  executions, seconds = recording.sql[(("scan",),
+    "SELECT x FROM t WHERE x > ?")]
+  assert executions == 1
+  assert seconds < 0.02
+  assert recording.sql[((), "INSERT INTO t VALUES (?)")][0] == 1
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+import lib.karp_rabin as kr
+
+WINDOWS = [(1,), (2, 3), (2, 4, 7), (5,)]
+
+
+def random_chunks(rng, vocab, max_chunks=3, max_tokens=12):
+  """Chunks of sentences of tokens drawn from a small vocabulary."""
+  chunks = []
+  for _ in range(rng.randint(0, max_chunks)):
+    tokens = [rng.choice(vocab) for _ in range(rng.randint(0, max_tokens))]
+    cut = rng.randint(0, len(tokens))
+    chunks.append([tokens[:cut], tokens[cut:]])
+  return chunks
+
+
+def common_prefix(tokens_1, offset_1, tokens_2, offset_2):
+  length = 0
+  while (offset_1 + length < len(tokens_1)
+      and offset_2 + length < len(tokens_2)
+      and tokens_1[offset_1 + length] == tokens_2[offset_2 + length]):
+    length += 1
+  return length
+
+
+def reference_matches(rebuttal, review, windows):
+  """find_matches_multi by comparing every pair of offsets.
+
+  Seeds start anywhere but the final window of a chunk, and each is extended
+  as far right as the chunks agree. A match is dropped if its text is part of
+  the previous match of its window.
+  """
+  (review_id, review_chunks), = review.items()
+  (rebuttal_id, rebuttal_chunks), = rebuttal.items()
+  review_tokens = kr.flatten_chunks(review_chunks)
+  rebuttal_tokens = kr.flatten_chunks(rebuttal_chunks)
+  matches = {window: [] for window in windows}
+  for i, review_chunk in enumerate(review_tokens):
+    for j, rebuttal_chunk in enumerate(rebuttal_tokens):
+      for review_offset in range(len(review_chunk)):
+        for rebuttal_offset in range(len(rebuttal_chunk)):
+          length = common_prefix(review_chunk, review_offset, rebuttal_chunk,
+              rebuttal_offset)
+          lcs = " ".join(review_chunk[review_offset:review_offset + length])
+          for window in windows:
+            if (length < window
+                or review_offset >= len(review_chunk) - window
+                or rebuttal_offset >= len(rebuttal_chunk) - window):
+              continue
+            if matches[window] and lcs in matches[window][-1].lcs:
+              continue
+            matches[window].append(kr.Match(
+              kr.Location(review_id, i, review_offset),
+              kr.Location(rebuttal_id, j, rebuttal_offset), lcs))
+  return matches
+
+
+@pytest.mark.parametrize("windows", WINDOWS)
+def test_matches_brute_force_on_random_text(windows):
+  rng = random.Random(sum(windows))
+  for _ in range(200):
+    vocab = "abcd"[:rng.randint(1, 4)]
+    review = {"review": random_chunks(rng, vocab)}
+    rebuttal = {"rebuttal": random_chunks(rng, vocab)}
+    matches = kr.find_matches_multi(rebuttal, review, windows)
+    assert matches == reference_matches(rebuttal, review, windows)
+    for window in windows:
+      assert matches[window] == kr.find_matches(rebuttal, review, window)
+
+
+@pytest.mark.parametrize("windows", WINDOWS)
+def test_edge_cases(windows):
+  identical = {"review": [[["a"] * 6], [["a"] * 3, ["a"] * 6]]}
+  other = {"rebuttal": [[["a"] * 8]]}
+  for review, rebuttal in [({"review": []}, other),
+      ({"review": [[[]]]}, other), ({"review": [[["a"]]]}, {"rebuttal": []}),
+      (identical, other)]:
+    assert kr.find_matches_multi(rebuttal, review, windows) == (
+        reference_matches(rebuttal, review, windows))
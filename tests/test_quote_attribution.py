@@ -0,0 +1,58 @@
+import lib.db_lib as dbl
+import lib.karp_rabin as kr
+
+import quote_attribution
+
+COLUMNS = ("forum_id split comment_supernote parent_supernote comment_type "
+    "author author_type chunk_idx sentence_idx token").split()
+
+REVIEW = [["the method is not compared with any strong baseline at all".split(),
+  "also the writing is unclear".split()],
+  ["figure two has no axis labels".split()]]
+REBUTTAL = [["you say the method is not compared with any strong baseline "
+  "so we added two".split()]]
+METAREVIEW = [["reviewers agree figure two has no axis labels and".split(),
+  "the method is not compared with any strong baseline".split()]]
+COMMENT = [["nice paper".split()]]
+
+
+def text_rows(forum_id, supernote, parent, comment_type, chunks):
+  return [(forum_id, "train", supernote, parent, comment_type, "a", "x",
+    chunk_idx, sentence_idx, token)
+    for chunk_idx, chunk in enumerate(chunks)
+    for sentence_idx, sentence in enumerate(chunk) for token in sentence]
+
+
+def make_db(db_file):
+  conn = dbl.open_connection(db_file)
+  for table_name in dbl.TextTables.ALL:
+    conn.execute("CREATE TABLE {0} ({1})".format(table_name,
+      ", ".join(COLUMNS)))
+  insert = "INSERT INTO {0} VALUES (" + ", ".join("?" for _ in COLUMNS) + ")"
+  conn.executemany(insert.format(dbl.TextTables.TRAIN_DEV),
+      text_rows("f", "r0", "f", "review", REVIEW) +
+      text_rows("f", "b0", "r0", "rebuttal", REBUTTAL))
+  conn.executemany(insert.format(dbl.TextTables.UNSTRUCTURED),
+      text_rows("f", "m0", "f", "metareview", METAREVIEW) +
+      text_rows("f", "c0", "f", "comment", COMMENT))
+  conn.commit()
+  return conn
+
+
+def stored_quotes(conn, table_name):
+  return [(row["comment_supernote"], row["review_supernote"], row["lcs"])
+      for row in conn.execute("SELECT * FROM {0} ORDER BY rowid".format(
+        table_name + "_quotes"))]
+
+
+def test_unstructured_comments_are_matched_against_forum_reviews(tmp_path):
+  conn = make_db(str(tmp_path / "q.db"))
+  quote_attribution.attribute_split(conn, "train", kr.WINDOW, 100)
+
+  expected = [("m0", "r0", match.lcs) for match in kr.find_matches(
+    {"m0": METAREVIEW}, {"r0": REVIEW})]
+  assert expected
+  assert stored_quotes(conn, dbl.TextTables.UNSTRUCTURED) == expected
+  assert stored_quotes(conn, dbl.TextTables.TRAIN_DEV) == [
+      ("b0", "r0", match.lcs) for match in kr.find_matches(
+        {"b0": REBUTTAL}, {"r0": REVIEW})]
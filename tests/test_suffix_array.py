@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+import lib.karp_rabin as kr
+import lib.suffix_array as sa
+
+WINDOWS = [(1,), (2, 3), (2, 4, 7), (5,)]
+
+
+def random_chunks(rng, vocab, max_chunks=3, max_tokens=12):
+  """Chunks of sentences of tokens drawn from a small vocabulary."""
+  chunks = []
+  for _ in range(rng.randint(0, max_chunks)):
+    tokens = [rng.choice(vocab) for _ in range(rng.randint(0, max_tokens))]
+    cut = rng.randint(0, len(tokens))
+    chunks.append([tokens[:cut], tokens[cut:]])
+  return chunks
+
+
+def reference_matches(rebuttal, review, windows):
+  """Every maximal match of at least each window, by comparing all offsets.
+
+  A match cannot be extended left (it starts a chunk or the preceding tokens
+  differ) or right (it ends a chunk or the following tokens differ).
+  """
+  (review_id, review_chunks), = review.items()
+  (rebuttal_id, rebuttal_chunks), = rebuttal.items()
+  review_tokens = kr.flatten_chunks(review_chunks)
+  rebuttal_tokens = kr.flatten_chunks(rebuttal_chunks)
+  found = []
+  for i, review_chunk in enumerate(review_tokens):
+    for j, rebuttal_chunk in enumerate(rebuttal_tokens):
+      for review_offset in range(len(review_chunk)):
+        for rebuttal_offset in range(len(rebuttal_chunk)):
+          if (review_offset and rebuttal_offset
+              and review_chunk[review_offset - 1]
+              == rebuttal_chunk[rebuttal_offset - 1]):
+            continue
+          length = 0
+          while (review_offset + length < len(review_chunk)
+              and rebuttal_offset + length < len(rebuttal_chunk)
+              and review_chunk[review_offset + length]
+              == rebuttal_chunk[rebuttal_offset + length]):
+            length += 1
+          if length:
+            found.append((kr.Match(kr.Location(review_id, i, review_offset),
+              kr.Location(rebuttal_id, j, rebuttal_offset), " ".join(
+                review_chunk[review_offset:review_offset + length])),
+              length))
+  found.sort()
+  return {window: [match for match, length in found if length >= window]
+      for window in windows}
+
+
+@pytest.mark.parametrize("windows", WINDOWS)
+def test_matches_brute_force_on_random_text(windows):
+  rng = random.Random(sum(windows))
+  for _ in range(200):
+    vocab = "abcd"[:rng.randint(1, 4)]
+    review = {"review": random_chunks(rng, vocab)}
+    rebuttal = {"rebuttal": random_chunks(rng, vocab)}
+    matches = sa.find_matches_multi(rebuttal, review, windows)
+    assert matches == reference_matches(rebuttal, review, windows)
+    for window in windows:
+      assert matches[window] == sa.find_matches(rebuttal, review, window)
+
+
+@pytest.mark.parametrize("windows", WINDOWS)
+def test_edge_cases(windows):
+  identical = {"review": [[["a"] * 6], [["a"] * 3, ["a"] * 6]]}
+  other = {"rebuttal": [[["a"] * 8]]}
+  for review, rebuttal in [({"review": []}, other),
+      ({"review": [[[]]]}, other), ({"review": [[["a"]]]}, {"rebuttal": []}),
+      (identical, other)]:
+    assert sa.find_matches_multi(rebuttal, review, windows) == (
+        reference_matches(rebuttal, review, windows))
@@ -0,0 +1,63 @@
+import random
+import sqlite3
+
+import pytest
+
+import lib.schema as schema
+import lib.summary as summary
+
+COLUMNS = ("forum_id split comment_supernote parent_supernote comment_type "
+    "author author_type chunk_idx sentence_idx token").split()
+
+
+def token_rows(comment, with_token_idx):
+  rows = []
+  for chunk_idx, chunk in enumerate(comment["chunks"]):
+    for sentence_idx, length in enumerate(chunk):
+      for token_idx in range(length):
+        row = ["f", "train", comment["id"], "None", "review", "a", "reviewer",
+            chunk_idx, sentence_idx, "t{0}".format(token_idx)]
+        rows.append(row + [token_idx] if with_token_idx else row)
+  return rows
+
+
+def summary_rows(cur, table_name):
+  return sorted(cur.execute("SELECT * FROM {0}".format(
+    summary.summary_table(table_name))).fetchall())
+
+
+@pytest.mark.parametrize("with_token_idx", [True, False])
+def test_triggers_match_rebuild(with_token_idx):
+  rng = random.Random(0)
+  conn = sqlite3.connect(":memory:")
+  cur = conn.cursor()
+  columns = COLUMNS + (["token_idx"] if with_token_idx else [])
+  cur.execute("CREATE TABLE t ({0})".format(", ".join(columns)))
+  schema.create_indexes(cur, "t", schema.text_table_indexes("t"))
+  summary.install_triggers(cur, "t")
+
+  insert = "INSERT INTO t ({0}) VALUES ({1})".format(", ".join(columns),
+      ", ".join("?" for _ in columns))
+  comments = [{"id": "c{0}".format(i), "chunks": [[rng.randint(1, 5)
+    for _ in range(rng.randint(1, 3))] for _ in range(rng.randint(1, 4))]}
+    for i in range(20)]
+  for comment in comments:
+    cur.executemany(insert, token_rows(comment, with_token_idx))
+  cur.execute("DELETE FROM t WHERE comment_supernote IN ('c3', 'c4')")
+  cur.execute("DELETE FROM t WHERE comment_supernote = 'c5' AND chunk_idx = 0")
+  triggered = summary_rows(cur, "t")
+
+  summary.rebuild(cur, "t")
+  assert triggered == summary_rows(cur, "t")
+  assert [row[0] for row in triggered if row[0] in ("c3", "c4")] == []
+
+
+def test_install_triggers_indexes_the_lookup():
+  conn = sqlite3.connect(":memory:")
+  cur = conn.cursor()
+  cur.execute("CREATE TABLE t ({0})".format(", ".join(COLUMNS)))
+  summary.install_triggers(cur, "t")
+  plan = " ".join(row[-1] for row in cur.execute(
+    "EXPLAIN QUERY PLAN SELECT 1 FROM t WHERE comment_supernote = 'c' "
+    "AND chunk_idx = 0 AND sentence_idx = 0"))
+  assert "t_supernote_idx" in plan
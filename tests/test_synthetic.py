@@ -0,0 +1,22 @@
+import sqlite3
+
+import lib.synthetic as synthetic
+
+
+def dump(db_file):
+  conn = sqlite3.connect(db_file)
+  try:
+    return list(conn.iterdump())
+  finally:
+    conn.close()
+
+
+def test_same_seed_gives_identical_db(tmp_path):
+  files = [str(tmp_path / name) for name in ("a.db", "b.db", "c.db")]
+  counts = [synthetic.generate(files[0], 12, seed=3, annotated_pairs=5),
+      synthetic.generate(files[1], 12, seed=3, annotated_pairs=5)]
+  assert counts[0] == counts[1]
+  assert dump(files[0]) == dump(files[1])
+
+  synthetic.generate(files[2], 12, seed=4, annotated_pairs=5)
+  assert dump(files[0]) != dump(files[2])
@@ -0,0 +1,66 @@
+import lib.tokenization as tok
+
+import stand_in_servers
+
+TEXTS = ["Doc {0} says hello. It has two sentences!".format(i)
+    for i in range(40)] + ["", "Unicode \U0001f600 offsets work. Yes."]
+
+
+def expected(text):
+  return [[word for _, word in sentence]
+      for sentence in stand_in_servers.whitespace_sentences(text)]
+
+
+def test_tokenize_many_unpacks_batched_documents(tmp_path):
+  with stand_in_servers.corenlp() as server:
+    with tok.TokenizerPool([server.url], cache_dir=str(tmp_path),
+        batch_chars=200) as pool:
+      assert pool.tokenize_many(TEXTS) == [expected(text) for text in TEXTS]
+    assert 1 < server.requests < len(TEXTS)
+
+
+def test_cache_avoids_requests(tmp_path):
+  with stand_in_servers.corenlp() as server:
+    with tok.TokenizerPool([server.url], cache_dir=str(tmp_path)) as pool:
+      pool.tokenize_many(TEXTS)
+    requests = server.requests
+    with tok.TokenizerPool([server.url], cache_dir=str(tmp_path)) as pool:
+      assert pool.tokenize_many(TEXTS) == [expected(text) for text in TEXTS]
+    assert server.requests == requests
+
+
+class _Client(object):
+
+  def __init__(self, notes):
+    self.notes = notes
+
+  def get_notes(self, forum=None):
+    return [note for note in self.notes if note["forum"] == forum]
+
+
+def test_prefetching_client_keeps_requests_in_flight():
+  # Ingest reads a forum's notes, then annotates them one at a time.
+  notes = [{"forum": "f", "content": {"review": text}} for text in TEXTS]
+  with stand_in_servers.corenlp(delay=0.05) as server:
+    with tok.TokenizerPool([server.url], batch_chars=60,
+        max_in_flight=4) as pool:
+      client = tok.PrefetchingClient(_Client(notes), pool)
+      conll = [pool.annotate(note["content"]["review"])
+          for note in client.get_notes(forum="f")]
+    assert server.max_in_flight == 4
+  assert conll == [tok.to_conll(expected(text)) for text in TEXTS]
+
+
+def test_prefetching_client_discards_unclaimed_texts():
+  notes = [{"forum": forum, "content": {"title": "Title " + forum,
+    "review": "Review of " + forum, "rating": "7: Accept"}}
+    for forum in ("f", "g")]
+  with stand_in_servers.corenlp() as server:
+    with tok.TokenizerPool([server.url]) as pool:
+      client = tok.PrefetchingClient(_Client(notes), pool)
+      client.get_notes(forum="f")
+      assert list(pool._in_flight) == ["Review of f"]
+      client.get_notes(forum="g")
+      assert list(pool._in_flight) == ["Review of g"]
+      pool.annotate("Review of g")
+      assert not pool._in_flight
@@ -0,0 +1,124 @@
+import argparse
+import difflib
+import itertools
+
+import lib.fetch as fetch
+import lib.ptb_tokenizer as ptb
+import lib.tokenization as tok
+
+parser = argparse.ArgumentParser(
+    description='Measure how closely the in-process PTB tokenizer agrees '
+    'with CoreNLP on the same raw OpenReview note text.')
+parser.add_argument('--note_cache', default="note_cache", type=str,
+    help='raw note cache written by build_or_db.py --fetch_invitation')
+parser.add_argument('-e', '--corenlp_endpoints', default=None, type=str,
+    help='comma-separated URLs of running CoreNLP servers; without them only '
+    'texts already in the tokenization cache are compared')
+parser.add_argument('-c', '--tokenization_cache', default="tok_cache",
+    type=str, help='directory of cached CoreNLP tokenizations')
+parser.add_argument('-n', '--limit', default=None, type=int,
+    help='compare at most this many texts')
+parser.add_argument('-w', '--workers', default=None, type=int,
+    help='tokenizer processes (default: one per CPU)')
+parser.add_argument('-v', '--verbose', action="store_true",
+    help='print every text that does not agree exactly')
+
+
+def get_texts(cache_dir, limit):
+  """Distinct non-blank text fields of every cached note."""
+  cache = fetch.NoteCache(cache_dir)
+  texts = (text for forum_id in cache.forum_ids()
+      for note in cache.get_forum(forum_id)
+      for text in tok.note_texts(note))
+  return list(itertools.islice(dict.fromkeys(texts), limit))
+
+
+def corenlp_sentences(texts, endpoints, cache_dir):
+  """(text, CoreNLP sentences) pairs.
+
+  Without endpoints, texts missing from the tokenization cache are skipped.
+  """
+  with tok.TokenizerPool(endpoints or [], cache_dir=cache_dir) as pool:
+    if endpoints:
+      return list(zip(texts, pool.tokenize_many(texts)))
+    return [(text, sentences) for text, sentences
+        in ((text, pool.cache.get(text)) for text in texts)
+        if sentences is not None]
+
+
+def boundaries(sentences):
+  ends, position = [], 0
+  for sentence in sentences:
+    position += len(sentence)
+    ends.append(position)
+  return ends
+
+
+def agreement(reference_docs, predicted_docs):
+  """Token, sentence and exact agreement rates over texts.
+
+  Each argument has the sentences of every text. Token agreement is the
+  fraction of reference tokens in the longest matching alignment with the
+  predicted tokens. Sentence agreement is over texts whose tokens agree
+  exactly.
+  """
+  reference_tokens = matched_tokens = 0
+  token_exact = fully_exact = 0
+  disagreements = []
+  for reference, predicted in zip(reference_docs, predicted_docs):
+    reference_flat = list(itertools.chain.from_iterable(reference))
+    predicted_flat = list(itertools.chain.from_iterable(predicted))
+    reference_tokens += len(reference_flat)
+    if reference_flat == predicted_flat:
+      matched_tokens += len(reference_flat)
+      token_exact += 1
+      if boundaries(reference) == boundaries(predicted):
+        fully_exact += 1
+        continue
+    else:
+      matcher = difflib.SequenceMatcher(None, reference_flat, predicted_flat,
+          autojunk=False)
+      matched_tokens += sum(block.size
+          for block in matcher.get_matching_blocks())
+    disagreements.append((reference, predicted))
+
+  num_docs = len(reference_docs)
+  return {
+      "texts": num_docs,
+      "token_agreement": matched_tokens / max(reference_tokens, 1),
+      "text_token_agreement": token_exact / max(num_docs, 1),
+      "sentence_agreement": fully_exact / max(token_exact, 1),
+      "text_agreement": fully_exact / max(num_docs, 1),
+  }, disagreements
+
+
+def main():
+
+  args = parser.parse_args()
+  texts = get_texts(args.note_cache, args.limit)
+  endpoints = (None if args.corenlp_endpoints is None
+      else args.corenlp_endpoints.split(","))
+  reference = corenlp_sentences(texts, endpoints, args.tokenization_cache)
+  if not reference:
+    print("No texts with a CoreNLP tokenization to compare against")
+    exit()
+  texts = [text for text, _ in reference]
+  reference_docs = [sentences for _, sentences in reference]
+  with ptb.PTBTokenizerPool(args.workers) as pool:
+    predicted_docs = pool.tokenize_many(texts)
+
+  results, disagreements = agreement(reference_docs, predicted_docs)
+  if args.verbose:
+    for reference, predicted in disagreements:
+      print("corenlp: " + " | ".join(" ".join(s) for s in reference))
+      print("ptb:     " + " | ".join(" ".join(s) for s in predicted))
+      print()
+  for key, value in results.items():
+    if isinstance(value, float):
+      print("{0}\t{1:.4f}".format(key, value))
+    else:
+      print("{0}\t{1}".format(key, value))
+
+
+if __name__ == "__main__":
+  main()